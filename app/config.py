@@ -16,6 +16,22 @@ from pathlib import Path
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 logger = logging.getLogger(__name__)
 
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean flag from the environment."""
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "y")
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    """Read a float setting from the environment."""
+    return float(os.getenv(name, str(default)))
+
+
 # Base directories
 PROJECT_ROOT: Path = Path(__file__).resolve().parents[1]
 VAR_DIR: Path = PROJECT_ROOT / "var"
@@ -23,20 +39,233 @@ VAR_DIR.mkdir(parents=True, exist_ok=True)
 
 # Telegram Bot settings
 BOT_TOKEN: str = os.getenv("BOT_TOKEN", "").strip()
+# Bot API base URL; empty means api.telegram.org (set it to a local server for testing)
+TELEGRAM_API_URL: str = os.getenv("TELEGRAM_API_URL", "").strip()
+
+# Update delivery: "polling" or "webhook". In webhook mode Telegram posts
+# updates to WEBHOOK_URL + WEBHOOK_PATH, served by an aiohttp app listening on
+# WEBAPP_HOST:WEBAPP_PORT. Updates that queued while the bot was down are
+# processed unless DROP_PENDING_UPDATES is set.
+BOT_MODE: str = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBAPP_HOST: str = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT: int = _env_int("WEBAPP_PORT", 8080)
+DROP_PENDING_UPDATES: bool = _env_bool("DROP_PENDING_UPDATES", False)
+
+# Webhook updates are handled by UPDATE_WORKERS workers; updates of one chat
+# run in arrival order. Once UPDATE_QUEUE_SIZE updates are waiting, new
+# webhook requests wait for room (Telegram then slows its delivery).
+UPDATE_WORKERS: int = _env_int("UPDATE_WORKERS", 16)
+UPDATE_QUEUE_SIZE: int = _env_int("UPDATE_QUEUE_SIZE", 1000)
+
+# Telegram user ids allowed to use admin commands (comma separated)
+ADMIN_IDS: frozenset = frozenset(
+    int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()
+)
 
 # Data files
 USERS_FILE_NAME: str = os.getenv("USERS_FILE", "users.json")
 USERS_FILE_PATH: Path = VAR_DIR / USERS_FILE_NAME
 
+# Write-behind persistence: mutations only mark users dirty and a background
+# task flushes them every USERS_FLUSH_INTERVAL seconds, or sooner once
+# USERS_FLUSH_THRESHOLD users are dirty.
+USERS_WRITE_BEHIND: bool = _env_bool("USERS_WRITE_BEHIND", True)
+USERS_FLUSH_INTERVAL: float = _env_float("USERS_FLUSH_INTERVAL", 2.0)
+USERS_FLUSH_THRESHOLD: int = _env_int("USERS_FLUSH_THRESHOLD", 500)
+
+# User storage backend: "json" (single users.json file), "journal" (users.json
+# snapshot plus append-only change journal), "lazy" (record-per-line store
+# loaded on demand) or "sqlite".
+USERS_STORAGE: str = os.getenv("USERS_STORAGE", "json").strip().lower()
+USERS_DB_NAME: str = os.getenv("USERS_DB", "users.db")
+USERS_DB_PATH: Path = VAR_DIR / USERS_DB_NAME
+
+# Journal backend: changes are appended to USERS_JOURNAL_PATH and compacted
+# into the users.json snapshot every USERS_JOURNAL_COMPACT_EVERY records.
+# With USERS_JOURNAL_FSYNC, records are fsynced in groups by a background task:
+# one fsync covers every record appended while the previous one ran, plus
+# those of the next USERS_JOURNAL_SYNC_INTERVAL seconds.
+USERS_JOURNAL_PATH: Path = VAR_DIR / os.getenv("USERS_JOURNAL", "users.journal")
+USERS_JOURNAL_COMPACT_EVERY: int = _env_int("USERS_JOURNAL_COMPACT_EVERY", 10000)
+USERS_JOURNAL_FSYNC: bool = _env_bool("USERS_JOURNAL_FSYNC", True)
+USERS_JOURNAL_SYNC_INTERVAL: float = _env_float("USERS_JOURNAL_SYNC_INTERVAL", 0.0)
+
+# Number of locks that per-user transactions are striped over.
+USERS_LOCK_STRIPES: int = _env_int("USERS_LOCK_STRIPES", 1024)
+
+# Lazy backend: one record per line in USERS_STORE_PATH, an offset index next
+# to it, and at most USERS_CACHE_SIZE decoded users kept in memory. With
+# USERS_STORE_FSYNC, appends are fsynced in groups like the journal's.
+USERS_STORE_PATH: Path = VAR_DIR / os.getenv("USERS_STORE", "users.jsonl")
+USERS_CACHE_SIZE: int = _env_int("USERS_CACHE_SIZE", 10000)
+USERS_STORE_FSYNC: bool = _env_bool("USERS_STORE_FSYNC", True)
+
+# Outbound Bot API calls that post to a chat are paced by token buckets: one
+# shared bucket (OUTBOUND_GLOBAL_RATE messages/s) and one per chat
+# (OUTBOUND_CHAT_RATE messages/s with bursts of OUTBOUND_CHAT_BURST). Calls
+# rejected with 429 are retried after retry_after, at most
+# OUTBOUND_MAX_RETRIES times.
+OUTBOUND_RATE_LIMIT: bool = _env_bool("OUTBOUND_RATE_LIMIT", True)
+OUTBOUND_GLOBAL_RATE: float = _env_float("OUTBOUND_GLOBAL_RATE", 30.0)
+OUTBOUND_CHAT_RATE: float = _env_float("OUTBOUND_CHAT_RATE", 1.0)
+OUTBOUND_CHAT_BURST: int = _env_int("OUTBOUND_CHAT_BURST", 3)
+OUTBOUND_MAX_RETRIES: int = _env_int("OUTBOUND_MAX_RETRIES", 3)
+
+# Incoming updates are throttled per user with token buckets (THROTTLE_*_RATE
+# tokens/s, bursts of THROTTLE_*_BURST): the "keys" bucket covers server
+# selections and key deletions, which create or revoke keys and rewrite the
+# user store; the "menu" bucket everything else. Admins are never throttled.
+THROTTLE_ENABLED: bool = _env_bool("THROTTLE_ENABLED", True)
+THROTTLE_KEYS_RATE: float = _env_float("THROTTLE_KEYS_RATE", 0.1)
+THROTTLE_KEYS_BURST: int = _env_int("THROTTLE_KEYS_BURST", 3)
+THROTTLE_MENU_RATE: float = _env_float("THROTTLE_MENU_RATE", 2.0)
+THROTTLE_MENU_BURST: int = _env_int("THROTTLE_MENU_BURST", 10)
+
+# Broadcasts send at most BROADCAST_RATE messages/s (below the global limit,
+# so replies to users keep flowing) and checkpoint their progress in
+# BROADCAST_DIR after every BROADCAST_BATCH_SIZE recipients.
+BROADCAST_DIR: Path = VAR_DIR / os.getenv("BROADCAST_DIR", "broadcasts")
+BROADCAST_RATE: float = _env_float("BROADCAST_RATE", 20.0)
+BROADCAST_BATCH_SIZE: int = _env_int("BROADCAST_BATCH_SIZE", 200)
+
+# Translations: languages without a key fall back along I18N_FALLBACKS
+# ("uz:ru,ru:en" means uz -> ru -> en) and finally to I18N_DEFAULT_LANG.
+# Catalog files are checked for changes every I18N_RELOAD_INTERVAL seconds
+# (0 disables hot reload).
+I18N_DEFAULT_LANG: str = os.getenv("I18N_DEFAULT_LANG", "en")
+I18N_FALLBACKS: str = os.getenv("I18N_FALLBACKS", "uz:ru,ru:en")
+I18N_RELOAD_INTERVAL: float = _env_float("I18N_RELOAD_INTERVAL", 5.0)
+
+# VPN servers offered to users: a JSON object of server id -> details under
+# var/ (written with placeholder servers when missing). The file is checked
+# for changes every SERVERS_RELOAD_INTERVAL seconds (0 disables reloading).
+SERVERS_FILE_PATH: Path = VAR_DIR / os.getenv("SERVERS_FILE", "servers.json")
+SERVERS_RELOAD_INTERVAL: float = _env_float("SERVERS_RELOAD_INTERVAL", 5.0)
+
+# Server health: every HEALTH_CHECK_INTERVAL seconds (0 disables checks) each
+# offered server gets a TCP (TLS for tls servers) connect probe that fails
+# after HEALTH_CHECK_TIMEOUT seconds, at most HEALTH_CHECK_CONCURRENCY at a
+# time. Stats cover the last HEALTH_WINDOW probes: a server is hidden after
+# HEALTH_DOWN_AFTER failed probes in a row and marked while its last probe
+# failed or its availability is below HEALTH_MIN_AVAILABILITY.
+HEALTH_CHECK_INTERVAL: float = _env_float("HEALTH_CHECK_INTERVAL", 30.0)
+HEALTH_CHECK_TIMEOUT: float = _env_float("HEALTH_CHECK_TIMEOUT", 3.0)
+HEALTH_CHECK_CONCURRENCY: int = _env_int("HEALTH_CHECK_CONCURRENCY", 10)
+HEALTH_WINDOW: int = _env_int("HEALTH_WINDOW", 10)
+HEALTH_DOWN_AFTER: int = _env_int("HEALTH_DOWN_AFTER", 3)
+HEALTH_MIN_AVAILABILITY: float = _env_float("HEALTH_MIN_AVAILABILITY", 0.8)
+
+# Key provisioning for servers with an "api_url": new and revoked keys are
+# written to the PROVISION_OUTBOX file and pushed to each server's management
+# API in batches of up to PROVISION_BATCH_SIZE, collected for
+# PROVISION_BATCH_INTERVAL seconds. Failed pushes are retried with
+# exponential backoff capped at PROVISION_MAX_BACKOFF seconds. A new key is
+# shown once active; if that takes longer than PROVISION_CONFIRM_TIMEOUT
+# seconds the user gets it in a later message.
+PROVISION_OUTBOX_PATH: Path = VAR_DIR / os.getenv("PROVISION_OUTBOX", "provisioning.jsonl")
+PROVISION_BATCH_SIZE: int = _env_int("PROVISION_BATCH_SIZE", 100)
+PROVISION_BATCH_INTERVAL: float = _env_float("PROVISION_BATCH_INTERVAL", 0.2)
+PROVISION_REQUEST_TIMEOUT: float = _env_float("PROVISION_REQUEST_TIMEOUT", 10.0)
+PROVISION_MAX_BACKOFF: float = _env_float("PROVISION_MAX_BACKOFF", 60.0)
+PROVISION_CONFIRM_TIMEOUT: float = _env_float("PROVISION_CONFIRM_TIMEOUT", 8.0)
+
+# "My keys" shows KEYS_PAGE_SIZE keys per page; rendered pages are kept for
+# the KEYS_PAGE_CACHE_USERS most recent users until their keys change.
+KEYS_PAGE_SIZE: int = _env_int("KEYS_PAGE_SIZE", 5)
+KEYS_PAGE_CACHE_USERS: int = _env_int("KEYS_PAGE_CACHE_USERS", 1000)
+
+# Prometheus metrics at http://METRICS_HOST:METRICS_PORT/metrics (port 0
+# disables the endpoint). Every update is counted; METRICS_SAMPLE_RATE of them
+# are also timed, split into storage, link generation and Bot API time.
+METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT: int = _env_int("METRICS_PORT", 9108)
+METRICS_SAMPLE_RATE: float = _env_float("METRICS_SAMPLE_RATE", 0.1)
+
+# Logging: LOG_FORMAT "text" or "json" (one object per line with user_id and
+# handler fields), written by a background thread unless LOG_ASYNC is off.
+# INFO records are kept for LOG_SAMPLE_RATE of the updates (all of an
+# update's records or none); warnings and errors always.
+LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text").lower()
+LOG_ASYNC: bool = _env_bool("LOG_ASYNC", True)
+LOG_SAMPLE_RATE: float = _env_float("LOG_SAMPLE_RATE", 1.0)
+
 # Feature flags / misc
-DEBUG: bool = os.getenv("DEBUG", "false").lower() in ("1", "true", "yes", "y")
+DEBUG: bool = _env_bool("DEBUG", False)
 
 __all__ = [
     "PROJECT_ROOT",
     "VAR_DIR",
     "BOT_TOKEN",
+    "TELEGRAM_API_URL",
+    "BOT_MODE",
+    "WEBHOOK_URL",
+    "WEBHOOK_PATH",
+    "WEBHOOK_SECRET",
+    "WEBAPP_HOST",
+    "WEBAPP_PORT",
+    "DROP_PENDING_UPDATES",
+    "UPDATE_WORKERS",
+    "UPDATE_QUEUE_SIZE",
+    "ADMIN_IDS",
     "USERS_FILE_NAME",
     "USERS_FILE_PATH",
+    "USERS_WRITE_BEHIND",
+    "USERS_FLUSH_INTERVAL",
+    "USERS_FLUSH_THRESHOLD",
+    "USERS_STORAGE",
+    "USERS_DB_NAME",
+    "USERS_DB_PATH",
+    "USERS_JOURNAL_PATH",
+    "USERS_JOURNAL_COMPACT_EVERY",
+    "USERS_JOURNAL_FSYNC",
+    "USERS_JOURNAL_SYNC_INTERVAL",
+    "USERS_LOCK_STRIPES",
+    "USERS_STORE_PATH",
+    "USERS_CACHE_SIZE",
+    "USERS_STORE_FSYNC",
+    "OUTBOUND_RATE_LIMIT",
+    "OUTBOUND_GLOBAL_RATE",
+    "OUTBOUND_CHAT_RATE",
+    "OUTBOUND_CHAT_BURST",
+    "OUTBOUND_MAX_RETRIES",
+    "THROTTLE_ENABLED",
+    "THROTTLE_KEYS_RATE",
+    "THROTTLE_KEYS_BURST",
+    "THROTTLE_MENU_RATE",
+    "THROTTLE_MENU_BURST",
+    "BROADCAST_DIR",
+    "BROADCAST_RATE",
+    "BROADCAST_BATCH_SIZE",
+    "I18N_DEFAULT_LANG",
+    "I18N_FALLBACKS",
+    "I18N_RELOAD_INTERVAL",
+    "SERVERS_FILE_PATH",
+    "SERVERS_RELOAD_INTERVAL",
+    "HEALTH_CHECK_INTERVAL",
+    "HEALTH_CHECK_TIMEOUT",
+    "HEALTH_CHECK_CONCURRENCY",
+    "HEALTH_WINDOW",
+    "HEALTH_DOWN_AFTER",
+    "HEALTH_MIN_AVAILABILITY",
+    "PROVISION_OUTBOX_PATH",
+    "PROVISION_BATCH_SIZE",
+    "PROVISION_BATCH_INTERVAL",
+    "PROVISION_REQUEST_TIMEOUT",
+    "PROVISION_MAX_BACKOFF",
+    "PROVISION_CONFIRM_TIMEOUT",
+    "KEYS_PAGE_SIZE",
+    "KEYS_PAGE_CACHE_USERS",
+    "METRICS_HOST",
+    "METRICS_PORT",
+    "METRICS_SAMPLE_RATE",
+    "LOG_LEVEL",
+    "LOG_FORMAT",
+    "LOG_ASYNC",
+    "LOG_SAMPLE_RATE",
     "DEBUG",
     "logger", # Added logger to __all__
 ]
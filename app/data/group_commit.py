@@ -0,0 +1,95 @@
+"""
+Group commit for append-only files.
+
+Writers call written() after appending (and flushing) records. Once start()
+has run, a background task fsyncs the file from a worker thread: one fsync
+covers every record written while the previous one ran, plus those of the
+next interval seconds, and wait() returns once the records written so far
+are on disk. Before start(), written() fsyncs synchronously.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommit:
+    """Fsyncs the file behind fileno() in groups; see the module docstring."""
+
+    def __init__(self, fileno: Callable[[], int], name: str, interval: float = 0.0):
+        # A callable, as owners reopen their file (e.g. on compaction)
+        self.fileno = fileno
+        self.name = name
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._requested: Optional[asyncio.Event] = None
+        # Resolves when the records written since the last sync are on disk
+        self._batch: Optional[asyncio.Future] = None
+
+    def start(self) -> None:
+        """Starts the sync task; must be called from a running event loop."""
+        if self._task is not None:
+            return
+        self._requested = asyncio.Event()
+        self._task = asyncio.create_task(self._sync_loop(), name=f"{self.name}-sync")
+
+    def written(self) -> None:
+        """Records that data was written; fsyncs right away until start() has run."""
+        if self._task is None:
+            os.fsync(self.fileno())
+        elif self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+            self._requested.set()
+
+    async def wait(self) -> None:
+        """Returns once the records written so far are fsynced."""
+        if self._batch is not None:
+            await asyncio.shield(self._batch)
+
+    def sync_now(self) -> None:
+        """Fsyncs pending records synchronously, e.g. before the file is closed or moved aside."""
+        batch, self._batch = self._batch, None
+        if batch is not None:
+            os.fsync(self.fileno())
+            batch.set_result(None)
+
+    async def stop(self) -> None:
+        """Stops the sync task after syncing what is pending; later writes fsync synchronously."""
+        task, self._task = self._task, None
+        if task is not None:
+            self._requested.set()
+            await task
+            await self._sync_batch()
+
+    async def _sync_loop(self) -> None:
+        while self._task is not None:
+            await self._requested.wait()
+            # Records written meanwhile join this batch
+            await asyncio.sleep(self.interval)
+            self._requested.clear()
+            await self._sync_batch()
+
+    async def _sync_batch(self) -> None:
+        batch, self._batch = self._batch, None
+        if batch is None:
+            return
+        # A duplicate descriptor stays valid if the owner closes the file meanwhile
+        fd = os.dup(self.fileno())
+        try:
+            await asyncio.to_thread(_fsync_and_close, fd)
+        except Exception as e:
+            logger.error("Syncing %s failed: %s", self.name, e, exc_info=True)
+            batch.set_exception(e)
+            batch.exception()  # logged above; waiters still get it
+        else:
+            batch.set_result(None)
+
+
+def _fsync_and_close(fd: int) -> None:
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import os
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from app.config import (
+    USERS_FILE_PATH,
+    USERS_JOURNAL_PATH,
+    USERS_JOURNAL_COMPACT_EVERY,
+    USERS_JOURNAL_FSYNC,
+    USERS_JOURNAL_SYNC_INTERVAL,
+)
+from app.data.group_commit import GroupCommit
+from app.data.user_data_manager import UserDataManager
+from app.data.user_record import UserRecord, user_to_json
+
+logger = logging.getLogger(__name__)
+
+
+class JournaledUserDataManager(UserDataManager):
+    """
+    UserDataManager that appends every change to a JSONL journal instead of
+    rewriting users.json.
+
+    users.json becomes a snapshot that is refreshed by compaction. Compaction
+    first rotates the journal to "<journal>.old", writes the snapshot, and
+    only then drops the rotated journal, so a crash at any point leaves a
+    snapshot plus journals that replay to the latest state.
+
+    With fsync, once start() has run, appends are fsynced in groups from a
+    worker thread instead of one fsync per change on the event loop;
+    wait_durable() returns when the records appended so far are synced.
+    """
+
+    def __init__(
+        self,
+        file_path: Path = USERS_FILE_PATH,
+        journal_path: Path = USERS_JOURNAL_PATH,
+        compact_every: int = USERS_JOURNAL_COMPACT_EVERY,
+        fsync: bool = USERS_JOURNAL_FSYNC,
+        sync_interval: float = USERS_JOURNAL_SYNC_INTERVAL,
+    ):
+        self.journal_path = Path(journal_path)
+        self.rotated_journal_path = self.journal_path.with_name(self.journal_path.name + ".old")
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._journal_records = 0
+        self._compaction_task: Optional[asyncio.Task] = None
+        self._group_commit = GroupCommit(lambda: self._journal.fileno(), f"journal {self.journal_path}", sync_interval)
+        # Journal replaces write-behind: each change is already a small append.
+        super().__init__(file_path, write_behind=False)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    def _load_users_data(self) -> Dict[str, UserRecord]:
+        """Loads the latest snapshot and replays the journal tail on top of it."""
+        data = super()._load_users_data()
+        for path in (self.rotated_journal_path, self.journal_path):
+            if os.path.exists(path):
+                replayed = self._replay(path, data)
+                self._journal_records += replayed
+                logger.info("Replayed %s journal records from %s.", replayed, path)
+        return data
+
+    @staticmethod
+    def _replay(path: Path, data: Dict[str, UserRecord]) -> int:
+        replayed = 0
+        valid_end = 0
+        with open(path, "rb") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.endswith(b"\n"):
+                    # A crash interrupted the last append; that change was never
+                    # acknowledged. Cut it off so new records start on a clean line.
+                    logger.warning("Dropping truncated record at %s:%s.", path, line_no)
+                    break
+                valid_end += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.error("Skipping corrupt journal record at %s:%s.", path, line_no)
+                    continue
+                user = data.get(record["u"])
+                if user is None:
+                    user = data[record["u"]] = UserRecord()
+                user.update(record["d"])
+                replayed += 1
+        if valid_end != os.path.getsize(path):
+            os.truncate(path, valid_end)
+        return replayed
+
+    def _mark_dirty(self, user_id: str, changes: Dict[str, Any]) -> None:
+        """Appends the change to the journal; compacts when it grows too long."""
+        line = json.dumps({"u": user_id, "d": user_to_json(changes)}, separators=(",", ":"))
+        self._journal.write(line + "\n")
+        self._journal.flush()
+        if self.fsync:
+            self._group_commit.written()
+        self._journal_records += 1
+        if self._journal_records >= self.compact_every:
+            self._schedule_compaction()
+
+    def _schedule_compaction(self) -> None:
+        if self._compaction_task is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.compact()
+            return
+        self._compaction_task = loop.create_task(self.compact_async())
+
+    def _rotate_journal(self) -> List[str]:
+        """Moves the live journal aside and returns the snapshot's members."""
+        self._group_commit.sync_now()
+        self._journal.close()
+        if os.path.exists(self.rotated_journal_path):
+            # A previous compaction did not finish; fold both journals together.
+            with open(self.rotated_journal_path, "a", encoding="utf-8") as rotated, open(
+                self.journal_path, "r", encoding="utf-8"
+            ) as live:
+                rotated.write(live.read())
+            os.unlink(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.rotated_journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal_records = 0
+        return self._encode_members()
+
+    def _finish_compaction(self, members: List[str]) -> None:
+        self._write_members(members)
+        os.unlink(self.rotated_journal_path)
+
+    def compact(self) -> None:
+        """Writes a fresh snapshot and drops the journal records it covers."""
+        self._finish_compaction(self._rotate_journal())
+        logger.info("Compacted journal into snapshot %s.", self.file_path)
+
+    async def compact_async(self) -> None:
+        """Like compact(), but writes the snapshot from a worker thread."""
+        try:
+            members = self._rotate_journal()
+            await asyncio.to_thread(self._finish_compaction, members)
+            logger.info("Compacted journal into snapshot %s.", self.file_path)
+        except Exception as e:
+            logger.error("Journal compaction failed: %s", e, exc_info=True)
+        finally:
+            self._compaction_task = None
+
+    def save_users_data(self) -> None:
+        """Saves user data by compacting the journal into a snapshot."""
+        self.compact()
+
+    async def start(self) -> None:
+        """Starts the group commit task when fsync is enabled."""
+        if self.fsync:
+            self._group_commit.start()
+
+    async def wait_durable(self) -> None:
+        """Returns once the records appended so far are fsynced (when fsync is enabled)."""
+        await self._group_commit.wait()
+
+    async def flush(self) -> None:
+        """Journal records are written as they happen; waits for their fsync."""
+        await self.wait_durable()
+
+    async def close(self) -> None:
+        """Syncs and waits for a running compaction, then compacts once more and closes the journal."""
+        await self._group_commit.stop()
+        if self._compaction_task is not None:
+            await self._compaction_task
+        if self._journal_records:
+            await self.compact_async()
+        self._journal.close()
+
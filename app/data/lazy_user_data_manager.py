@@ -0,0 +1,455 @@
+import json
+import logging
+import mmap
+import os
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from heapq import merge
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.config import USERS_FILE_PATH, USERS_STORE_PATH, USERS_CACHE_SIZE, USERS_STORE_FSYNC
+from app.data.group_commit import GroupCommit
+from app.data.user_record import UserRecord, user_order_key, user_to_json
+from app.data.transactions import UserTransactionMixin
+
+logger = logging.getLogger(__name__)
+
+_INDEX_VERSION = 1
+
+
+def _numeric_id(user_id: str) -> Optional[int]:
+    """Returns user_id as an int when it round-trips exactly (Telegram ids do)."""
+    if user_id.isdigit() and (user_id == "0" or not user_id.startswith("0")):
+        value = int(user_id)
+        if value < 2 ** 63:
+            return value
+    return None
+
+
+class _OffsetIndex:
+    """
+    user_id -> (record offset, language slot) map.
+
+    Users known at startup live in three parallel sorted arrays (16 bytes and
+    one byte per user); users written since then live in a small dict overlay
+    that is folded back into the arrays when the index is saved.
+    """
+
+    def __init__(self, ids: array, offsets: array, langs: array, lang_codes: List[str]):
+        self.ids = ids
+        self.offsets = offsets
+        self.langs = langs
+        self.lang_codes = lang_codes  # slot 0 means "no language stored"
+        self._lang_slots = {code: slot for slot, code in enumerate(lang_codes)}
+        self.overlay: Dict[str, Tuple[int, int]] = {}
+
+    @classmethod
+    def empty(cls) -> "_OffsetIndex":
+        return cls(array("q"), array("q"), array("B"), [""])
+
+    def lang_slot(self, lang: Optional[str]) -> int:
+        if not lang:
+            return 0
+        slot = self._lang_slots.get(lang)
+        if slot is None:
+            if len(self.lang_codes) >= 256:
+                raise ValueError("Too many distinct language codes for the lazy user index.")
+            slot = len(self.lang_codes)
+            self.lang_codes.append(lang)
+            self._lang_slots[lang] = slot
+        return slot
+
+    def _position(self, numeric: int) -> int:
+        i = bisect_left(self.ids, numeric)
+        if i < len(self.ids) and self.ids[i] == numeric:
+            return i
+        return -1
+
+    def get(self, user_id: str) -> Optional[Tuple[int, int]]:
+        hit = self.overlay.get(user_id)
+        if hit is not None:
+            return hit
+        numeric = _numeric_id(user_id)
+        if numeric is None:
+            return None
+        i = self._position(numeric)
+        if i < 0:
+            return None
+        return self.offsets[i], self.langs[i]
+
+    def set(self, user_id: str, offset: int, lang_slot: int) -> None:
+        numeric = _numeric_id(user_id)
+        if numeric is not None:
+            i = self._position(numeric)
+            if i >= 0:
+                # Known user: update in place, no overlay entry needed.
+                self.offsets[i] = offset
+                self.langs[i] = lang_slot
+                return
+        self.overlay[user_id] = (offset, lang_slot)
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self.overlay)
+
+    def user_ids(self) -> Iterator[str]:
+        for numeric in self.ids:
+            yield str(numeric)
+        yield from self.overlay
+
+    def entries(self) -> Iterator[Tuple[str, int, int]]:
+        for numeric, offset, lang in zip(self.ids, self.offsets, self.langs):
+            yield str(numeric), offset, lang
+        for user_id, (offset, lang) in self.overlay.items():
+            yield user_id, offset, lang
+
+    @classmethod
+    def from_entries(cls, entries: Dict[str, Tuple[int, int]], lang_codes: List[str]) -> "_OffsetIndex":
+        numeric_entries = []
+        overlay = {}
+        for user_id, entry in entries.items():
+            numeric = _numeric_id(user_id)
+            if numeric is None:
+                overlay[user_id] = entry
+            else:
+                numeric_entries.append((numeric, entry))
+        numeric_entries.sort()
+        index = cls(
+            array("q", (numeric for numeric, _ in numeric_entries)),
+            array("q", (offset for _, (offset, _) in numeric_entries)),
+            array("B", (lang for _, (_, lang) in numeric_entries)),
+            lang_codes,
+        )
+        index.overlay = overlay
+        return index
+
+    def frozen(self) -> "_OffsetIndex":
+        """Returns an equivalent index with numeric overlay entries folded into the arrays."""
+        if not any(_numeric_id(user_id) is not None for user_id in self.overlay):
+            return self
+        entries = {user_id: (offset, lang) for user_id, offset, lang in self.entries()}
+        return _OffsetIndex.from_entries(entries, self.lang_codes)
+
+
+class LazyUserDataManager(UserTransactionMixin):
+    """
+    UserDataManager for large user bases that loads users on demand.
+
+    Users are stored one record per line ("<user_id>\\t<lang>\\t<json>\\n") in
+    an append-only file; an update appends a fresh line and the offset index
+    points at the newest one. Startup only loads the index (or rebuilds it by
+    scanning line prefixes), records are faulted in through mmap into a
+    bounded LRU cache, and get_lang is answered from the index alone.
+
+    With fsync, appends are fsynced (in groups from a worker thread once
+    start() has run) and wait_durable() returns when they are on disk. The
+    index needs no fsync: records past the size it was saved at are scanned
+    again on startup.
+    """
+
+    def __init__(
+        self,
+        store_path: Path = USERS_STORE_PATH,
+        cache_size: int = USERS_CACHE_SIZE,
+        legacy_json_path: Optional[Path] = USERS_FILE_PATH,
+        fsync: bool = USERS_STORE_FSYNC,
+    ):
+        self.store_path = Path(store_path)
+        self.index_path = self.store_path.with_name(self.store_path.name + ".idx")
+        self.cache_size = cache_size
+        self.fsync = fsync
+        self._cache: "OrderedDict[str, UserRecord]" = OrderedDict()
+        self._dead_bytes = 0
+        self._mm: Optional[mmap.mmap] = None
+        # Compaction replaces the store file, so the index remembers which file it describes.
+        self._index_inode: Optional[int] = None
+
+        if not self.store_path.exists() and legacy_json_path and os.path.exists(legacy_json_path):
+            self._import_json(Path(legacy_json_path))
+        self.store_path.touch(exist_ok=True)
+        self._index = self._load_index()
+        self._fh = open(self.store_path, "ab")
+        self._reader = open(self.store_path, "rb")
+        self._store_size = self._fh.tell()
+        self._group_commit = GroupCommit(lambda: self._fh.fileno(), f"user store {self.store_path}")
+
+    # ---- index ---------------------------------------------------------
+
+    def _load_index(self) -> _OffsetIndex:
+        store_size = os.path.getsize(self.store_path)
+        index, indexed_size = self._read_index_file()
+        if index is None or indexed_size > store_size or self._index_inode != os.stat(self.store_path).st_ino:
+            logger.info("Building user index for %s from scratch.", self.store_path)
+            index, indexed_size = _OffsetIndex.empty(), 0
+            self._dead_bytes = 0
+        if indexed_size < store_size:
+            # Records appended after the index was last saved.
+            scanned = self._scan(index, indexed_size)
+            logger.info("Indexed %s records from %s.", scanned, self.store_path)
+        logger.info("User index ready: %s users in %s.", len(index), self.store_path)
+        return index
+
+    def _read_index_file(self) -> Tuple[Optional[_OffsetIndex], int]:
+        if not self.index_path.exists():
+            return None, 0
+        try:
+            with open(self.index_path, "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("version") != _INDEX_VERSION:
+                    return None, 0
+                count = header["count"]
+                ids, offsets, langs = array("q"), array("q"), array("B")
+                ids.fromfile(f, count)
+                offsets.fromfile(f, count)
+                langs.fromfile(f, count)
+            index = _OffsetIndex(ids, offsets, langs, header["langs"])
+            for user_id, (offset, lang) in header["extra"].items():
+                index.overlay[user_id] = (offset, lang)
+            self._dead_bytes = header.get("dead_bytes", 0)
+            self._index_inode = header["inode"]
+            return index, header["store_size"]
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            logger.warning("Ignoring unreadable user index %s: %s", self.index_path, e)
+            return None, 0
+
+    def _scan(self, index: _OffsetIndex, start: int) -> int:
+        """Indexes records from byte offset start to the end of the store."""
+        scanned = 0
+        entries: Dict[str, Tuple[int, int]] = {}
+        with open(self.store_path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    logger.warning("Dropping truncated record at offset %s in %s.", offset, self.store_path)
+                    os.truncate(self.store_path, offset)
+                    break
+                try:
+                    user_id, lang, _ = line.split(b"\t", 2)
+                    user_id, lang = user_id.decode(), lang.decode()
+                except ValueError:
+                    # E.g. a zero-filled tail left by a crash; compaction drops it
+                    logger.error("Skipping corrupt record at offset %s in %s.", offset, self.store_path)
+                    self._dead_bytes += len(line)
+                    offset += len(line)
+                    continue
+                if user_id in entries or index.get(user_id) is not None:
+                    self._dead_bytes += len(line)
+                entries[user_id] = (offset, index.lang_slot(lang))
+                offset += len(line)
+                scanned += 1
+        if start == 0:
+            fresh = _OffsetIndex.from_entries(entries, index.lang_codes)
+            index.ids, index.offsets, index.langs = fresh.ids, fresh.offsets, fresh.langs
+            index.overlay = fresh.overlay
+        else:
+            for user_id, (offset, lang) in entries.items():
+                index.set(user_id, offset, lang)
+        return scanned
+
+    def _save_index(self) -> None:
+        self._index = self._index.frozen()
+        index = self._index
+        header = {
+            "version": _INDEX_VERSION,
+            "store_size": self._store_size,
+            "dead_bytes": self._dead_bytes,
+            "inode": os.fstat(self._fh.fileno()).st_ino,
+            "count": len(index.ids),
+            "langs": index.lang_codes,
+            "extra": index.overlay,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.index_path.parent, prefix=".users-idx-", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            index.ids.tofile(f)
+            index.offsets.tofile(f)
+            index.langs.tofile(f)
+        os.replace(tmp_path, self.index_path)
+        logger.info("Saved user index %s (%s users).", self.index_path, len(index))
+
+    # ---- records -------------------------------------------------------
+
+    @staticmethod
+    def _encode(user_id: str, data: Any) -> bytes:
+        lang = data.get("lang") or ""
+        if not (isinstance(lang, str) and lang.isprintable() and "\t" not in lang):
+            # Only the JSON part is authoritative; keep the line prefix parseable.
+            lang = ""
+        return f"{user_id}\t{lang}\t{json.dumps(user_to_json(data), separators=(',', ':'))}\n".encode()
+
+    def _read_line(self, offset: int) -> bytes:
+        if self._mm is None or offset >= len(self._mm):
+            # The store only grows by appends; remap to see the new tail.
+            if self._mm is not None:
+                self._mm.close()
+            self._mm = mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ)
+        end = self._mm.find(b"\n", offset)
+        return self._mm[offset:end + 1]
+
+    def _read_record(self, offset: int) -> UserRecord:
+        return UserRecord.from_dict(json.loads(self._read_line(offset).split(b"\t", 2)[2]))
+
+    def _cache_put(self, user_id: str, data: UserRecord) -> None:
+        self._cache[user_id] = data
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _append(self, user_id: str, data: UserRecord) -> None:
+        previous = self._index.get(user_id)
+        if previous is not None:
+            self._dead_bytes += len(self._read_line(previous[0]))
+        line = self._encode(user_id, data)
+        offset = self._store_size
+        self._fh.write(line)
+        self._fh.flush()
+        if self.fsync:
+            self._group_commit.written()
+        self._store_size += len(line)
+        self._index.set(user_id, offset, self._index.lang_slot(data.get("lang")))
+
+    def _load(self, user_id: str) -> Optional[UserRecord]:
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            self._cache.move_to_end(user_id)
+            return cached
+        entry = self._index.get(user_id)
+        if entry is None:
+            return None
+        data = self._read_record(entry[0])
+        self._cache_put(user_id, data)
+        return data
+
+    def _import_json(self, json_path: Path) -> None:
+        logger.info("Importing %s into %s.", json_path, self.store_path)
+        with open(json_path, "r") as f:
+            users = json.load(f)
+        with open(self.store_path, "wb") as f:
+            for user_id, data in users.items():
+                f.write(self._encode(user_id, data))
+
+    # ---- UserDataManager surface ----------------------------------------
+
+    def get_user_data(self, user_id: str) -> UserRecord:
+        """Returns data for a specific user (an empty, detached record if unknown)."""
+        data = self._load(user_id)
+        return data if data is not None else UserRecord()
+
+    def update_user_data(self, user_id: str, data: Dict[str, Any]) -> None:
+        """Updates data for a specific user by appending its new record."""
+        current = self._load(user_id)
+        merged = current.copy() if current is not None else UserRecord()
+        merged.update(data)
+        self._append(user_id, merged)
+        self._cache_put(user_id, merged)
+
+    def get_all_users_data(self) -> Dict[str, UserRecord]:
+        """
+        Returns all users data. This decodes every record and is meant for
+        maintenance tasks, not for request handling.
+        """
+        return {user_id: self.get_user_data(user_id) for user_id in self._index.user_ids()}
+
+    def count_users(self) -> int:
+        """Returns the number of stored users."""
+        return len(self._index)
+
+    def iter_users(self, after: Optional[str] = None) -> Iterator[Tuple[str, Optional[str]]]:
+        """
+        Yields (user_id, lang) in user_order_key order, starting after the
+        given user. Answered from the index; no record is decoded.
+        """
+        index = self._index
+        lang_codes = index.lang_codes
+        after_key = user_order_key(after) if after is not None else None
+        numeric_after = _numeric_id(after) if after is not None else None
+        start = bisect_right(index.ids, numeric_after) if numeric_after is not None else 0
+
+        def from_arrays() -> Iterator[Tuple[str, Optional[str]]]:
+            # Canonical numeric ids in ascending order already follow user_order_key
+            for i in range(start, len(index.ids)):
+                yield str(index.ids[i]), lang_codes[index.langs[i]] or None
+
+        overlay = sorted(
+            (
+                (user_id, lang_codes[slot] or None)
+                for user_id, (_, slot) in list(index.overlay.items())
+                if after_key is None or user_order_key(user_id) > after_key
+            ),
+            key=lambda entry: user_order_key(entry[0]),
+        )
+        for user_id, lang in merge(from_arrays(), overlay, key=lambda entry: user_order_key(entry[0])):
+            if after_key is None or numeric_after is not None or user_order_key(user_id) > after_key:
+                yield user_id, lang
+
+    def get_lang(self, user_id: str, default: str = "en") -> str:
+        """Return user's language code from the index, defaulting to 'en'."""
+        entry = self._index.get(user_id)
+        if entry is None or entry[1] == 0:
+            return default
+        return self._index.lang_codes[entry[1]]
+
+    def set_lang(self, user_id: str, lang_code: str) -> None:
+        """Set user's language code."""
+        self.update_user_data(user_id, {"lang": lang_code})
+
+    def compact(self) -> None:
+        """Rewrites the store with only the newest record of every user."""
+        tmp_path = self.store_path.with_name(self.store_path.name + ".compact")
+        entries: Dict[str, Tuple[int, int]] = {}
+        offset = 0
+        with open(tmp_path, "wb") as out:
+            for user_id, _, lang in self._index.entries():
+                line = self._encode(user_id, self.get_user_data(user_id))
+                out.write(line)
+                entries[user_id] = (offset, lang)
+                offset += len(line)
+            out.flush()
+            os.fsync(out.fileno())
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._group_commit.sync_now()
+        self._fh.close()
+        self._reader.close()
+        os.replace(tmp_path, self.store_path)
+        self._fh = open(self.store_path, "ab")
+        self._reader = open(self.store_path, "rb")
+        self._store_size = offset
+        self._dead_bytes = 0
+        self._index = _OffsetIndex.from_entries(entries, self._index.lang_codes)
+        self._save_index()
+        logger.info("Compacted %s to %s bytes.", self.store_path, offset)
+
+    def save_users_data(self) -> None:
+        """Records are appended as they change; this persists the index."""
+        self._fh.flush()
+        self._save_index()
+
+    async def start(self) -> None:
+        """Starts the group commit task when fsync is enabled."""
+        if self.fsync:
+            self._group_commit.start()
+
+    async def wait_durable(self) -> None:
+        """Returns once the records appended so far are fsynced (when fsync is enabled)."""
+        await self._group_commit.wait()
+
+    async def flush(self) -> None:
+        """Flushes appended records to the OS and waits for their fsync."""
+        self._fh.flush()
+        await self.wait_durable()
+
+    async def close(self) -> None:
+        """Compacts when more than half of the store is stale and saves the index."""
+        await self._group_commit.stop()
+        if self._dead_bytes * 2 > self._store_size:
+            self.compact()
+        self.save_users_data()
+        if self._mm is not None:
+            self._mm.close()
+        self._fh.close()
+        self._reader.close()
@@ -0,0 +1,39 @@
+"""
+One-shot migration of users.json into the SQLite user store.
+
+Usage:
+  pipenv run python -m app.data.migrate_json_to_sqlite [users.json] [users.db]
+
+Both paths default to the values in app/config.py. The JSON file is left
+untouched so the migration can be repeated or rolled back.
+"""
+
+import json
+import logging
+import sys
+from pathlib import Path
+
+from app.config import USERS_FILE_PATH, USERS_DB_PATH
+from app.data.sqlite_user_data_manager import SQLiteUserDataManager
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(json_path: Path = USERS_FILE_PATH, db_path: Path = USERS_DB_PATH) -> int:
+    """Copies every user from json_path into db_path and returns the user count."""
+    with open(json_path, "r") as f:
+        users = json.load(f)
+    store = SQLiteUserDataManager(db_path)
+    try:
+        count = store.import_users(users)
+    finally:
+        store.disconnect()
+    logger.info("Migrated %s users from %s to %s.", count, json_path, db_path)
+    return count
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    json_path = Path(args[0]) if len(args) > 0 else USERS_FILE_PATH
+    db_path = Path(args[1]) if len(args) > 1 else USERS_DB_PATH
+    migrate(json_path, db_path)
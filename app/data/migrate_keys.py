@@ -0,0 +1,82 @@
+"""
+One-shot migration of stored VPN links into compact StoredKey parameters.
+
+Usage:
+  pipenv run python -m app.data.migrate_keys
+
+Works on whichever backend USERS_STORAGE selects. Links whose server can be
+matched (by address and port) against app.services.servers are replaced by
+StoredKey tuples that render to an equivalent link; anything else is kept as
+the original string.
+"""
+
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import sys
+import uuid
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from app.data.storage import create_user_data_manager
+from app.data.vpn_keys import StoredKey, UserKey
+from app.services.servers import all_servers
+
+logger = logging.getLogger(__name__)
+
+
+def _servers_by_endpoint() -> Dict[Tuple[str, int], str]:
+    return {(server.address, server.port): server.id for server in all_servers()}
+
+
+def parse_legacy_link(link: str, servers: Dict[Tuple[str, int], str]) -> Optional[StoredKey]:
+    """Returns the StoredKey equivalent of a vmess:// or vless:// link, or None."""
+    try:
+        if link.startswith("vmess://"):
+            config = json.loads(base64.b64decode(link[len("vmess://"):]))
+            protocol, user_uuid, endpoint = "vmess", config["id"], (config["add"], int(config["port"]))
+        elif link.startswith("vless://"):
+            parts = urlsplit(link)
+            protocol, user_uuid, endpoint = "vless", parts.username, (parts.hostname, parts.port)
+        else:
+            return None
+        server_id = servers.get(endpoint)
+        if server_id is None:
+            return None
+        # Creation time was never recorded for legacy links.
+        return StoredKey(uuid.UUID(user_uuid).bytes, sys.intern(server_id), sys.intern(protocol), 0)
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None
+
+
+async def migrate() -> Tuple[int, int]:
+    """Converts legacy links of every user; returns (converted, kept) counts."""
+    servers = _servers_by_endpoint()
+    manager = create_user_data_manager()
+    converted = kept = 0
+    await manager.start()  # batch the rewrites when the backend supports write-behind
+    try:
+        for user_id, user_data in list(manager.get_all_users_data().items()):
+            keys = user_data.get("keys")
+            if not keys or not any(isinstance(key, str) for key in keys):
+                continue
+            new_keys = []
+            for key in keys:
+                parsed: Optional[UserKey] = parse_legacy_link(key, servers) if isinstance(key, str) else None
+                if parsed is not None:
+                    converted += 1
+                    new_keys.append(parsed)
+                else:
+                    kept += isinstance(key, str)
+                    new_keys.append(key)
+            manager.update_user_data(user_id, {"keys": new_keys})
+    finally:
+        await manager.close()
+    logger.info("Converted %s stored links to key parameters; kept %s unmatched links.", converted, kept)
+    return converted, kept
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
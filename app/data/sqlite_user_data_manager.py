@@ -0,0 +1,247 @@
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.config import USERS_DB_PATH
+from app.data.transactions import UserTransactionMixin
+from app.data.vpn_keys import StoredKey, UserKey, decode_key
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    lang    TEXT,
+    extra   TEXT
+);
+CREATE TABLE IF NOT EXISTS keys (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id  TEXT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    uuid     BLOB,
+    server   TEXT,
+    protocol TEXT,
+    created  INTEGER,
+    link     TEXT  -- only for legacy keys stored as full links
+);
+CREATE INDEX IF NOT EXISTS keys_user_position ON keys(user_id, position);
+-- Same order as app.data.user_record.user_order_key
+CREATE INDEX IF NOT EXISTS users_order ON users(length(user_id), user_id);
+"""
+
+_KEY_COLUMNS = "uuid, server, protocol, created, link"
+
+# Version 1 stored every key as a NOT NULL link; version 2 stores key parameters.
+_SCHEMA_VERSION = 2
+
+
+def _key_row(user_id: str, position: int, key: UserKey) -> Tuple:
+    if isinstance(key, StoredKey):
+        return (user_id, position, key.uuid, key.server, key.protocol, key.created, None)
+    return (user_id, position, None, None, None, None, key)
+
+
+def _row_key(uuid: bytes, server: str, protocol: str, created: int, link: str) -> UserKey:
+    if uuid is None:
+        return link
+    return StoredKey(uuid, server, protocol, created)
+
+
+class SQLiteUserDataManager(UserTransactionMixin):
+    """
+    UserDataManager backed by SQLite in WAL mode.
+
+    Exposes the same surface as UserDataManager, but every mutation is a
+    per-row statement instead of a whole-file rewrite, and users are only
+    read from disk when they are asked for.
+    """
+
+    def __init__(self, db_path: Path = USERS_DB_PATH):
+        self.db_path = db_path
+        logger.info("Opening SQLite user store at %s.", self.db_path)
+        # isolation_level=None: autocommit, multi-statement updates use explicit BEGIN
+        self._conn = sqlite3.connect(str(self.db_path), isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._migrate_schema()
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+
+    def _migrate_schema(self) -> None:
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(keys)")]
+        if not columns or "uuid" in columns:
+            return
+        logger.info("Migrating keys table in %s to schema version %s.", self.db_path, _SCHEMA_VERSION)
+        self._conn.executescript(
+            "BEGIN;"
+            "ALTER TABLE keys RENAME TO keys_v1;"
+            "DROP INDEX IF EXISTS keys_user_position;"
+            + _SCHEMA
+            + "INSERT INTO keys (user_id, position, link) SELECT user_id, position, link FROM keys_v1;"
+            "DROP TABLE keys_v1;"
+            "COMMIT;"
+        )
+
+    def _fetch_keys(self, user_id: str) -> List[UserKey]:
+        rows = self._conn.execute(
+            f"SELECT {_KEY_COLUMNS} FROM keys WHERE user_id = ? ORDER BY position", (user_id,)
+        ).fetchall()
+        return [_row_key(*row) for row in rows]
+
+    def _insert_keys(self, user_id: str, keys: List[UserKey], start: int = 0) -> None:
+        self._conn.executemany(
+            "INSERT INTO keys (user_id, position, uuid, server, protocol, created, link) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [_key_row(user_id, position, key) for position, key in enumerate(keys, start)],
+        )
+
+    def _ensure_user(self, user_id: str) -> None:
+        self._conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+
+    def _replace_keys(self, user_id: str, new_keys: List[UserKey]) -> None:
+        """Stores new_keys, appending only the tail when the list just grew."""
+        current = self._fetch_keys(user_id)
+        if new_keys[: len(current)] == current:
+            start = len(current)
+        else:
+            self._conn.execute("DELETE FROM keys WHERE user_id = ?", (user_id,))
+            start = 0
+        self._insert_keys(user_id, new_keys[start:], start)
+
+    def get_user_data(self, user_id: str) -> Dict[str, Any]:
+        """Returns data for a specific user."""
+        row = self._conn.execute(
+            "SELECT lang, extra FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return {}
+        lang, extra = row
+        data: Dict[str, Any] = json.loads(extra) if extra else {}
+        if lang is not None:
+            data["lang"] = lang
+        keys = self._fetch_keys(user_id)
+        if keys:
+            data["keys"] = keys
+        return data
+
+    def update_user_data(self, user_id: str, data: Dict[str, Any]) -> None:
+        """Updates data for a specific user in a single transaction."""
+        data = dict(data)
+        lang = data.pop("lang", None)
+        keys = data.pop("keys", None)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._ensure_user(user_id)
+            if lang is not None:
+                self._conn.execute("UPDATE users SET lang = ? WHERE user_id = ?", (lang, user_id))
+            if data:
+                row = self._conn.execute(
+                    "SELECT extra FROM users WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                extra = json.loads(row[0]) if row[0] else {}
+                extra.update(data)
+                self._conn.execute(
+                    "UPDATE users SET extra = ? WHERE user_id = ?", (json.dumps(extra), user_id)
+                )
+            if keys is not None:
+                self._replace_keys(user_id, [decode_key(key) for key in keys])
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def get_all_users_data(self) -> Dict[str, Any]:
+        """
+        Returns all users data. This materializes the whole table and is meant
+        for maintenance tasks, not for request handling.
+        """
+        users: Dict[str, Any] = {}
+        for user_id, lang, extra in self._conn.execute("SELECT user_id, lang, extra FROM users"):
+            data: Dict[str, Any] = json.loads(extra) if extra else {}
+            if lang is not None:
+                data["lang"] = lang
+            users[user_id] = data
+        for user_id, *key in self._conn.execute(
+            f"SELECT user_id, {_KEY_COLUMNS} FROM keys ORDER BY user_id, position"
+        ):
+            users[user_id].setdefault("keys", []).append(_row_key(*key))
+        return users
+
+    def count_users(self) -> int:
+        """Returns the number of stored users."""
+        return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def iter_users(self, after: Optional[str] = None, batch_size: int = 1000) -> Iterator[Tuple[str, Optional[str]]]:
+        """Yields (user_id, lang) in user_order_key order, starting after the given user."""
+        while True:
+            if after is None:
+                rows = self._conn.execute(
+                    "SELECT user_id, lang FROM users ORDER BY length(user_id), user_id LIMIT ?", (batch_size,)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT user_id, lang FROM users WHERE (length(user_id), user_id) > (?, ?) "
+                    "ORDER BY length(user_id), user_id LIMIT ?",
+                    (len(after), after, batch_size),
+                ).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    def get_lang(self, user_id: str, default: str = "en") -> str:
+        """Return user's language code, defaulting to 'en'."""
+        row = self._conn.execute("SELECT lang FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None or row[0] is None:
+            return default
+        return row[0]
+
+    def set_lang(self, user_id: str, lang_code: str) -> None:
+        """Set user's language code."""
+        self._conn.execute(
+            "INSERT INTO users (user_id, lang) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET lang = excluded.lang",
+            (user_id, lang_code),
+        )
+
+    def import_users(self, users: Dict[str, Any]) -> int:
+        """Bulk-loads a users.json style mapping in one transaction."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            for user_id, data in users.items():
+                data = dict(data)
+                lang = data.pop("lang", None)
+                keys = data.pop("keys", None) or []
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO users (user_id, lang, extra) VALUES (?, ?, ?)",
+                    (user_id, lang, json.dumps(data) if data else None),
+                )
+                self._conn.execute("DELETE FROM keys WHERE user_id = ?", (user_id,))
+                self._insert_keys(user_id, [decode_key(key) for key in keys])
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return len(users)
+
+    def save_users_data(self) -> None:
+        """Every mutation is already committed; kept for interface parity."""
+
+    async def start(self) -> None:
+        """Nothing to start; kept for interface parity with UserDataManager."""
+
+    async def flush(self) -> None:
+        """Nothing is buffered; kept for interface parity with UserDataManager."""
+
+    def disconnect(self) -> None:
+        """Checkpoints the WAL and closes the connection."""
+        logger.info("Closing SQLite user store at %s.", self.db_path)
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.close()
+
+    async def close(self) -> None:
+        """Closes the store on bot shutdown."""
+        self.disconnect()
@@ -0,0 +1,34 @@
+"""
+Storage backend selection.
+
+Handlers only rely on the UserDataManager surface (get_user_data,
+update_user_data, get_lang, set_lang, start, close), so any backend
+returned here can be passed to the register_* functions.
+"""
+
+import logging
+
+from app.config import USERS_STORAGE
+
+logger = logging.getLogger(__name__)
+
+
+def create_user_data_manager(storage: str = USERS_STORAGE):
+    """Returns the user data manager configured by USERS_STORAGE."""
+    if storage == "json":
+        from app.data.user_data_manager import UserDataManager
+
+        return UserDataManager()
+    if storage == "journal":
+        from app.data.journaled_user_data_manager import JournaledUserDataManager
+
+        return JournaledUserDataManager()
+    if storage == "lazy":
+        from app.data.lazy_user_data_manager import LazyUserDataManager
+
+        return LazyUserDataManager()
+    if storage == "sqlite":
+        from app.data.sqlite_user_data_manager import SQLiteUserDataManager
+
+        return SQLiteUserDataManager()
+    raise ValueError(f"Unknown USERS_STORAGE backend: {storage!r}. Use 'json', 'journal', 'lazy' or 'sqlite'.")
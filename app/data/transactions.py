@@ -0,0 +1,44 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from app.config import USERS_LOCK_STRIPES
+from app.data.user_record import UserRecord
+
+
+class UserTransactionMixin:
+    """
+    Adds per-user transactions to a user data manager:
+
+        async with user_data_manager.transaction(user_id) as user_data:
+            user_data["keys"].append(new_key)
+
+    The block works on a copy of the user's record; on a clean exit the copy
+    is written back with a single update_user_data call (one persistence
+    step), and the block only ends once wait_durable() returns; on an
+    exception the copy is discarded. Transactions on the same user
+    run one after another, while users hashing to different lock stripes
+    proceed in parallel. Fields deleted from the copy are not propagated.
+    """
+
+    lock_stripes: int = USERS_LOCK_STRIPES
+    _transaction_locks: Optional[List[asyncio.Lock]] = None
+
+    def _user_lock(self, user_id: str) -> asyncio.Lock:
+        if self._transaction_locks is None:
+            self._transaction_locks = [asyncio.Lock() for _ in range(self.lock_stripes)]
+        return self._transaction_locks[hash(user_id) % self.lock_stripes]
+
+    @asynccontextmanager
+    async def transaction(self, user_id: str) -> AsyncIterator[UserRecord]:
+        async with self._user_lock(user_id):
+            current = self.get_user_data(user_id)
+            if not isinstance(current, UserRecord):
+                current = UserRecord.from_dict(current)
+            draft = current.copy()
+            yield draft
+            self.update_user_data(user_id, draft)
+            await self.wait_durable()
+
+    async def wait_durable(self) -> None:
+        """Returns once the changes made so far are as durable as the backend makes them."""
@@ -1,69 +1,236 @@
+import asyncio
 import json
 import os
 import logging
-from typing import Dict, Any
+import tempfile
+import time
+from bisect import bisect_right
+from typing import Dict, Any, Iterator, List, Optional, Set, Tuple
 from pathlib import Path # Import Path for type hinting
 
-from app.config import USERS_FILE_PATH
+from app.data.user_record import UserRecord, user_order_key
+from app.data.transactions import UserTransactionMixin
+from app.config import (
+    USERS_FILE_PATH,
+    USERS_WRITE_BEHIND,
+    USERS_FLUSH_INTERVAL,
+    USERS_FLUSH_THRESHOLD,
+)
 
 logger = logging.getLogger(__name__)
 
-class UserDataManager:
-    def __init__(self, file_path: Path = USERS_FILE_PATH):
+_encode = json.JSONEncoder(separators=(",", ":"), default=UserRecord.to_dict).encode
+
+class UserDataManager(UserTransactionMixin):
+    def __init__(
+        self,
+        file_path: Path = USERS_FILE_PATH,
+        write_behind: bool = USERS_WRITE_BEHIND,
+        flush_interval: float = USERS_FLUSH_INTERVAL,
+        flush_threshold: int = USERS_FLUSH_THRESHOLD,
+    ):
         self.file_path = file_path
-        self._users_data: Dict[str, Any] = self._load_users_data()
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._users_data: Dict[str, UserRecord] = self._load_users_data()
+        # Each user's '"id":{...}' member of the users file, so that saving
+        # only re-encodes the users changed since the last save. Users in
+        # _unencoded (an ordered set) have no up-to-date member yet.
+        self._encoded: Dict[str, str] = {}
+        self._unencoded: Dict[str, None] = dict.fromkeys(self._users_data)
+
+        # Write-behind state. Until start() is awaited inside a running loop,
+        # mutations are persisted synchronously as before.
+        self._dirty: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
 
-    def _load_users_data(self) -> Dict[str, Any]:
+    def _load_users_data(self) -> Dict[str, UserRecord]:
         """Loads user data from the users.json file."""
-        logger.info(f"Attempting to load user data from {self.file_path}.")
+        logger.info("Attempting to load user data from %s.", self.file_path)
         if os.path.exists(self.file_path):
             try:
                 with open(self.file_path, "r") as f:
                     data = json.load(f)
-                    logger.info(f"Successfully loaded user data from {self.file_path}.")
-                    return data
+                    logger.info("Successfully loaded user data from %s.", self.file_path)
+                    return {user_id: UserRecord.from_dict(user) for user_id, user in data.items()}
             except json.JSONDecodeError:
-                logger.warning(
-                    f"Error decoding JSON from {self.file_path}. Returning empty data."
+                # Keep the damaged file for inspection instead of letting the
+                # next save overwrite it.
+                corrupt_path = f"{self.file_path}.corrupt-{int(time.time())}"
+                os.replace(self.file_path, corrupt_path)
+                logger.error(
+                    "Error decoding JSON from %s. Moved it to %s and starting with empty data.",
+                    self.file_path,
+                    corrupt_path,
                 )
                 return {}
         else:
-            logger.info(f"{self.file_path} not found. Returning empty user data.")
+            logger.info("%s not found. Returning empty user data.", self.file_path)
             return {}
 
+    def _invalidate(self, user_id: str) -> None:
+        """Drops the user's encoded member; the next save re-encodes it."""
+        self._unencoded[user_id] = None
+
+    def _encode_members(self) -> List[str]:
+        """Encodes the users changed since the last call; returns every user's member."""
+        for user_id in self._unencoded:
+            user = self._users_data.get(user_id)
+            if user is None:
+                self._encoded.pop(user_id, None)
+            else:
+                self._encoded[user_id] = f"{_encode(user_id)}:{_encode(user)}"
+        self._unencoded.clear()
+        return list(self._encoded.values())
+
+    def _write_members(self, members: List[str]) -> None:
+        """Joins the members from _encode_members() into the users file and writes it."""
+        self._write_atomic("{" + ",".join(members) + "}")
+
+    def _write_atomic(self, payload: str) -> None:
+        """
+        Writes payload to a temp file next to the users file and renames it
+        into place, so readers never observe a half-written file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".users-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
     def save_users_data(self) -> None:
         """Saves user data to the users.json file."""
-        logger.info(f"Attempting to save user data to {self.file_path}.")
+        logger.info("Attempting to save user data to %s.", self.file_path)
         try:
-            with open(self.file_path, "w") as f:
-                json.dump(self._users_data, f, indent=4)
-            logger.info(f"Successfully saved user data to {self.file_path}.")
+            self._write_members(self._encode_members())
+            self._dirty.clear()
+            logger.info("Successfully saved user data to %s.", self.file_path)
         except IOError as e:
-            logger.error(f"Error saving user data to {self.file_path}: {e}")
+            logger.error("Error saving user data to %s: %s", self.file_path, e)
+
+    def _mark_dirty(self, user_id: str, changes: Dict[str, Any]) -> None:
+        """
+        Records that a user changed. In write-behind mode the flush task picks
+        it up later; otherwise the file is rewritten immediately.
+        """
+        if self._flush_task is None:
+            self.save_users_data()
+            return
+        self._dirty.add(user_id)
+        if len(self._dirty) >= self.flush_threshold:
+            self._flush_requested.set()
 
-    def get_user_data(self, user_id: str) -> Dict[str, Any]:
-        """Returns data for a specific user."""
-        return self._users_data.get(user_id, {})
+    async def start(self) -> None:
+        """Starts the background flush task when write-behind is enabled."""
+        if not self.write_behind or self._flush_task is not None:
+            return
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = asyncio.create_task(self._flush_loop(), name="users-flush")
+        logger.info(
+            "Write-behind enabled for %s (interval=%ss, threshold=%s).",
+            self.file_path,
+            self.flush_interval,
+            self.flush_threshold,
+        )
+
+    async def _flush_loop(self) -> None:
+        while self._flush_task is not None:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Background flush of %s failed: %s", self.file_path, e, exc_info=True)
+
+    async def flush(self) -> None:
+        """
+        Persists pending changes. The changed users are encoded on the event
+        loop (so the snapshot is consistent); the file is joined and written in
+        a worker thread.
+        """
+        if self._flush_lock is None:
+            if self._dirty:
+                self.save_users_data()
+            return
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            pending, self._dirty = self._dirty, set()
+            members = self._encode_members()
+            try:
+                await asyncio.to_thread(self._write_members, members)
+            except Exception:
+                # Nothing was written; make sure the next flush retries.
+                self._dirty |= pending
+                raise
+            logger.info("Flushed %s changed users to %s.", len(pending), self.file_path)
+
+    async def close(self) -> None:
+        """Stops the flush task and performs a final flush."""
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            # Wake the loop so it exits after finishing any in-flight write.
+            self._flush_requested.set()
+            await task
+        await self.flush()
+
+    def get_user_data(self, user_id: str) -> UserRecord:
+        """Returns data for a specific user (an empty, detached record if unknown)."""
+        user = self._users_data.get(user_id)
+        return user if user is not None else UserRecord()
 
     def update_user_data(self, user_id: str, data: Dict[str, Any]) -> None:
-        """Updates data for a specific user and saves to file."""
+        """Updates data for a specific user and schedules persistence."""
         if user_id not in self._users_data:
-            self._users_data[user_id] = {}
+            self._users_data[user_id] = UserRecord()
         self._users_data[user_id].update(data)
-        self.save_users_data()
+        self._invalidate(user_id)
+        self._mark_dirty(user_id, data)
 
-    def get_all_users_data(self) -> Dict[str, Any]:
+    def get_all_users_data(self) -> Dict[str, UserRecord]:
         """Returns all users data."""
         return self._users_data
 
+    def count_users(self) -> int:
+        """Returns the number of stored users."""
+        return len(self._users_data)
+
+    def iter_users(self, after: Optional[str] = None) -> Iterator[Tuple[str, Optional[str]]]:
+        """Yields (user_id, lang) in user_order_key order, starting after the given user."""
+        user_ids = sorted(self._users_data, key=user_order_key)
+        start = bisect_right(user_ids, user_order_key(after), key=user_order_key) if after else 0
+        for user_id in user_ids[start:]:
+            user = self._users_data.get(user_id)
+            if user is not None:
+                yield user_id, user.lang
+
     def get_lang(self, user_id: str, default: str = "en") -> str:
         """Return user's language code, defaulting to 'en'."""
-        user = self._users_data.get(user_id, {})
-        return user.get("lang", default)
+        user = self._users_data.get(user_id)
+        if user is None or user.lang is None:
+            return default
+        return user.lang
 
     def set_lang(self, user_id: str, lang_code: str) -> None:
-        """Set user's language code and persist."""
+        """Set user's language code and schedule persistence."""
         if user_id not in self._users_data:
-            self._users_data[user_id] = {}
+            self._users_data[user_id] = UserRecord()
         self._users_data[user_id]["lang"] = lang_code
-        self.save_users_data()
+        self._invalidate(user_id)
+        self._mark_dirty(user_id, {"lang": lang_code})
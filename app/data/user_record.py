@@ -0,0 +1,159 @@
+import sys
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from app.data.vpn_keys import UserKey, decode_key, encode_key
+
+
+class UserRecord:
+    """
+    Compact in-memory representation of one user.
+
+    Replaces the per-user dict: fixed fields live in slots, language codes are
+    interned so every user shares the same few strings, and the keys list and
+    the dict of any other fields are only allocated when used. It implements
+    the mapping protocol (record["keys"], record.get("lang"), "keys" in
+    record, dict(record), ...) so handlers can keep treating it like a dict.
+
+    Keys are held as StoredKey tuples (legacy link strings are kept as-is);
+    assigning a keys list in its JSON form decodes it.
+    """
+
+    __slots__ = ("lang", "vpn_keys", "extra")
+
+    def __init__(
+        self,
+        lang: Optional[str] = None,
+        vpn_keys: Optional[List[UserKey]] = None,
+        extra: Optional[Dict[str, Any]] = None,
+    ):
+        self.lang = sys.intern(lang) if isinstance(lang, str) else lang
+        self.vpn_keys = vpn_keys
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "UserRecord":
+        record = cls()
+        record.update(data)
+        return record
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the plain, JSON-serializable dict stored on disk."""
+        return user_to_json(self)
+
+    def copy(self) -> "UserRecord":
+        return UserRecord(
+            self.lang,
+            list(self.vpn_keys) if self.vpn_keys is not None else None,
+            dict(self.extra) if self.extra else None,
+        )
+
+    # ---- mapping protocol ----------------------------------------------
+
+    def __getitem__(self, name: str) -> Any:
+        if name == "lang":
+            value = self.lang
+        elif name == "keys":
+            value = self.vpn_keys
+        elif self.extra and name in self.extra:
+            return self.extra[name]
+        else:
+            raise KeyError(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        if name == "lang":
+            self.lang = sys.intern(value) if isinstance(value, str) else value
+        elif name == "keys":
+            if value and any(isinstance(key, list) for key in value):
+                value = [decode_key(key) for key in value]
+            self.vpn_keys = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[name] = value
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+        if name == "lang":
+            self.lang = None
+        elif name == "keys":
+            self.vpn_keys = None
+        else:
+            del self.extra[name]
+            if not self.extra:
+                self.extra = None
+
+    def __contains__(self, name: object) -> bool:
+        if name == "lang":
+            return self.lang is not None
+        if name == "keys":
+            return self.vpn_keys is not None
+        return bool(self.extra) and name in self.extra
+
+    def __iter__(self) -> Iterator[str]:
+        if self.lang is not None:
+            yield "lang"
+        if self.vpn_keys is not None:
+            yield "keys"
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return (self.lang is not None) + (self.vpn_keys is not None) + len(self.extra or ())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (UserRecord, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"UserRecord({dict(self.items())!r})"
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def get(self, name: str, default: Any = None) -> Any:
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def setdefault(self, name: str, default: Any = None) -> Any:
+        if name not in self:
+            self[name] = default
+        return self[name]
+
+    def update(self, other: Any = (), **kwargs: Any) -> None:
+        if other is self:
+            return
+        items = other.items() if hasattr(other, "items") else other
+        for name, value in items:
+            self[name] = value
+        for name, value in kwargs.items():
+            self[name] = value
+
+
+def user_order_key(user_id: str) -> Tuple[int, str]:
+    """
+    Sort key for walking a user store in a stable order (e.g. broadcasts):
+    numeric Telegram ids sort numerically, every store agrees on the order.
+    """
+    return len(user_id), user_id
+
+
+def user_to_json(data: Mapping[str, Any]) -> Dict[str, Any]:
+    """Returns the JSON-serializable form of a UserRecord or user dict."""
+    result = dict(data.items())
+    keys = result.get("keys")
+    if keys:
+        result["keys"] = [encode_key(key) for key in keys]
+    return result
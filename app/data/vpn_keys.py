@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+from typing import Any, List, NamedTuple, Union
+
+# UUIDs are cut from one os.urandom() call per UUID_POOL_SIZE keys instead of
+# a uuid.uuid4() object per key.
+UUID_POOL_SIZE = 4096
+
+# Byte translations that stamp the RFC 4122 version (4) and variant bits
+_VERSION_4 = bytes((b & 0x0F) | 0x40 for b in range(256))
+_VARIANT_RFC4122 = bytes((b & 0x3F) | 0x80 for b in range(256))
+
+
+class UUIDPool:
+    """
+    Hands out random (version 4) UUIDs as 16 raw bytes from a pre-generated
+    buffer. The version and variant bits of a whole refill are set with two
+    bytes.translate() calls over strided slices.
+    """
+
+    def __init__(self, size: int = UUID_POOL_SIZE):
+        self.size = size
+        self._buffer = b""
+        self._position = 0
+
+    @staticmethod
+    def _generate(count: int) -> bytes:
+        buffer = bytearray(os.urandom(16 * count))
+        buffer[6::16] = buffer[6::16].translate(_VERSION_4)
+        buffer[8::16] = buffer[8::16].translate(_VARIANT_RFC4122)
+        return bytes(buffer)
+
+    def take(self) -> bytes:
+        if self._position >= len(self._buffer):
+            self._buffer = self._generate(self.size)
+            self._position = 0
+        start = self._position
+        self._position += 16
+        return self._buffer[start:start + 16]
+
+    def take_many(self, count: int) -> List[bytes]:
+        if count > self.size:
+            buffer = self._generate(count)
+            return [buffer[i:i + 16] for i in range(0, 16 * count, 16)]
+        return [self.take() for _ in range(count)]
+
+
+uuid_pool = UUIDPool()
+
+
+def format_uuid(raw: bytes) -> str:
+    """Canonical 8-4-4-4-12 text form of 16 raw UUID bytes."""
+    h = raw.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+class StoredKey(NamedTuple):
+    """
+    A VPN key as stored for a user: just the parameters needed to re-render
+    its link. On disk it is the JSON list [uuid_hex, server, protocol, created].
+    """
+
+    uuid: bytes  # 16 raw bytes
+    server: str  # server id from app.services.servers, e.g. "russia"
+    protocol: str  # "vmess" or "vless"
+    created: int  # unix time
+
+    @classmethod
+    def new(cls, server: str, protocol: str) -> "StoredKey":
+        return cls(uuid_pool.take(), sys.intern(server), sys.intern(protocol), int(time.time()))
+
+    @property
+    def uuid_str(self) -> str:
+        return format_uuid(self.uuid)
+
+    def to_json(self) -> List[Any]:
+        return [self.uuid.hex(), self.server, self.protocol, self.created]
+
+
+# Keys generated before StoredKey existed are kept as full link strings.
+UserKey = Union[StoredKey, str]
+
+
+def decode_key(value: Any) -> UserKey:
+    """Turns the on-disk form of a key back into a StoredKey (legacy links stay strings)."""
+    if isinstance(value, list):
+        uuid_hex, server, protocol, created = value
+        return StoredKey(bytes.fromhex(uuid_hex), sys.intern(server), sys.intern(protocol), int(created))
+    return value
+
+
+def encode_key(key: UserKey) -> Any:
+    """Returns the on-disk (JSON) form of a key."""
+    return key.to_json() if isinstance(key, StoredKey) else key
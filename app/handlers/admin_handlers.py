@@ -0,0 +1,56 @@
+import logging
+from aiogram import Router, F
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from app.config import ADMIN_IDS
+from app.services.broadcast import Broadcaster, parse_templates
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_USAGE = (
+    "Usage: /broadcast followed by the message on the next lines.\n"
+    "Add [ru], [uz], ... lines to give other languages their own text:\n\n"
+    "/broadcast\n"
+    "New servers are available!\n"
+    "[ru]\n"
+    "Доступны новые серверы!"
+)
+
+def register_admin_handlers(router: Router, broadcaster: Broadcaster):
+    # Admin commands are only seen by users listed in ADMIN_IDS
+    is_admin = F.from_user.id.in_(ADMIN_IDS)
+
+    @router.message(Command("broadcast"), is_admin)
+    async def cmd_broadcast(message: Message):
+        """
+        Starts a broadcast to every user. Formatting of the admin's message
+        is kept by sending its HTML form.
+        """
+        parts = message.html_text.split(maxsplit=1)
+        templates = parse_templates(parts[1]) if len(parts) > 1 else {}
+        if not templates:
+            await message.answer(BROADCAST_USAGE)
+            return
+        try:
+            job = broadcaster.start(templates, parse_mode="HTML", admin_chat_id=message.chat.id)
+        except RuntimeError:
+            await message.answer(f"A broadcast is already running.\n{broadcaster.format_progress()}")
+            return
+        logger.info("Admin %s started broadcast %s", message.from_user.id, job.job_id)
+        await message.answer(
+            f"Broadcast {job.job_id} started for {job.total} users "
+            f"(languages: {', '.join(sorted(templates))}). Use /broadcast_status to follow it."
+        )
+
+    @router.message(Command("broadcast_status"), is_admin)
+    async def cmd_broadcast_status(message: Message):
+        await message.answer(broadcaster.format_progress())
+
+    @router.message(Command("broadcast_cancel"), is_admin)
+    async def cmd_broadcast_cancel(message: Message):
+        if broadcaster.cancel():
+            logger.info("Admin %s cancelled broadcast %s", message.from_user.id, broadcaster.job.job_id)
+            await message.answer(f"Cancelling broadcast {broadcaster.job.job_id}.")
+        else:
+            await message.answer("No broadcast is running.")
@@ -2,133 +2,172 @@ import logging
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
-from app.keyboards.menu_keyboards import create_main_menu_keyboard
+from app.handlers.key_pages import find_key, key_pages
+from app.handlers.responses import replace_or_answer
+from app.keyboards.menu_keyboards import (
+    KEY_DELETE_CONFIRM_PREFIX,
+    KEY_DELETE_PREFIX,
+    KEYS_PAGE_PREFIX,
+    create_key_delete_confirm_keyboard,
+)
 from app.services.vpn_link_generator import VPNLinkGenerator
 from app.data.user_data_manager import UserDataManager
+from app.data.vpn_keys import StoredKey
+from app.services.health import health_monitor
+from app.services.provisioning import Provisioner, ProvisioningError
+from app.services.servers import AUTO_SERVER_ID, SERVER_CALLBACK_PREFIX, available_servers, get_server
 from app.utils.i18n import get_translation as t
+from app.utils.message_templates import VPN_LINK
 
 logger = logging.getLogger(__name__)
 
 def register_callback_query_handlers(
     router: Router,
     user_data_manager: UserDataManager,
-    vpn_link_generator: VPNLinkGenerator
+    vpn_link_generator: VPNLinkGenerator,
+    provisioner: Provisioner,
 ):
-    @router.callback_query(F.data.startswith("select_server_"))
+    @router.callback_query(F.data.startswith(SERVER_CALLBACK_PREFIX))
     async def process_server_selection(callback_query: CallbackQuery):
         user_id = str(callback_query.from_user.id)
         lang = user_data_manager.get_lang(user_id)
         logger.info(
-            f"Received server selection callback query '{callback_query.data}' from user {user_id}"
+            "Received server selection callback query '%s' from user %s", callback_query.data, user_id
         )
-        server_location = callback_query.data.split("_")[-1]  # e.g., 'russia'
-
-        # Placeholder server details (replace with actual server info)
-        server_details = {
-            "russia": {
-                "address": "ru.example.com",
-                "port": 443,
-                "security": "tls",
-                "network": "ws",
-                "path": "/ws",
-            },
-            "america": {
-                "address": "us.example.com",
-                "port": 8443,
-                "security": "tls",
-                "network": "tcp",
-                "flow": "xtls-rprx-vision",
-            },
-            "germany": {
-                "address": "de.example.com",
-                "port": 2053,
-                "security": "tls",
-                "network": "ws",
-                "path": "/v2ray",
-            },
-            "singapore": {
-                "address": "sg.example.com",
-                "port": 443,
-                "security": "tls",
-                "network": "tcp",
-            },
-        }
-
-        selected_server = server_details.get(server_location)
-
-        if not selected_server:
+        server_location = callback_query.data[len(SERVER_CALLBACK_PREFIX):]  # e.g., 'russia'
+
+        if server_location == AUTO_SERVER_ID:
+            selected_server = health_monitor.fastest(available_servers())
+            server_location = selected_server.id if selected_server else server_location
+        else:
+            selected_server = get_server(server_location)
+
+        # Unknown, or disabled since the keyboard was sent
+        if selected_server is None or not selected_server.enabled:
             logger.warning(
-                f"User {user_id} selected unknown server location: {server_location}"
+                "User %s selected unknown server location: %s", user_id, server_location
             )
             await callback_query.answer(t(lang, "server_not_found", "Server not found."), show_alert=True)
             return
 
-        # Determine link type (can be dynamic based on server, for now let's assume vmess for ws, vless for tcp with flow)
-        link_type = "vmess" if selected_server.get("network") == "ws" else "vless"
-        logger.info(f"User {user_id} selected {server_location}. Generating {link_type} link.")
+        link_type = selected_server.protocol
+        logger.info("User %s selected %s. Generating %s link.", user_id, server_location, link_type)
 
         try:
-            # Generate the VPN link
-            generated_link = vpn_link_generator.generate_vpn_link(
-                link_type,
-                selected_server["address"],
-                selected_server["port"],
-                security=selected_server.get("security", "auto"),
-                network=selected_server.get("network", "tcp"),
-                **{
-                    k: v
-                    for k, v in selected_server.items()
-                    if k not in ["address", "port", "security", "network"]
-                },  # Pass extra args
-            )
-
-            # Update user data
-            user_data = user_data_manager.get_user_data(user_id)
-            if "keys" not in user_data:
-                user_data["keys"] = []
-            user_data["keys"].append(generated_link)
-            user_data_manager.update_user_data(user_id, user_data)
-            logger.info(f"Saved new key for user {user_id}.")
-
-            # Send the link to the user
-            await callback_query.message.answer(
-                f"{t(lang, 'your_vpn_link', 'Your VPN link:')}\n`{generated_link}`", parse_mode="MarkdownV2"
+            # Only the key parameters are stored; the link is rendered from them
+            new_key = StoredKey.new(selected_server.id, link_type)
+            generated_link = vpn_link_generator.render_key(new_key)
+
+            # The key is registered on its server and saved to the user's keys; it is
+            # only shown once active
+            try:
+                active = await provisioner.provision(user_id, new_key)
+            except ProvisioningError as e:
+                logger.warning("Server %s refused the new key of user %s: %s", new_key.server, user_id, e)
+                await callback_query.answer(
+                    t(lang, "key_provision_failed", "Sorry, your key could not be created. Please try again later."),
+                    show_alert=True,
+                )
+                return
+            if not active:
+                # The provisioner sends the link when the server confirms it
+                await replace_or_answer(
+                    callback_query,
+                    t(lang, "key_activation_pending", "Your key is being activated. We will send it as soon as it is ready."),
+                )
+                await callback_query.answer()
+                return
+            logger.info("Saved new key for user %s.", user_id)
+
+            # The server list turns into the link; the main menu keyboard is still on screen
+            await replace_or_answer(
+                callback_query, VPN_LINK.render(lang, link=generated_link), parse_mode="MarkdownV2"
             )
-            logger.info(f"Sent VPN link to user {user_id}")
+            logger.info("Sent VPN link to user %s", user_id)
 
             # Answer the callback query to remove the loading state
             await callback_query.answer(t(lang, "link_generated", "Link generated!"))
-            logger.info(f"Answered callback query for user {user_id}")
-
-            # Display the main menu again
-            await callback_query.message.answer(
-                t(lang, "main_menu_message_prompt", "Main menu:"), reply_markup=create_main_menu_keyboard(lang)
-            )
-            logger.info(f"Sent main menu to user {user_id}")
-
+            logger.info("Answered callback query for user %s", user_id)
 
         except ValueError as e:
-            logger.error(f"ValueError during link generation for user {user_id}: {e}")
+            logger.error("ValueError during link generation for user %s: %s", user_id, e)
             await callback_query.answer(f"{t(lang, 'error_prefix', 'Error:')} {e}", show_alert=True)
         except Exception as e:
             logger.error(
-                f"Error generating or saving link for user {user_id}: {e}", exc_info=True
+                "Error generating or saving link for user %s: %s", user_id, e, exc_info=True
             )  # Log traceback
             await callback_query.answer(t(lang, "error_during_link_generation", "An unexpected error occurred during link generation."), show_alert=True)
 
 
+    async def show_keys_page(callback_query: CallbackQuery, user_id: str, lang: str, page: int) -> None:
+        keys = user_data_manager.get_user_data(user_id).get("keys") or ()
+        rendered = key_pages.render(user_id, lang, keys, page)
+        if rendered is None:
+            await replace_or_answer(callback_query, t(lang, "no_saved_keys", "You don't have any saved keys yet."))
+            return
+        await replace_or_answer(callback_query, rendered.text, reply_markup=rendered.reply_markup, parse_mode="MarkdownV2")
+
+    def parse_key_callback(data: str, prefix: str):
+        # "<prefix><page>:<key uuid hex>"; client-supplied, so anything else is ignored
+        page, _, key_id = data[len(prefix):].partition(":")
+        return (int(page), key_id) if page.isdigit() and key_id else (None, None)
+
+    @router.callback_query(F.data.startswith(KEYS_PAGE_PREFIX))
+    async def process_keys_page(callback_query: CallbackQuery):
+        user_id = str(callback_query.from_user.id)
+        lang = user_data_manager.get_lang(user_id)
+        page = callback_query.data[len(KEYS_PAGE_PREFIX):]
+        await callback_query.answer()
+        await show_keys_page(callback_query, user_id, lang, int(page) if page.isdigit() else 0)
+
+    @router.callback_query(F.data.startswith(KEY_DELETE_PREFIX))
+    async def process_key_delete(callback_query: CallbackQuery):
+        user_id = str(callback_query.from_user.id)
+        lang = user_data_manager.get_lang(user_id)
+        page, key_id = parse_key_callback(callback_query.data, KEY_DELETE_PREFIX)
+        keys = user_data_manager.get_user_data(user_id).get("keys") or ()
+        found = find_key(keys, key_id) if key_id else None
+        rendered = key_pages.render(user_id, lang, keys, page or 0)
+        if found is None or rendered is None:
+            # Deleted meanwhile, e.g. from another copy of the list
+            await callback_query.answer(t(lang, "key_not_found", "This key no longer exists."))
+            await show_keys_page(callback_query, user_id, lang, page or 0)
+            return
+        await callback_query.answer()
+        # Same page, with the delete buttons swapped for a confirmation
+        await replace_or_answer(
+            callback_query,
+            rendered.text,
+            reply_markup=create_key_delete_confirm_keyboard(lang, rendered.page, found[0], key_id),
+            parse_mode="MarkdownV2",
+        )
+
+    @router.callback_query(F.data.startswith(KEY_DELETE_CONFIRM_PREFIX))
+    async def process_key_delete_confirmed(callback_query: CallbackQuery):
+        user_id = str(callback_query.from_user.id)
+        lang = user_data_manager.get_lang(user_id)
+        page, key_id = parse_key_callback(callback_query.data, KEY_DELETE_CONFIRM_PREFIX)
+        found = find_key(user_data_manager.get_user_data(user_id).get("keys") or (), key_id) if key_id else None
+        if found is not None and await provisioner.revoke(user_id, found[1]):
+            logger.info("User %s deleted key %s.", user_id, found[1].uuid_str)
+            await callback_query.answer(t(lang, "key_deleted", "Key deleted."))
+        else:
+            await callback_query.answer(t(lang, "key_not_found", "This key no longer exists."))
+        # The keys changed, so the page is rendered anew (and clamped if it emptied)
+        await show_keys_page(callback_query, user_id, lang, page or 0)
+
+
     @router.callback_query(F.data == "back_to_main")
     async def process_back_to_main(callback_query: CallbackQuery):
         user_id = str(callback_query.from_user.id)
         lang = user_data_manager.get_lang(user_id)
         logger.info(
-            f"Received 'Back to main' callback query from user {user_id}"
+            "Received 'Back to main' callback query from user %s", user_id
         )
         await callback_query.answer()  # Answer the callback query
-        await callback_query.message.answer(
-            t(lang, "main_menu_message_prompt", "Main menu:"), reply_markup=create_main_menu_keyboard(lang)
-        )
-        logger.info(f"Sent main menu to user {user_id}")
+        # Close the server list; the main menu keyboard never left the screen
+        await replace_or_answer(callback_query, t(lang, "main_menu_message_prompt", "Main menu:"))
+        logger.info("Sent main menu to user %s", user_id)
 
 
     @router.callback_query(F.data == "enter_promo_code")
@@ -139,9 +178,9 @@ def register_callback_query_handlers(
         user_id = str(callback_query.from_user.id)
         lang = user_data_manager.get_lang(user_id)
         logger.info(
-            f"Received 'enter_promo_code' callback query from user {user_id}"
+            "Received 'enter_promo_code' callback query from user %s", user_id
         )
         await callback_query.answer()  # Answer the callback query
         # For now, just prompt the user. Promo code logic will be implemented later.
         await callback_query.message.answer(t(lang, "enter_promo_code_prompt", "Please enter your promo code:"))
-        logger.info(f"Prompted user {user_id} for promo code.")
+        logger.info("Prompted user %s for promo code.", user_id)
@@ -1,16 +1,18 @@
 import logging
 from aiogram import Router
-from aiogram.types import Update
+from aiogram.types import ErrorEvent
 
 logger = logging.getLogger(__name__)
 
 def register_error_handler(router: Router):
     @router.error()
-    async def errors_handler(update: Update, exception: Exception):
+    async def errors_handler(event: ErrorEvent):
         """
         Global error handler to log unhandled exceptions and notify the user.
         """
-        logger.error(f"Unhandled exception in update: {update}", exc_info=exception)
+        update = event.update
+        # Only the id and type: formatting the whole update is costly and logs user content
+        logger.error("Unhandled exception in update %s (%s)", update.update_id, update.event_type, exc_info=event.exception)
 
         # Attempt to send an error message to the user
         try:
@@ -24,4 +26,4 @@ def register_error_handler(router: Router):
                 )
                 await update.callback_query.answer()  # Answer the callback query to prevent infinite loading
         except Exception as e:
-            logger.error(f"Failed to send error message to user: {e}")
+            logger.error("Failed to send error message to user: %s", e)
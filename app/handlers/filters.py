@@ -0,0 +1,22 @@
+from typing import Any, Dict, Union
+
+from aiogram.filters import Filter
+from aiogram.types import Message
+
+from app.utils.i18n import lookup_menu_button
+
+
+class MenuButtonFilter(Filter):
+    """
+    Matches any main-menu reply button in any language with one dict lookup.
+
+    On a match the handler receives menu_action (e.g. "tariflar") and
+    button_lang (the language whose catalog the text came from).
+    """
+
+    async def __call__(self, message: Message) -> Union[bool, Dict[str, Any]]:
+        hit = lookup_menu_button(message.text)
+        if hit is None:
+            return False
+        action, lang = hit
+        return {"menu_action": action, "button_lang": lang}
@@ -0,0 +1,117 @@
+"""
+The paginated "My keys" list.
+
+Only the visible page is rendered: its links, escaped for MarkdownV2, and
+its inline keyboard with a delete button per key and prev/next buttons.
+Rendered pages are cached per user and reused until the user's keys or
+language change, or servers or translations are reloaded, so paging back
+and forth costs no rendering.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Sequence, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+from app.config import KEYS_PAGE_CACHE_USERS, KEYS_PAGE_SIZE
+from app.data.vpn_keys import StoredKey
+from app.keyboards.menu_keyboards import create_keys_page_keyboard
+from app.services import servers
+from app.services.vpn_link_generator import VPNLinkGenerator
+from app.utils import i18n
+from app.utils.message_templates import KEY_ENTRY, KEY_ENTRY_SERVER_REMOVED, KEYS_PAGE, KEYS_PAGE_FOOTER
+
+logger = logging.getLogger(__name__)
+
+
+class KeyPage(NamedTuple):
+    text: str  # MarkdownV2
+    reply_markup: InlineKeyboardMarkup
+    page: int  # after clamping to the existing pages
+    pages: int
+
+
+class KeyPages:
+    """Renders pages of users' key lists and caches them per user."""
+
+    def __init__(
+        self,
+        vpn_link_generator: Optional[VPNLinkGenerator] = None,
+        page_size: int = KEYS_PAGE_SIZE,
+        cache_users: int = KEYS_PAGE_CACHE_USERS,
+    ):
+        self.vpn_link_generator = vpn_link_generator or VPNLinkGenerator()
+        self.page_size = max(1, page_size)
+        self.cache_users = cache_users
+        # user id -> (lang, keys the pages were rendered from, page -> KeyPage)
+        self._cache: "OrderedDict[str, Tuple[str, Tuple[Any, ...], Dict[int, KeyPage]]]" = OrderedDict()
+
+    def render(self, user_id: str, lang: str, keys: Sequence[Any], page: int) -> Optional[KeyPage]:
+        """
+        Returns the given page (clamped to the existing ones) of the user's
+        keys, or None if there are none.
+        """
+        keys = tuple(keys)
+        if not keys:
+            self._cache.pop(user_id, None)
+            return None
+        pages = -(-len(keys) // self.page_size)
+        page = min(max(page, 0), pages - 1)
+        cached = self._cache.get(user_id)
+        if cached is None or cached[0] != lang or cached[1] != keys:
+            cached = (lang, keys, {})
+            self._cache[user_id] = cached
+            if len(self._cache) > self.cache_users:
+                self._cache.popitem(last=False)
+        self._cache.move_to_end(user_id)
+        rendered = cached[2].get(page)
+        if rendered is None:
+            rendered = cached[2][page] = self._render_page(user_id, lang, keys, page, pages)
+        return rendered
+
+    def clear(self) -> None:
+        """Forgets every rendered page; they are rendered again on next use."""
+        self._cache.clear()
+
+    def _render_page(self, user_id: str, lang: str, keys: Tuple[Any, ...], page: int, pages: int) -> KeyPage:
+        first = page * self.page_size
+        entries = []
+        deletable = []
+        for number, key in enumerate(keys[first:first + self.page_size], first + 1):
+            if isinstance(key, StoredKey):
+                deletable.append((number, key.uuid.hex()))
+                try:
+                    # Keys are stored as parameters; render the link on demand
+                    link = self.vpn_link_generator.render_key(key)
+                except KeyError:
+                    logger.warning("Key %s of user %s belongs to removed server %s.", key.uuid_str, user_id, key.server)
+                    entries.append(KEY_ENTRY_SERVER_REMOVED.render(lang, number=number))
+                    continue
+            else:
+                link = key  # legacy keys are stored as links
+            entries.append(KEY_ENTRY.render(lang, number=number, link=link))
+        if pages > 1:
+            entries.append(KEYS_PAGE_FOOTER.render(lang, page=page + 1, pages=pages))
+        return KeyPage(
+            KEYS_PAGE.render(lang, entries="\n\n".join(entries)),
+            create_keys_page_keyboard(lang, page, pages, deletable),
+            page,
+            pages,
+        )
+
+
+def find_key(keys: Sequence[Any], key_id: str) -> Optional[Tuple[int, StoredKey]]:
+    """The 1-based number and the key whose uuid hex is key_id, or None."""
+    for number, key in enumerate(keys, 1):
+        if isinstance(key, StoredKey) and key.uuid.hex() == key_id:
+            return number, key
+    return None
+
+
+# Shared by the message and callback handlers
+key_pages = KeyPages()
+
+# Pages embed server links and translated texts
+servers.add_reload_listener(key_pages.clear)
+i18n.add_reload_listener(key_pages.clear)
@@ -3,28 +3,38 @@ from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery
 
-from app.utils.i18n import get_translation as t
-from app.utils.markdown_utils import escape_markdown_v2 # NEW: Import markdown escape utility
+from app.utils.i18n import available_languages, get_translation as t
+from app.utils.message_templates import ACCOUNT_INFO, REFERRAL
+from app.handlers.filters import MenuButtonFilter
+from app.handlers.key_pages import key_pages
+from app.handlers.responses import answer_with_menu
 from app.keyboards.language_keyboards import create_language_keyboard
 from app.keyboards.menu_keyboards import create_main_menu_keyboard, create_server_location_keyboard, create_accauntim_keyboard
 from app.data.user_data_manager import UserDataManager
+from app.services.vpn_link_generator import VPNLinkGenerator
 
 logger = logging.getLogger(__name__)
 
-def register_message_handlers(router: Router, user_data_manager: UserDataManager):
+def register_message_handlers(
+    router: Router,
+    user_data_manager: UserDataManager,
+    vpn_link_generator: VPNLinkGenerator
+):
     @router.message(Command("start"))
     async def cmd_start(message: Message):
         user_id = str(message.from_user.id)
         lang = user_data_manager.get_lang(user_id) # Get user's preferred language
 
-        logger.info(f"Received /start from {user_id} with lang={lang}")
+        logger.info("Received /start from %s with lang=%s", user_id, lang)
+        if user_data_manager.get_lang(user_id, default=None) is not None:
+            # Returning users get the main menu right away; /language changes the language
+            await answer_with_menu(message, t(lang, "welcome_message", "Hello! Welcome to our bot!"), lang)
+            return
+        # New users pick a language first; choosing one sends the main menu
         await message.answer(
-            t(lang, "welcome_message", "Hello! Welcome to our bot!"),
-            reply_markup=create_main_menu_keyboard(lang),
-        )
-        # Always offer language selection after the main menu
-        await message.answer(
-            t(lang, "language_selection_prompt", "Please select a language:"),
+            t(lang, "welcome_message", "Hello! Welcome to our bot!")
+            + "\n\n"
+            + t(lang, "language_selection_prompt", "Please select a language:"),
             reply_markup=create_language_keyboard(lang),
         )
 
@@ -43,10 +53,15 @@ def register_message_handlers(router: Router, user_data_manager: UserDataManager
     async def on_language_selected(callback: CallbackQuery):
         user_id = str(callback.from_user.id)
         _, lang_code = callback.data.split(":", 1)
+        if lang_code not in available_languages():
+            # Callback data is client-supplied; only accept languages we have catalogs for
+            logger.warning("User %s selected unsupported language %r", user_id, lang_code)
+            await callback.answer()
+            return
 
         # Save language
         user_data_manager.set_lang(user_id, lang_code)
-        logger.info(f"Language set to {lang_code} for user {user_id}")
+        logger.info("Language set to %s for user %s", lang_code, user_id)
 
         # Confirm to the user and update messages in selected language
         await callback.message.edit_text(
@@ -59,101 +74,53 @@ def register_message_handlers(router: Router, user_data_manager: UserDataManager
         )
         await callback.answer()
 
-    @router.message(
-        F.text.in_([
-            t("ru", "main_menu_button_tariflar"),
-            t("uz", "main_menu_button_tariflar"),
-            t("en", "main_menu_button_tariflar")
-        ])
-    )
-    async def handle_tariflar(message: Message):
+    async def handle_tariflar(message: Message, lang: str):
         user_id = str(message.from_user.id)
-        lang = user_data_manager.get_lang(user_id)
-        logger.info(f"Received '💎 Tariflar' from user {user_id}")
+        logger.info("Received '💎 Tariflar' from user %s", user_id)
         await message.answer(
             t(lang, "server_selection_prompt", "Please select a server location:"),
             reply_markup=create_server_location_keyboard(lang),
         )
-        logger.info(f"Sent server selection menu to user {user_id}")
+        logger.info("Sent server selection menu to user %s", user_id)
 
 
-    @router.message(
-        F.text.in_([
-            t("ru", "main_menu_button_kalitlarim"),
-            t("uz", "main_menu_button_kalitlarim"),
-            t("en", "main_menu_button_kalitlarim")
-        ])
-    )
-    async def handle_kalitlarim(message: Message):
+    async def handle_kalitlarim(message: Message, lang: str):
         """
         Handles the "🔑 Kalitlarim" button press and displays the user's generated keys.
         """
         user_id = str(message.from_user.id)
-        lang = user_data_manager.get_lang(user_id)
-        logger.info(f"Received '🔑 Kalitlarim' from user {user_id}")
+        logger.info("Received '🔑 Kalitlarim' from user %s", user_id)
         user_data = user_data_manager.get_user_data(user_id)
 
-        if user_data and user_data.get("keys"):
-            user_keys = user_data["keys"]
-            if user_keys:
-                logger.info(f"Displaying {len(user_keys)} keys for user {user_id}.")
-                # Format the keys into a readable message
-                keys_message_raw = t(lang, "keys_message_header", "Your saved keys:") + "\n\n"
-                for i, key in enumerate(user_keys):
-                    # Escape the dot in the number and any special characters in the key
-                    escaped_key = escape_markdown_v2(key) # Use the new escape utility
-                    keys_message_raw += f"{i + 1}\\. `{escaped_key}`\n\n"
-
-                await message.answer(keys_message_raw, parse_mode="MarkdownV2")
-            else:
-                logger.info(f"User {user_id} has no saved keys.")
-                await message.answer(t(lang, "no_saved_keys", "You don't have any saved keys yet."))
-        else:
-            logger.info(f"User {user_id} has no saved keys in database.")
-            await message.answer(t(lang, "no_saved_keys", "You don't have any saved keys yet."))
-
-        # Display the main menu again
-        await message.answer(t(lang, "main_menu_message_prompt", "Main menu:"), reply_markup=create_main_menu_keyboard(lang)) # New key
-        logger.info(f"Sent main menu to user {user_id}")
-
-
-    @router.message(
-        F.text.in_([
-            t("ru", "main_menu_button_accauntim"),
-            t("uz", "main_menu_button_accauntim"),
-            t("en", "main_menu_button_accauntim")
-        ])
-    )
-    async def handle_accauntim(message: Message):
+        rendered = key_pages.render(user_id, lang, user_data.get("keys") or (), 0)
+        if rendered is None:
+            logger.info("User %s has no saved keys.", user_id)
+            await answer_with_menu(message, t(lang, "no_saved_keys", "You don't have any saved keys yet."), lang)
+            return
+        logger.info("Displaying page 1 of %s of keys for user %s.", rendered.pages, user_id)
+        # Only the first page is rendered; the inline keyboard pages through the rest
+        await message.answer(rendered.text, reply_markup=rendered.reply_markup, parse_mode="MarkdownV2")
+
+
+    async def handle_accauntim(message: Message, lang: str):
         """
         Handles the "👤 Accauntim" button press and displays user account info
         with an inline keyboard for promo code entry.
         """
         user_id = str(message.from_user.id)
-        lang = user_data_manager.get_lang(user_id)
-        logger.info(f"Received '👤 Accauntim' from user {user_id}")
-        account_info_raw = f"{t(lang, 'account_info_header', 'Your Account:')}\n\n{t(lang, 'account_info_user_id', 'User ID:')} `{escape_markdown_v2(user_id)}`"
-
+        logger.info("Received '👤 Accauntim' from user %s", user_id)
         await message.answer(
-            account_info_raw, reply_markup=create_accauntim_keyboard(lang), parse_mode="MarkdownV2" # Pass lang
+            ACCOUNT_INFO.render(lang, user_id=user_id), reply_markup=create_accauntim_keyboard(lang), parse_mode="MarkdownV2" # Pass lang
         )
-        logger.info(f"Sent account info and inline keyboard to user {user_id}")
+        logger.info("Sent account info and inline keyboard to user %s", user_id)
 
 
-    @router.message(
-        F.text.in_([
-            t("ru", "main_menu_button_korsatmalar"),
-            t("uz", "main_menu_button_korsatmalar"),
-            t("en", "main_menu_button_korsatmalar")
-        ])
-    )
-    async def handle_korsatmalar(message: Message):
+    async def handle_korsatmalar(message: Message, lang: str):
         """
         Handles the "📘 Ko'rsatmalar" button press and displays installation instructions.
         """
         user_id = str(message.from_user.id)
-        lang = user_data_manager.get_lang(user_id)
-        logger.info(f"Received '📘 Ko'rsatmalar' from user {user_id}")
+        logger.info("Received '📘 Ko'rsatmalar' from user %s", user_id)
         # Instructions text can be put in translation files if they vary by language
         instructions_text = t(lang, "instructions_full_text", """
 <b>📘 Instructions</b>
@@ -186,28 +153,16 @@ def register_message_handlers(router: Router, user_data_manager: UserDataManager
 4. Find the 'Import' or 'Add' button in the app and paste the link.
 5. Activate the connection.
 """)
-        await message.answer(instructions_text, parse_mode="HTML") # Instructions text is fixed for now
-        logger.info(f"Sent instructions to user {user_id}")
-
-        # Display the main menu again
-        await message.answer(t(lang, "main_menu_message_prompt", "Main menu:"), reply_markup=create_main_menu_keyboard(lang))
-        logger.info(f"Sent main menu to user {user_id}")
-
-
-    @router.message(
-        F.text.in_([
-            t("ru", "main_menu_button_yordam"),
-            t("uz", "main_menu_button_yordam"),
-            t("en", "main_menu_button_yordam")
-        ])
-    )
-    async def handle_yordam(message: Message):
+        await answer_with_menu(message, instructions_text, lang, parse_mode="HTML") # Instructions text is fixed for now
+        logger.info("Sent instructions to user %s", user_id)
+
+
+    async def handle_yordam(message: Message, lang: str):
         """
         Handles the "🆘 Yordam" button press and displays help information.
         """
         user_id = str(message.from_user.id)
-        lang = user_data_manager.get_lang(user_id)
-        logger.info(f"Received '🆘 Yordam' from user {user_id}")
+        logger.info("Received '🆘 Yordam' from user %s", user_id)
         # Help text can be put in translation files if they vary by language
         help_text = t(lang, "help_full_text", """
 <b>🆘 Help</b>
@@ -228,45 +183,45 @@ def register_message_handlers(router: Router, user_data_manager: UserDataManager
 - Try again after a few minutes. The bot may be undergoing technical maintenance.
 - If the problem persists, use the contact information in the "👥 My Friend" menu (if available) to contact the administrator.
 """)
-        await message.answer(help_text, parse_mode="HTML") # Help text is fixed for now
-        logger.info(f"Sent help information to user {user_id}")
-
-        # Display the main menu again
-        await message.answer(t(lang, "main_menu_message_prompt", "Main menu:"), reply_markup=create_main_menu_keyboard(lang))
-        logger.info(f"Sent main menu to user {user_id}")
-
-
-    @router.message(
-        F.text.in_([
-            t("ru", "main_menu_button_dustim"),
-            t("uz", "main_menu_button_dustim"),
-            t("en", "main_menu_button_dustim")
-        ])
-    )
-    async def handle_dustim(message: Message):
+        await answer_with_menu(message, help_text, lang, parse_mode="HTML") # Help text is fixed for now
+        logger.info("Sent help information to user %s", user_id)
+
+
+    async def handle_dustim(message: Message, lang: str):
         """
         Handles the "👥 Do'stim" button press, shows a referral link,
         and a placeholder message about referral tracking.
         """
         user_id = str(message.from_user.id)
-        lang = user_data_manager.get_lang(user_id)
-        logger.info(f"Received '👥 Do'stim' from user {user_id}")
+        logger.info("Received '👥 Do'stim' from user %s", user_id)
         bot_username = "your_bot_username"  # IMPORTANT: Replace with your actual bot username (e.g., "my_awesome_vpn_bot")
         referral_link = f"https://t.me/{bot_username}?start={user_id}"
 
-        # Escape special characters for MarkdownV2
-        escaped_link = escape_markdown_v2(referral_link) # Use the new escape utility
-        referral_bonus_info_escaped = escape_markdown_v2(t(lang, "referral_bonus_info", "Invite your friends and get bonuses! (Referral accounting is basic for now)"))
-
-        referral_message = f"""
-{t(lang, "referral_link_message", "Your referral link:")}
-`{escaped_link}`
-
-{referral_bonus_info_escaped}
-"""
-        await message.answer(referral_message, parse_mode="MarkdownV2")
-        logger.info(f"Sent referral link to user {user_id}")
-
-        # Display the main menu again
-        await message.answer(t(lang, "main_menu_message_prompt", "Main menu:"), reply_markup=create_main_menu_keyboard(lang))
-        logger.info(f"Sent main menu to user {user_id}")
+        await answer_with_menu(message, REFERRAL.render(lang, link=referral_link), lang, parse_mode="MarkdownV2")
+        logger.info("Sent referral link to user %s", user_id)
+
+
+    # Reply buttons are dispatched by action name instead of one F.text.in_ filter per button
+    menu_handlers = {
+        "tariflar": handle_tariflar,
+        "kalitlarim": handle_kalitlarim,
+        "accauntim": handle_accauntim,
+        "korsatmalar": handle_korsatmalar,
+        "yordam": handle_yordam,
+        "dustim": handle_dustim,
+    }
+
+    @router.message(MenuButtonFilter())
+    async def handle_menu_button(message: Message, menu_action: str, button_lang: str):
+        handler = menu_handlers.get(menu_action)
+        if handler is None:
+            logger.warning("No handler for menu action '%s'", menu_action)
+            return
+        user_id = str(message.from_user.id)
+        lang = user_data_manager.get_lang(user_id, default=None)
+        if lang is None:
+            # The button text tells us which language the user's keyboard is in
+            lang = button_lang
+            user_data_manager.set_lang(user_id, lang)
+            logger.info("Language %s detected from menu button for user %s", lang, user_id)
+        await handler(message, lang)
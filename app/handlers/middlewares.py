@@ -0,0 +1,134 @@
+"""
+Dispatcher middlewares wrapped around every message and callback query
+handler.
+"""
+
+import functools
+import logging
+import math
+import random
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Router
+from aiogram.types import CallbackQuery, TelegramObject
+
+from app.config import ADMIN_IDS, LOG_SAMPLE_RATE
+from app.data.user_data_manager import UserDataManager
+from app.keyboards.menu_keyboards import KEY_DELETE_CONFIRM_PREFIX
+from app.services.metrics import Metrics
+from app.services.servers import SERVER_CALLBACK_PREFIX
+from app.services.throttling import KEYS, MENU, UserThrottle
+from app.utils.i18n import add_reload_listener, get_translation as t
+from app.utils.logging_setup import reset_log_context, set_log_context
+
+logger = logging.getLogger(__name__)
+
+# Callbacks that create or revoke a key
+_KEY_CALLBACK_PREFIXES = (SERVER_CALLBACK_PREFIX, KEY_DELETE_CONFIRM_PREFIX)
+
+
+@functools.lru_cache(maxsize=256)
+def _throttled_notice(lang: str, seconds: int) -> str:
+    return t(lang, "throttled", "Too many requests. Please try again in {seconds} s.").format(seconds=seconds)
+
+
+add_reload_listener(_throttled_notice.cache_clear)
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """The handler's function name; menu buttons add their action, e.g. "handle_menu_button:tariflar"."""
+    name = data["handler"].callback.__name__
+    if "menu_action" in data:
+        name = f"{name}:{data['menu_action']}"
+    return name
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Stops the updates of users over their limit (see app.services.throttling)
+    before they reach the handler. A throttled callback query is answered
+    with a short notice, which ends the button's loading state; a throttled
+    message gets the notice once per wait and is ignored after that.
+    """
+
+    def __init__(self, throttle: UserThrottle, user_data_manager: UserDataManager):
+        self.throttle = throttle
+        self.user_data_manager = user_data_manager
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in ADMIN_IDS:
+            return await handler(event, data)
+        is_callback = isinstance(event, CallbackQuery)
+        action = KEYS if is_callback and event.data and event.data.startswith(_KEY_CALLBACK_PREFIXES) else MENU
+        wait = self.throttle.take(action, user.id)
+        if not wait:
+            return await handler(event, data)
+        logger.debug("Throttled %s update of user %s for %.1fs.", action, user.id, wait)
+        if is_callback or self.throttle.notify_once(action, user.id, wait):
+            lang = self.user_data_manager.get_lang(str(user.id))
+            await event.answer(_throttled_notice(lang, math.ceil(wait)))
+        return None
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Counts and (sampled) times every handled update under the name of its handler."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        return await self.metrics.measure(handler_name(data), lambda: handler(event, data))
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """
+    Tags the log records of each update with its user and handler and
+    decides whether its INFO records are kept (see app.utils.logging_setup).
+    """
+
+    def __init__(self, sample_rate: float = LOG_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        tokens = set_log_context(str(user.id) if user else None, handler_name(data), sampled)
+        try:
+            return await handler(event, data)
+        finally:
+            reset_log_context(tokens)
+
+
+def register_throttling_middleware(router: Router, throttle: UserThrottle, user_data_manager: UserDataManager):
+    """Register before the other middlewares, so that throttled updates skip them."""
+    middleware = ThrottlingMiddleware(throttle, user_data_manager)
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
+
+
+def register_metrics_middleware(router: Router, metrics: Metrics):
+    middleware = MetricsMiddleware(metrics)
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
+
+
+def register_log_context_middleware(router: Router, sample_rate: float = LOG_SAMPLE_RATE):
+    middleware = LogContextMiddleware(sample_rate)
+    router.message.middleware(middleware)
+    router.callback_query.middleware(middleware)
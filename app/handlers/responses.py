@@ -0,0 +1,52 @@
+"""
+Response composition helpers shared by the handlers.
+
+Each user action should cost as few Bot API calls as Telegram allows:
+content goes out together with the main menu keyboard instead of being
+followed by a separate "Main menu:" message, and callbacks edit the message
+their inline button belongs to instead of posting a new one.
+"""
+
+import logging
+from typing import Any, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, Message
+
+from app.keyboards.menu_keyboards import create_main_menu_keyboard
+
+logger = logging.getLogger(__name__)
+
+
+async def answer_with_menu(message: Message, text: str, lang: str, **kwargs: Any) -> Message:
+    """
+    Sends text with the main menu reply keyboard attached.
+
+    The reply keyboard stays on screen once sent, so attaching it to the
+    content replaces the separate "Main menu:" message. Messages that carry
+    an inline keyboard cannot have it and are sent with theirs as usual.
+    """
+    kwargs.setdefault("reply_markup", create_main_menu_keyboard(lang))
+    return await message.answer(text, **kwargs)
+
+
+async def replace_or_answer(callback_query: CallbackQuery, text: str, **kwargs: Any) -> Optional[Message]:
+    """
+    Replaces the text (and inline keyboard) of the message the callback came
+    from; sends a new message when that one cannot be edited.
+
+    Only inline keyboards can be attached to an edited message.
+    """
+    message = callback_query.message
+    if message is None:
+        return None
+    if message.text is not None:
+        try:
+            edited = await message.edit_text(text, **kwargs)
+            return edited if isinstance(edited, Message) else None
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return None
+            # E.g. the message is too old or no longer accessible
+            logger.info("Could not edit message %s, sending a new one: %s", message.message_id, e)
+    return await message.answer(text, **kwargs)
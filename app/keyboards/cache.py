@@ -0,0 +1,72 @@
+"""
+Per-language keyboard cache.
+
+Keyboard builders decorated with @cached_keyboard build each markup once
+per argument set and return the same object afterwards, so handlers no
+longer rebuild pydantic models and re-run translations on every message.
+Cached markups are shared and must not be mutated.
+
+The JSON form of every cached markup is serialized once as well;
+CachedMarkupSession sends that string instead of re-serializing the markup
+on each request. Everything is dropped when translations or the server
+catalog are reloaded, or a server's health state changes.
+"""
+
+import functools
+import json
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from app.services import servers
+from app.services.health import health_monitor
+from app.utils import i18n
+
+Markup = TypeVar("Markup")
+
+_cached_builders: List[Any] = []
+_serialized_markups: Dict[int, str] = {}
+
+
+def _prune_none(value: Any) -> Any:
+    # Mirrors how aiogram prepares values: None fields are left out
+    if isinstance(value, dict):
+        return {k: _prune_none(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_prune_none(v) for v in value if v is not None]
+    return value
+
+
+def serialize_markup(markup: Any) -> str:
+    """Returns the JSON that aiogram would send for markup."""
+    return json.dumps(_prune_none(markup.model_dump(warnings=False)))
+
+
+def cached_keyboard(builder: Callable[..., Markup]) -> Callable[..., Markup]:
+    """Caches a keyboard builder's result (and its JSON) per argument set."""
+
+    @functools.lru_cache(maxsize=None)
+    def build(*args: Any, **kwargs: Any) -> Markup:
+        markup = builder(*args, **kwargs)
+        _serialized_markups[id(markup)] = serialize_markup(markup)
+        return markup
+
+    _cached_builders.append(build)
+    return functools.wraps(builder)(build)
+
+
+def get_serialized_markup(markup: Any) -> Optional[str]:
+    """Returns the pre-serialized JSON of a cached markup, or None."""
+    return _serialized_markups.get(id(markup))
+
+
+def clear_keyboard_cache() -> None:
+    """Forgets every cached keyboard; they are rebuilt on next use."""
+    # Cached markups are only referenced from the builders' caches, so both
+    # maps are cleared together and an id can never point at a stale JSON.
+    _serialized_markups.clear()
+    for build in _cached_builders:
+        build.cache_clear()
+
+
+i18n.add_reload_listener(clear_keyboard_cache)
+servers.add_reload_listener(clear_keyboard_cache)
+health_monitor.add_change_listener(clear_keyboard_cache)
@@ -1,6 +1,8 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from app.keyboards.cache import cached_keyboard
 from app.utils.i18n import get_translation as t
 
+@cached_keyboard
 def create_language_keyboard(lang_code: str = "ru") -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
         [
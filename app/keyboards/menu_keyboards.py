@@ -1,12 +1,18 @@
+from typing import List, Tuple
+
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
+from app.keyboards.cache import cached_keyboard
+from app.services.health import health_monitor
+from app.services.servers import AUTO_SERVER_ID, SERVER_CALLBACK_PREFIX, available_servers
 from app.utils.i18n import get_translation as t
 
 
+@cached_keyboard
 def create_main_menu_keyboard(lang_code: str = "en") -> ReplyKeyboardMarkup:
     """Define a function to create the main menu keyboard."""
     menu_buttons = [
@@ -19,22 +25,29 @@ def create_main_menu_keyboard(lang_code: str = "en") -> ReplyKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def create_server_location_keyboard(lang_code: str = "en") -> InlineKeyboardMarkup:
-    """Creates an Inline Keyboard Markup for server location selection."""
-    server_buttons = [
-        [InlineKeyboardButton(text=t(lang_code, "server_button_russia"), callback_data="select_server_russia")],
-        [InlineKeyboardButton(text=t(lang_code, "server_button_america"), callback_data="select_server_america")],
-        [InlineKeyboardButton(text=t(lang_code, "server_button_germany"), callback_data="select_server_germany")],
-        [
-            InlineKeyboardButton(
-                text=t(lang_code, "server_button_singapore"), callback_data="select_server_singapore"
-            )
-        ],
-        [InlineKeyboardButton(text=t(lang_code, "button_back_to_main"), callback_data="back_to_main")],
-    ]
+    """
+    Creates an Inline Keyboard Markup for server location selection: an
+    "auto (fastest)" button, then the servers that are not down, unhealthy
+    ones marked.
+    """
+    offered = health_monitor.offered(available_servers())
+    server_buttons = []
+    if len(offered) > 1:
+        server_buttons.append(
+            [InlineKeyboardButton(text=t(lang_code, "server_button_auto"), callback_data=f"{SERVER_CALLBACK_PREFIX}{AUTO_SERVER_ID}")]
+        )
+    for server, unhealthy in offered:
+        text = t(lang_code, server.button_key, server.name)
+        server_buttons.append(
+            [InlineKeyboardButton(text=f"⚠️ {text}" if unhealthy else text, callback_data=server.callback_data)]
+        )
+    server_buttons.append([InlineKeyboardButton(text=t(lang_code, "button_back_to_main"), callback_data="back_to_main")])
     return InlineKeyboardMarkup(inline_keyboard=server_buttons)
 
 
+@cached_keyboard
 def create_accauntim_keyboard(lang_code: str = "en") -> InlineKeyboardMarkup:
     """Creates an Inline Keyboard Markup for the Accauntim menu."""
     accauntim_buttons = [
@@ -42,3 +55,46 @@ def create_accauntim_keyboard(lang_code: str = "en") -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text=t(lang_code, "button_back_to_main"), callback_data="back_to_main")],
     ]
     return InlineKeyboardMarkup(inline_keyboard=accauntim_buttons)
+
+
+# Callback data of the key list: "keys_page:<page>", "keys_del:<page>:<key uuid hex>"
+# asks to delete a key and "keys_delok:<page>:<key uuid hex>" confirms it
+KEYS_PAGE_PREFIX = "keys_page:"
+KEY_DELETE_PREFIX = "keys_del:"
+KEY_DELETE_CONFIRM_PREFIX = "keys_delok:"
+
+
+def create_keys_page_keyboard(
+    lang_code: str, page: int, pages: int, deletable: List[Tuple[int, str]]
+) -> InlineKeyboardMarkup:
+    """
+    Creates the inline keyboard under a page of the key list: a delete button
+    per (number, uuid hex) in deletable, then prev/next buttons when there is
+    more than one page. Not cached, it differs per user and page.
+    """
+    rows = []
+    if deletable:
+        rows.append([
+            InlineKeyboardButton(text=f"🗑 {number}", callback_data=f"{KEY_DELETE_PREFIX}{page}:{key_id}")
+            for number, key_id in deletable
+        ])
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"{KEYS_PAGE_PREFIX}{page - 1}"))
+        navigation.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=f"{KEYS_PAGE_PREFIX}{page}"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"{KEYS_PAGE_PREFIX}{page + 1}"))
+        rows.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def create_key_delete_confirm_keyboard(lang_code: str, page: int, number: int, key_id: str) -> InlineKeyboardMarkup:
+    """Creates the keyboard asking to confirm deleting key number on page."""
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text=t(lang_code, "button_delete_key", "🗑 Delete key {number}").format(number=number),
+            callback_data=f"{KEY_DELETE_CONFIRM_PREFIX}{page}:{key_id}",
+        ),
+        InlineKeyboardButton(text=t(lang_code, "button_cancel", "✖️ Cancel"), callback_data=f"{KEYS_PAGE_PREFIX}{page}"),
+    ]])
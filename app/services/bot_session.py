@@ -0,0 +1,29 @@
+from aiohttp import FormData
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+
+from app.keyboards.cache import get_serialized_markup
+
+
+class CachedMarkupSession(AiohttpSession):
+    """
+    AiohttpSession that sends the pre-serialized JSON of cached keyboards
+    instead of dumping and re-encoding the markup model on every request.
+    """
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        serialized = get_serialized_markup(getattr(method, "reply_markup", None))
+        if serialized is None:
+            return super().build_form_data(bot, method)
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", serialized)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
@@ -0,0 +1,382 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, TextIO
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError
+
+from app.config import BROADCAST_BATCH_SIZE, BROADCAST_DIR, BROADCAST_RATE, I18N_DEFAULT_LANG
+from app.data.user_record import user_order_key
+from app.services.outbound import bulk_priority
+
+logger = logging.getLogger(__name__)
+
+# Per-recipient outcomes
+SENT = "sent"
+BLOCKED = "blocked"
+DEACTIVATED = "deactivated"
+NOT_FOUND = "not_found"
+FAILED = "failed"
+
+# Job states
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+
+_SECTION = re.compile(r"^\[([a-z]{2,3})\][ \t]*$", re.MULTILINE)
+
+# Progress is logged at most this often (seconds)
+_PROGRESS_LOG_INTERVAL = 10.0
+
+
+def parse_templates(text: str, default_lang: str = I18N_DEFAULT_LANG) -> Dict[str, str]:
+    """
+    Splits a broadcast text into per-language templates. Each "[xx]" line
+    starts the text for language xx; text before the first section (or a
+    text without sections) is the default for every other language:
+
+        Maintenance tonight from 02:00 to 03:00.
+        [ru]
+        Сегодня ночью с 02:00 до 03:00 технические работы.
+    """
+    parts = _SECTION.split(text)
+    templates = {}
+    if parts[0].strip():
+        templates[default_lang] = parts[0].strip()
+    for lang, body in zip(parts[1::2], parts[2::2]):
+        if body.strip():
+            templates[lang] = body.strip()
+    return templates
+
+
+def classify_error(error: TelegramAPIError) -> str:
+    """Maps a failed send to a recipient outcome."""
+    if isinstance(error, TelegramForbiddenError):
+        return DEACTIVATED if "deactivated" in error.message else BLOCKED
+    if isinstance(error, TelegramBadRequest) and "chat not found" in error.message:
+        return NOT_FOUND
+    return FAILED
+
+
+class BroadcastJob:
+    """
+    Persistent state of one broadcast.
+
+    cursor is the last user (in user_order_key order) of the last finished
+    batch; every recipient up to it has an outcome in counts. Outcomes of
+    later recipients are appended to the outcomes file as they happen, so a
+    resumed job skips them instead of messaging those users twice.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        templates: Dict[str, str],
+        parse_mode: Optional[str] = None,
+        admin_chat_id: Optional[int] = None,
+        total: int = 0,
+        cursor: Optional[str] = None,
+        counts: Optional[Dict[str, int]] = None,
+        status: str = RUNNING,
+        created: Optional[float] = None,
+        default_lang: str = I18N_DEFAULT_LANG,
+    ):
+        self.job_id = job_id
+        self.templates = templates
+        self.parse_mode = parse_mode
+        self.admin_chat_id = admin_chat_id
+        self.total = total
+        self.cursor = cursor
+        self.counts = counts or {}
+        self.status = status
+        self.created = created or time.time()
+        self.default_lang = default_lang
+
+    @property
+    def processed(self) -> int:
+        return sum(self.counts.values())
+
+    def template_for(self, lang: Optional[str]) -> str:
+        template = self.templates.get(lang) if lang else None
+        if template is None:
+            template = self.templates.get(self.default_lang) or next(iter(self.templates.values()))
+        return template
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "templates": self.templates,
+            "parse_mode": self.parse_mode,
+            "admin_chat_id": self.admin_chat_id,
+            "total": self.total,
+            "cursor": self.cursor,
+            "counts": self.counts,
+            "status": self.status,
+            "created": self.created,
+            "default_lang": self.default_lang,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BroadcastJob":
+        return cls(**data)
+
+
+class Broadcaster:
+    """
+    Sends one message to every stored user, one broadcast at a time.
+
+    Recipients are streamed from the user store in user_order_key order
+    (iter_users), so memory does not grow with the user base. Sends are
+    paced at rate messages/s and go through the outbound rate limiter's bulk
+    lane, so replies to users are never queued behind a broadcast. The job
+    state is checkpointed after every batch; a broadcast interrupted by a
+    restart continues where it stopped (resume_pending()).
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        user_data_manager: Any,
+        state_dir: Path = BROADCAST_DIR,
+        rate: float = BROADCAST_RATE,
+        batch_size: int = BROADCAST_BATCH_SIZE,
+    ):
+        self.bot = bot
+        self.user_data_manager = user_data_manager
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        self.rate = rate
+        self.batch_size = batch_size
+        self.job: Optional[BroadcastJob] = None
+        self._task: Optional[asyncio.Task] = None
+        self._next_slot = 0.0
+        self._run_started = 0.0
+        self._processed_at_start = 0
+        self._last_progress_log = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _state_path(self, job_id: str) -> Path:
+        return self.state_dir / f"{job_id}.json"
+
+    def _outcomes_path(self, job_id: str) -> Path:
+        return self.state_dir / f"{job_id}.outcomes"
+
+    def _save(self, job: BroadcastJob) -> None:
+        """Writes the job state atomically (temp file + rename)."""
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.state_dir), prefix=f".{job.job_id}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(job.to_dict(), f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._state_path(job.job_id))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    # ---- control -------------------------------------------------------
+
+    def start(
+        self, templates: Dict[str, str], parse_mode: Optional[str] = None, admin_chat_id: Optional[int] = None
+    ) -> BroadcastJob:
+        """Creates a broadcast and starts sending it in the background."""
+        if self.running:
+            raise RuntimeError("A broadcast is already running.")
+        if not templates:
+            raise ValueError("A broadcast needs a message text.")
+        job = BroadcastJob(
+            job_id=time.strftime("%Y%m%d-%H%M%S"),
+            templates=templates,
+            parse_mode=parse_mode,
+            admin_chat_id=admin_chat_id,
+            total=self.user_data_manager.count_users(),
+        )
+        self._save(job)
+        self._launch(job)
+        logger.info("Broadcast %s started for %s users in %s.", job.job_id, job.total, sorted(templates))
+        return job
+
+    def resume_pending(self) -> Optional[BroadcastJob]:
+        """Continues a broadcast that was still running when the bot stopped."""
+        if self.running:
+            return self.job
+        for path in sorted(self.state_dir.glob("*.json")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    job = BroadcastJob.from_dict(json.load(f))
+            except (OSError, ValueError, TypeError) as e:
+                logger.error("Skipping unreadable broadcast state %s: %s", path, e)
+                continue
+            if job.status == RUNNING:
+                logger.info("Resuming broadcast %s after user %s (%s/%s).", job.job_id, job.cursor, job.processed, job.total)
+                self._launch(job)
+                return job
+        return None
+
+    def cancel(self) -> bool:
+        """Stops the running broadcast after the recipient being sent to."""
+        if not self.running:
+            return False
+        self.job.status = CANCELLED
+        return True
+
+    def _launch(self, job: BroadcastJob) -> None:
+        self.job = job
+        self._run_started = time.monotonic()
+        self._processed_at_start = job.processed
+        self._task = asyncio.create_task(self._run(job))
+
+    async def wait(self) -> None:
+        """Waits for the running broadcast to finish."""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def close(self) -> None:
+        """Stops sending; a running broadcast stays resumable."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # ---- progress ------------------------------------------------------
+
+    def progress(self) -> Optional[Dict[str, Any]]:
+        """Progress of the current (or last) broadcast, with throughput and ETA."""
+        job = self.job
+        if job is None:
+            return None
+        processed = job.processed
+        elapsed = time.monotonic() - self._run_started
+        rate = (processed - self._processed_at_start) / elapsed if elapsed > 0 else 0.0
+        remaining = max(job.total - processed, 0)
+        return {
+            "job_id": job.job_id,
+            "status": job.status,
+            "processed": processed,
+            "total": job.total,
+            "counts": dict(job.counts),
+            "rate": rate,
+            "eta": remaining / rate if rate and job.status == RUNNING else None,
+        }
+
+    def format_progress(self) -> str:
+        progress = self.progress()
+        if progress is None:
+            return "No broadcast has been started."
+        percent = 100.0 * progress["processed"] / progress["total"] if progress["total"] else 100.0
+        counts = ", ".join(f"{outcome} {count}" for outcome, count in sorted(progress["counts"].items())) or "nothing sent yet"
+        eta = f", ETA {progress['eta']:.0f}s" if progress["eta"] is not None else ""
+        return (
+            f"Broadcast {progress['job_id']} ({progress['status']}): {progress['processed']}/{progress['total']} "
+            f"({percent:.1f}%): {counts}; {progress['rate']:.1f} msg/s{eta}"
+        )
+
+    # ---- sending -------------------------------------------------------
+
+    def _recorded_outcomes(self, job: BroadcastJob) -> Dict[str, str]:
+        """Outcomes recorded by earlier runs of the job, user_id -> outcome."""
+        path = self._outcomes_path(job.job_id)
+        recorded = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    user_id, _, outcome = line.rstrip("\n").partition("\t")
+                    if outcome:
+                        recorded[user_id] = outcome
+        return recorded
+
+    async def _pace(self) -> None:
+        now = time.monotonic()
+        slot = max(self._next_slot, now)
+        self._next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _send_one(self, job: BroadcastJob, user_id: str, lang: Optional[str], outcomes: TextIO) -> None:
+        try:
+            await self.bot.send_message(int(user_id), job.template_for(lang), parse_mode=job.parse_mode)
+            outcome = SENT
+        except TelegramAPIError as e:
+            outcome = classify_error(e)
+            if outcome == FAILED:
+                logger.warning("Broadcast %s failed for user %s: %s", job.job_id, user_id, e)
+        except ValueError:
+            outcome = NOT_FOUND  # Not a Telegram chat id
+        outcomes.write(f"{user_id}\t{outcome}\n")
+        outcomes.flush()
+        job.counts[outcome] = job.counts.get(outcome, 0) + 1
+
+    async def _send_batch(self, job: BroadcastJob, batch: list, skip: Set[str], outcomes: TextIO) -> None:
+        sends = []
+        try:
+            for user_id, lang in batch:
+                if job.status != RUNNING:
+                    break
+                if user_id in skip:
+                    continue
+                await self._pace()
+                sends.append(asyncio.create_task(self._send_one(job, user_id, lang, outcomes)))
+        finally:
+            # Messages already handed to Telegram must get their outcome recorded,
+            # even when shutdown interrupts the batch; otherwise a resume resends them
+            pending = asyncio.gather(*sends)
+            try:
+                await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                await pending
+                raise
+        if job.status == RUNNING:
+            job.cursor = batch[-1][0]
+        self._save(job)
+        now = time.monotonic()
+        if now - self._last_progress_log >= _PROGRESS_LOG_INTERVAL:
+            self._last_progress_log = now
+            logger.info(self.format_progress())
+
+    async def _run(self, job: BroadcastJob) -> None:
+        recorded = self._recorded_outcomes(job)
+        # The outcomes file is authoritative: it also holds sends made after the last checkpoint
+        job.counts = {}
+        for outcome in recorded.values():
+            job.counts[outcome] = job.counts.get(outcome, 0) + 1
+        self._processed_at_start = job.processed
+        cursor_key = user_order_key(job.cursor) if job.cursor is not None else None
+        skip = {
+            user_id for user_id in recorded if cursor_key is None or user_order_key(user_id) > cursor_key
+        }
+        outcomes = open(self._outcomes_path(job.job_id), "a", encoding="utf-8")
+        try:
+            with bulk_priority():
+                batch = []
+                for entry in self.user_data_manager.iter_users(after=job.cursor):
+                    if job.status != RUNNING:
+                        break
+                    batch.append(entry)
+                    if len(batch) >= self.batch_size:
+                        await self._send_batch(job, batch, skip, outcomes)
+                        batch = []
+                if batch and job.status == RUNNING:
+                    await self._send_batch(job, batch, skip, outcomes)
+            if job.status == RUNNING:
+                job.status = DONE
+        except Exception as e:
+            logger.error("Broadcast %s stopped: %s", job.job_id, e, exc_info=True)
+            raise
+        finally:
+            outcomes.close()
+            self._save(job)
+        logger.info("Broadcast %s finished. %s", job.job_id, self.format_progress())
+        if job.admin_chat_id is not None:
+            try:
+                await self.bot.send_message(job.admin_chat_id, self.format_progress())
+            except TelegramAPIError as e:
+                logger.error("Failed to report broadcast %s to admin: %s", job.job_id, e)
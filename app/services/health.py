@@ -0,0 +1,232 @@
+"""
+Background health checks of the VPN servers.
+
+Every offered server is probed concurrently with a TCP connect (plus a TLS
+handshake for tls servers) under a strict timeout. Each server keeps rolling
+stats over its last probes, from which it is UP, DEGRADED (offered with a
+warning mark) or DOWN (not offered); a server that was never probed is
+UNKNOWN and offered as usual. The server keyboard reads the current states
+and is rebuilt whenever one of them changes.
+"""
+
+import asyncio
+import logging
+import ssl
+import statistics
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.config import (
+    HEALTH_CHECK_CONCURRENCY,
+    HEALTH_CHECK_INTERVAL,
+    HEALTH_CHECK_TIMEOUT,
+    HEALTH_DOWN_AFTER,
+    HEALTH_MIN_AVAILABILITY,
+    HEALTH_WINDOW,
+)
+from app.services.servers import Server, available_servers
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN = "unknown"
+UP = "up"
+DEGRADED = "degraded"
+DOWN = "down"
+
+# Probes only check that a handshake completes; VPN servers often present
+# certificates for a fronting domain, so they are not verified.
+_PROBE_SSL = ssl.create_default_context()
+_PROBE_SSL.check_hostname = False
+_PROBE_SSL.verify_mode = ssl.CERT_NONE
+
+
+async def probe(server: Server, timeout: float = HEALTH_CHECK_TIMEOUT) -> Optional[float]:
+    """
+    Connects to a server (with a TLS handshake for tls servers) and returns
+    the seconds it took, or None if it failed or took longer than timeout.
+    """
+    params = dict(server.params)
+    tls = server.security == "tls"
+    start = time.perf_counter()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                server.address,
+                server.port,
+                ssl=_PROBE_SSL if tls else None,
+                server_hostname=str(params.get("sni") or server.address) if tls else None,
+            ),
+            timeout,
+        )
+    except (OSError, asyncio.TimeoutError, ssl.SSLError) as e:
+        logger.debug("Probe of server %s (%s:%s) failed: %r", server.id, server.address, server.port, e)
+        return None
+    latency = time.perf_counter() - start
+    writer.close()
+    try:
+        await asyncio.wait_for(writer.wait_closed(), timeout)
+    except (OSError, asyncio.TimeoutError, ssl.SSLError):
+        pass
+    return latency
+
+
+class ServerHealth:
+    """Rolling probe results of one server endpoint."""
+
+    def __init__(self, endpoint: Tuple[str, int], window: int = HEALTH_WINDOW):
+        self.endpoint = endpoint
+        self.samples: Deque[Optional[float]] = deque(maxlen=window)  # latency, or None for a failure
+        self.consecutive_failures = 0
+        self.availability = 0.0
+        self.latency: Optional[float] = None  # median of the successful probes in the window
+        self.last_probe = 0.0
+
+    def record(self, latency: Optional[float]) -> None:
+        self.samples.append(latency)
+        self.last_probe = time.time()
+        self.consecutive_failures = 0 if latency is not None else self.consecutive_failures + 1
+        successes = [sample for sample in self.samples if sample is not None]
+        self.availability = len(successes) / len(self.samples)
+        self.latency = statistics.median(successes) if successes else None
+
+    def state(self, down_after: int = HEALTH_DOWN_AFTER, min_availability: float = HEALTH_MIN_AVAILABILITY) -> str:
+        if not self.samples:
+            return UNKNOWN
+        if self.consecutive_failures >= down_after:
+            return DOWN
+        if self.consecutive_failures or self.availability < min_availability:
+            return DEGRADED
+        return UP
+
+
+class HealthMonitor:
+    """
+    Probes the servers every interval seconds and answers which of them to
+    offer. servers returns the servers to probe (the offered ones by default).
+    """
+
+    def __init__(
+        self,
+        interval: float = HEALTH_CHECK_INTERVAL,
+        timeout: float = HEALTH_CHECK_TIMEOUT,
+        concurrency: int = HEALTH_CHECK_CONCURRENCY,
+        window: int = HEALTH_WINDOW,
+        down_after: int = HEALTH_DOWN_AFTER,
+        min_availability: float = HEALTH_MIN_AVAILABILITY,
+        servers: Callable[[], Iterable[Server]] = available_servers,
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.window = window
+        self.down_after = down_after
+        self.min_availability = min_availability
+        self.servers = servers
+        self._health: Dict[str, ServerHealth] = {}
+        self._states: Dict[str, str] = {}
+        self._listeners: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def add_change_listener(self, callback: Callable[[], None]) -> None:
+        """Registers a callback to run whenever a server changes state."""
+        self._listeners.append(callback)
+
+    def health(self, server_id: str) -> Optional[ServerHealth]:
+        return self._health.get(server_id)
+
+    def state(self, server_id: str) -> str:
+        return self._states.get(server_id, UNKNOWN)
+
+    async def probe_all(self) -> None:
+        """Probes every server once, at most concurrency at a time."""
+        servers = list(self.servers())
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def bounded_probe(server: Server) -> Optional[float]:
+            async with slots:
+                return await probe(server, self.timeout)
+
+        results = await asyncio.gather(*(bounded_probe(server) for server in servers))
+        health = {}
+        for server, latency in zip(servers, results):
+            endpoint = (server.address, server.port)
+            stats = self._health.get(server.id)
+            if stats is None or stats.endpoint != endpoint:
+                # New server, or its address changed: earlier results say nothing about it
+                stats = ServerHealth(endpoint, self.window)
+            stats.record(latency)
+            health[server.id] = stats
+        self._health = health
+        self._update_states()
+
+    def _update_states(self) -> None:
+        states = {
+            server_id: stats.state(self.down_after, self.min_availability) for server_id, stats in self._health.items()
+        }
+        if states == self._states:
+            return
+        for server_id, state in states.items():
+            if state != self._states.get(server_id, UNKNOWN):
+                stats = self._health[server_id]
+                latency = f"{stats.latency * 1000:.0f} ms" if stats.latency is not None else "-"
+                logger.info(
+                    "Server %s is %s (availability %.0f%%, latency %s).",
+                    server_id,
+                    state,
+                    stats.availability * 100,
+                    latency,
+                )
+        self._states = states
+        for callback in self._listeners:
+            callback()
+
+    def offered(self, servers: Iterable[Server]) -> List[Tuple[Server, bool]]:
+        """
+        The servers to offer with whether each should carry a warning mark.
+        DOWN servers are left out unless every server is down, which points
+        at the bot's own connectivity; then all are offered, marked.
+        """
+        servers = list(servers)
+        offered = [
+            (server, self.state(server.id) == DEGRADED) for server in servers if self.state(server.id) != DOWN
+        ]
+        return offered if offered else [(server, True) for server in servers]
+
+    def fastest(self, servers: Iterable[Server]) -> Optional[Server]:
+        """The UP server with the lowest median latency, else the first offered one."""
+        servers = list(servers)
+        measured = [
+            (self._health[server.id].latency, server)
+            for server in servers
+            if self.state(server.id) == UP and self._health[server.id].latency is not None
+        ]
+        if measured:
+            return min(measured, key=lambda item: item[0])[1]
+        offered = self.offered(servers)
+        return offered[0][0] if offered else None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error("Server health check failed: %s", e, exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Shared by the server keyboard and the handlers; started from main
+health_monitor = HealthMonitor()
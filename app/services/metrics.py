@@ -0,0 +1,314 @@
+"""
+Handler, storage and Bot API metrics in the Prometheus text format.
+
+Every handled update is counted per handler, errors included. A sampled
+share of them (METRICS_SAMPLE_RATE) is also timed, and its time is split
+into user storage calls, link generation and Bot API calls; the rest is
+"other". Storage and link generator instances are timed by wrapping their
+methods with instrument(), Bot API calls by the ApiMetrics session
+middleware, which also keeps per-method stats of every call. Outside a
+sampled update the wrappers cost one context variable lookup.
+
+serve_metrics() exposes the numbers at http://<host>:<port>/metrics.
+"""
+
+import asyncio
+import functools
+import logging
+import random
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+
+from app.config import METRICS_HOST, METRICS_PORT, METRICS_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+STORAGE = "storage"
+LINKS = "links"
+BOT_API = "bot_api"
+OTHER = "other"
+PARTS = (STORAGE, LINKS, BOT_API, OTHER)
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STORAGE_METHODS = ("get_user_data", "update_user_data", "get_lang", "set_lang", "transaction")
+LINK_METHODS = ("generate_vpn_link", "render_key", "generate_many")
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class HandlerStats:
+    __slots__ = ("updates", "errors", "seconds", "parts")
+
+    def __init__(self):
+        self.updates = 0
+        self.errors = 0
+        self.seconds = Histogram()
+        self.parts = {part: Histogram() for part in PARTS}
+
+
+class _UpdateTimes:
+    """Time spent per part by the sampled update being handled."""
+
+    __slots__ = ("seconds", "active")
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PARTS, 0.0)
+        # Parts being timed right now, so that nested calls (get_lang calling
+        # get_user_data) are not counted twice
+        self.active: Set[str] = set()
+
+
+_current: ContextVar[Optional[_UpdateTimes]] = ContextVar("metrics_update", default=None)
+
+
+class Metrics:
+    """The collected numbers; shared by the middlewares and the endpoint."""
+
+    def __init__(self, sample_rate: float = METRICS_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.handlers: Dict[str, HandlerStats] = {}
+        # Bot API method -> [calls, errors, Histogram]
+        self.api: Dict[str, List[Any]] = {}
+
+    # ---- updates ---------------------------------------------------------
+
+    def handler(self, name: str) -> HandlerStats:
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats()
+        return stats
+
+    def sample(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    async def measure(self, name: str, call: Callable[[], Any]) -> Any:
+        """Runs the awaitable returned by call() as an update of handler name."""
+        stats = self.handler(name)
+        stats.updates += 1
+        if not self.sample():
+            try:
+                return await call()
+            except Exception:
+                stats.errors += 1
+                raise
+        times = _UpdateTimes()
+        token = _current.set(times)
+        start = time.perf_counter()
+        try:
+            return await call()
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            stats.seconds.observe(elapsed)
+            seconds = times.seconds
+            seconds[OTHER] = max(0.0, elapsed - seconds[STORAGE] - seconds[LINKS] - seconds[BOT_API])
+            for part, histogram in stats.parts.items():
+                histogram.observe(seconds[part])
+
+    # ---- Bot API ---------------------------------------------------------
+
+    def observe_api_call(self, method: str, seconds: float, failed: bool) -> None:
+        stats = self.api.get(method)
+        if stats is None:
+            stats = self.api[method] = [0, 0, Histogram()]
+        stats[0] += 1
+        stats[1] += failed
+        stats[2].observe(seconds)
+
+    # ---- export ----------------------------------------------------------
+
+    def render(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP vpnbot_metrics_sample_rate Share of updates whose time is measured.",
+            "# TYPE vpnbot_metrics_sample_rate gauge",
+            f"vpnbot_metrics_sample_rate {self.sample_rate}",
+            "# HELP vpnbot_updates_total Updates handled, per handler.",
+            "# TYPE vpnbot_updates_total counter",
+        ]
+        handlers = sorted(self.handlers.items())
+        lines += [f'vpnbot_updates_total{{handler="{_label(name)}"}} {stats.updates}' for name, stats in handlers]
+        lines += [
+            "# HELP vpnbot_update_errors_total Updates whose handler raised, per handler.",
+            "# TYPE vpnbot_update_errors_total counter",
+        ]
+        lines += [f'vpnbot_update_errors_total{{handler="{_label(name)}"}} {stats.errors}' for name, stats in handlers]
+        lines += [
+            "# HELP vpnbot_handler_seconds Handling time of sampled updates.",
+            "# TYPE vpnbot_handler_seconds histogram",
+        ]
+        for name, stats in handlers:
+            _histogram_lines(lines, "vpnbot_handler_seconds", f'handler="{_label(name)}"', stats.seconds)
+        lines += [
+            "# HELP vpnbot_handler_part_seconds Handling time of sampled updates spent in storage, links, bot_api and other.",
+            "# TYPE vpnbot_handler_part_seconds histogram",
+        ]
+        for name, stats in handlers:
+            for part, histogram in stats.parts.items():
+                _histogram_lines(lines, "vpnbot_handler_part_seconds", f'handler="{_label(name)}",part="{part}"', histogram)
+        api = sorted(self.api.items())
+        lines += ["# HELP vpnbot_bot_api_calls_total Bot API calls, per method.", "# TYPE vpnbot_bot_api_calls_total counter"]
+        lines += [f'vpnbot_bot_api_calls_total{{method="{_label(method)}"}} {calls}' for method, (calls, _, _) in api]
+        lines += [
+            "# HELP vpnbot_bot_api_errors_total Bot API calls that failed, per method.",
+            "# TYPE vpnbot_bot_api_errors_total counter",
+        ]
+        lines += [f'vpnbot_bot_api_errors_total{{method="{_label(method)}"}} {errors}' for method, (_, errors, _) in api]
+        lines += [
+            "# HELP vpnbot_bot_api_seconds Bot API call time, rate limiter waits included.",
+            "# TYPE vpnbot_bot_api_seconds histogram",
+        ]
+        for method, (_, _, histogram) in api:
+            _histogram_lines(lines, "vpnbot_bot_api_seconds", f'method="{_label(method)}"', histogram)
+        return "\n".join(lines) + "\n"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(lines: List[str], name: str, labels: str, histogram: Histogram) -> None:
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+# ---- instrumentation -----------------------------------------------------
+
+class _TimedContext:
+    """Times entering and leaving an async context manager (not its body)."""
+
+    __slots__ = ("_context", "_part")
+
+    def __init__(self, context: Any, part: str):
+        self._context = context
+        self._part = part
+
+    async def __aenter__(self) -> Any:
+        return await _timed(self._part, self._context.__aenter__)
+
+    async def __aexit__(self, *exc_info: Any) -> Any:
+        return await _timed(self._part, self._context.__aexit__, *exc_info)
+
+
+async def _timed(part: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    times = _current.get()
+    if times is None or part in times.active:
+        return await func(*args, **kwargs)
+    times.active.add(part)
+    start = time.perf_counter()
+    try:
+        return await func(*args, **kwargs)
+    finally:
+        times.active.discard(part)
+        times.seconds[part] += time.perf_counter() - start
+
+
+def _wrap(part: str, func: Callable[..., Any], context: bool) -> Callable[..., Any]:
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def timed_async(*args: Any, **kwargs: Any) -> Any:
+            return await _timed(part, func, *args, **kwargs)
+
+        return timed_async
+
+    if context:
+        @functools.wraps(func)
+        def timed_context(*args: Any, **kwargs: Any) -> Any:
+            return _TimedContext(func(*args, **kwargs), part)
+
+        return timed_context
+
+    @functools.wraps(func)
+    def timed(*args: Any, **kwargs: Any) -> Any:
+        times = _current.get()
+        if times is None or part in times.active:
+            return func(*args, **kwargs)
+        times.active.add(part)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            times.active.discard(part)
+            times.seconds[part] += time.perf_counter() - start
+
+    return timed
+
+
+def instrument(obj: Any, part: str, methods: Iterable[str], contexts: Tuple[str, ...] = ("transaction",)) -> Any:
+    """
+    Times the given methods of obj (those it has) as part in sampled
+    updates by replacing them on the instance; methods named in contexts
+    return async context managers. Returns obj.
+    """
+    for name in methods:
+        method = getattr(obj, name, None)
+        if callable(method) and not getattr(method, "__metrics_part__", None):
+            wrapper = _wrap(part, method, name in contexts)
+            wrapper.__metrics_part__ = part
+            setattr(obj, name, wrapper)
+    return obj
+
+
+class ApiMetrics(BaseRequestMiddleware):
+    """Session middleware timing every Bot API call."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Response:
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = await _timed(BOT_API, make_request, bot, method)
+            failed = False
+            return response
+        finally:
+            self.metrics.observe_api_call(method.__api_method__, time.perf_counter() - start, failed)
+
+
+async def serve_metrics(metrics: Metrics, host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """Starts the /metrics endpoint; cleanup() the returned runner to stop it."""
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics.", host, port)
+    return runner
+
+
+# Shared by the middlewares, the instrumented components and the endpoint
+metrics = Metrics()
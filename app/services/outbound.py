@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+
+from app.config import (
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_MAX_RETRIES,
+)
+from app.services.token_buckets import TokenBuckets
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+
+# Lane of the calls made from the current task; see bulk_priority()
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=INTERACTIVE)
+
+# Calls that post into a chat and count against Telegram's flood limits
+_LIMITED_PREFIXES = ("send", "edit", "copy", "forward")
+_UNLIMITED_METHODS = {"sendChatAction"}
+
+
+@contextmanager
+def bulk_priority() -> Iterator[None]:
+    """Marks the calls made inside the block as bulk traffic (e.g. broadcasts)."""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_rate_limited(method: TelegramMethod) -> bool:
+    name = method.__api_method__
+    return name.startswith(_LIMITED_PREFIXES) and name not in _UNLIMITED_METHODS
+
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """
+    Session middleware that paces messages to Telegram's flood limits.
+
+    Every call that posts into a chat first waits for its chat's bucket, then
+    queues for the global bucket. The global queue has two lanes and always
+    serves interactive replies before bulk traffic. Buckets use GCRA: each
+    one is a single float, the time its next call is due ("theoretical
+    arrival time"), so tracking many chats stays cheap (see
+    app.services.token_buckets).
+
+    A 429 response blocks the chat (or, without a chat, every chat) for
+    retry_after seconds and the call is retried. Other calls, such as
+    answerCallbackQuery, pass straight through.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = OUTBOUND_GLOBAL_RATE,
+        chat_rate: float = OUTBOUND_CHAT_RATE,
+        chat_burst: int = OUTBOUND_CHAT_BURST,
+        max_retries: int = OUTBOUND_MAX_RETRIES,
+    ):
+        # Global slots are spaced evenly: a burst on top of the full rate
+        # would overshoot Telegram's limit within the same second
+        self.global_interval = 1.0 / global_rate
+        self.global_tolerance = 0.0
+        self.chat_buckets = TokenBuckets(chat_rate, chat_burst)
+        self.max_retries = max_retries
+        self._global_tat = 0.0
+        self._lanes: Tuple[Deque[asyncio.Future], Deque[asyncio.Future]] = (deque(), deque())
+        self._wakeup: Optional[asyncio.Event] = None
+        self._grant_task: Optional[asyncio.Task] = None
+        # Metrics
+        self.sent = 0
+        self.retried = 0
+        self.waiting_for_chat = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # ---- buckets ---------------------------------------------------------
+
+    def _take_global(self, now: float) -> float:
+        """Takes a global slot if one is free; otherwise returns the wait."""
+        tat = max(self._global_tat, now)
+        delay = tat - self.global_tolerance - now
+        if delay > 0:
+            return delay
+        self._global_tat = tat + self.global_interval
+        return 0.0
+
+    async def _acquire_global(self, priority: int) -> None:
+        if not self._lanes[INTERACTIVE] and not self._lanes[BULK] and not self._take_global(time.monotonic()):
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(future)
+        if self._grant_task is None or self._grant_task.done():
+            self._wakeup = asyncio.Event()
+            self._grant_task = asyncio.create_task(self._grant_loop())
+        self._wakeup.set()
+        await future
+
+    async def _grant_loop(self) -> None:
+        while True:
+            lane = self._lanes[INTERACTIVE] or self._lanes[BULK]
+            if not lane:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._take_global(time.monotonic())
+            if delay:
+                # Re-check the lanes afterwards: an interactive call may have arrived
+                await asyncio.sleep(delay)
+                continue
+            future = lane.popleft()
+            if future.done():
+                # Its caller was cancelled; give the slot back
+                self._global_tat -= self.global_interval
+            else:
+                future.set_result(None)
+
+    async def acquire(self, chat_id: Any = None, priority: Optional[int] = None) -> None:
+        """Waits until a message may be sent to chat_id."""
+        start = time.monotonic()
+        if chat_id is not None:
+            delay = self.chat_buckets.reserve(chat_id, start)
+            if delay:
+                self.waiting_for_chat += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self.waiting_for_chat -= 1
+        await self._acquire_global(_priority.get() if priority is None else priority)
+        waited = time.monotonic() - start
+        self.wait_count += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def block(self, chat_id: Any, seconds: float) -> None:
+        """Holds back messages to chat_id (all chats if None) for the given time."""
+        until = time.monotonic() + seconds
+        if chat_id is None:
+            self._global_tat = max(self._global_tat, until + self.global_tolerance)
+        else:
+            self.chat_buckets.block(chat_id, until)
+
+    # ---- middleware ------------------------------------------------------
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        if not is_rate_limited(method):
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 0
+        while True:
+            await self.acquire(chat_id)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.retried += 1
+                logger.warning(
+                    "Flood limit on %s to chat %s: retry after %ss (attempt %s/%s).",
+                    method.__api_method__,
+                    chat_id,
+                    e.retry_after,
+                    attempt,
+                    self.max_retries,
+                )
+                self.block(chat_id, e.retry_after)
+                if attempt > self.max_retries:
+                    raise
+                continue
+            self.sent += 1
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Current queue depth and wait times."""
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "waiting_for_chat": self.waiting_for_chat,
+            "queued_interactive": len(self._lanes[INTERACTIVE]),
+            "queued_bulk": len(self._lanes[BULK]),
+            "tracked_chats": len(self.chat_buckets),
+            "waits": self.wait_count,
+            "wait_avg": self.wait_total / self.wait_count if self.wait_count else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+    async def close(self) -> None:
+        if self._grant_task is not None:
+            self._grant_task.cancel()
+            self._grant_task = None
+        logger.info("Outbound rate limiter stats: %s", self.stats())
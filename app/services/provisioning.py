@@ -0,0 +1,484 @@
+"""
+Key provisioning through the servers' management APIs.
+
+A key is a random UUID that a server only accepts once it is registered
+there. For servers with an "api_url", every new and revoked key first
+becomes an entry in a durable outbox (an append-only JSONL file); one worker
+per server pushes the pending entries in batches and retries failed pushes
+with exponential backoff, so an entry survives restarts until its server has
+answered. A new key is added to the user's keys only once its server
+accepted it.
+
+Management API, one call per batch:
+
+    POST <api_url>/users/batch
+    Authorization: Bearer <api_token>
+    Idempotency-Key: <batch id, the same for every retry of the batch>
+
+    {"add": [{"id": "<uuid>", "email": "<user id>", "protocol": "vless"}],
+     "remove": ["<uuid>", ...]}
+
+A 2xx response means the batch was applied, except for the ids listed in
+its optional "rejected" object ({"<uuid>": "reason"}). Adding an id that
+exists and removing one that does not must succeed, so a batch re-sent
+after a restart is harmless. 429 (honouring Retry-After), 5xx and network
+errors are retried; any other status rejects the whole batch.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import aiohttp
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from app.config import (
+    PROVISION_BATCH_INTERVAL,
+    PROVISION_BATCH_SIZE,
+    PROVISION_CONFIRM_TIMEOUT,
+    PROVISION_MAX_BACKOFF,
+    PROVISION_OUTBOX_PATH,
+    PROVISION_REQUEST_TIMEOUT,
+)
+from app.data.group_commit import GroupCommit
+from app.data.user_data_manager import UserDataManager
+from app.data.vpn_keys import StoredKey, decode_key
+from app.services.servers import get_server
+from app.services.vpn_link_generator import VPNLinkGenerator
+from app.utils.message_templates import KEY_PROVISION_FAILED, VPN_LINK
+
+logger = logging.getLogger(__name__)
+
+# Outbox operations
+ADD = "add"
+REMOVE = "remove"
+
+# Outcomes that finish an outbox entry
+ACTIVE = "active"
+REMOVED = "removed"
+REJECTED = "rejected"
+
+# First retry delay (seconds); doubled per failed attempt up to max_backoff
+_BASE_BACKOFF = 0.5
+
+
+class ProvisioningError(Exception):
+    """A key was refused by its server."""
+
+
+class _RetryablePushError(Exception):
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class OutboxEntry(NamedTuple):
+    seq: int
+    op: str  # ADD or REMOVE
+    user_id: str
+    key: StoredKey
+
+    def to_json(self) -> Dict[str, Any]:
+        return {"seq": self.seq, "op": self.op, "user": self.user_id, "key": self.key.to_json()}
+
+
+class ProvisioningOutbox:
+    """
+    Durable list of pending provisioning entries.
+
+    The file holds entry records and {"seq": n, "done": outcome} records
+    that finish them; both are fsynced before they count, in groups from a
+    worker thread once start() has run. On load, and whenever nothing is
+    pending and enough records piled up, the file is rewritten with just
+    the pending entries.
+    """
+
+    def __init__(self, path: Path = PROVISION_OUTBOX_PATH, compact_after: int = 1000):
+        self.path = Path(path)
+        self.compact_after = compact_after
+        self.pending: Dict[int, OutboxEntry] = {}  # in seq order
+        self._next_seq = 1
+        self._records = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._group_commit = GroupCommit(lambda: self._file.fileno(), f"outbox {self.path}")
+
+    def start(self) -> None:
+        """Starts fsyncing appends in groups; must be called from a running event loop."""
+        self._group_commit.start()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.endswith(b"\n"):
+                    # A crash interrupted this append, so it was never acknowledged
+                    logger.warning("Dropping truncated outbox record at %s:%s.", self.path, line_no)
+                    break
+                try:
+                    record = json.loads(line)
+                    seq = record["seq"]
+                    if "done" in record:
+                        self.pending.pop(seq, None)
+                    else:
+                        self.pending[seq] = OutboxEntry(seq, record["op"], record["user"], decode_key(record["key"]))
+                    self._next_seq = max(self._next_seq, seq + 1)
+                except (ValueError, KeyError, TypeError):
+                    logger.error("Skipping corrupt outbox record at %s:%s.", self.path, line_no)
+        self._rewrite()
+        if self.pending:
+            logger.info("Loaded %s pending provisioning entries from %s.", len(self.pending), self.path)
+
+    def _rewrite(self) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.path.parent), prefix=f".{self.path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for entry in self.pending.values():
+                    f.write(json.dumps(entry.to_json(), separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._records = len(self.pending)
+
+    def _append(self, records: Iterable[Dict[str, Any]]) -> None:
+        for record in records:
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._records += 1
+        self._file.flush()
+        self._group_commit.written()
+
+    async def add(self, op: str, user_id: str, key: StoredKey) -> OutboxEntry:
+        """Records a new entry; it is on disk when this returns."""
+        entry = OutboxEntry(self._next_seq, op, user_id, key)
+        self._next_seq += 1
+        self._append([entry.to_json()])
+        # Pending at once, so that a compaction meanwhile keeps it
+        self.pending[entry.seq] = entry
+        try:
+            await self._group_commit.wait()
+        except BaseException:
+            self.pending.pop(entry.seq, None)
+            raise
+        return entry
+
+    def finish(self, outcomes: List[Tuple[OutboxEntry, str]]) -> None:
+        """
+        Records the outcomes of entries, which are no longer pending
+        afterwards. Does not wait for the fsync: a lost outcome only makes
+        the entry be sent again.
+        """
+        self._append({"seq": entry.seq, "done": outcome} for entry, outcome in outcomes)
+        for entry, _ in outcomes:
+            self.pending.pop(entry.seq, None)
+        if not self.pending and self._records >= self.compact_after:
+            self._group_commit.sync_now()
+            self._file.close()
+            self._rewrite()
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    async def close(self) -> None:
+        await self._group_commit.stop()
+        self._file.close()
+
+
+class Provisioner:
+    """
+    Registers new keys on, and removes revoked keys from, the servers that
+    have a management API. Keys of other servers are active right away.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        user_data_manager: UserDataManager,
+        outbox: Optional[ProvisioningOutbox] = None,
+        batch_size: int = PROVISION_BATCH_SIZE,
+        batch_interval: float = PROVISION_BATCH_INTERVAL,
+        request_timeout: float = PROVISION_REQUEST_TIMEOUT,
+        max_backoff: float = PROVISION_MAX_BACKOFF,
+        confirm_timeout: float = PROVISION_CONFIRM_TIMEOUT,
+    ):
+        self.bot = bot
+        self.user_data_manager = user_data_manager
+        self.outbox = outbox if outbox is not None else ProvisioningOutbox()
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.request_timeout = request_timeout
+        self.max_backoff = max_backoff
+        self.confirm_timeout = confirm_timeout
+        self.counts: Dict[str, int] = {"batches": 0, "retries": 0, ACTIVE: 0, REMOVED: 0, REJECTED: 0}
+        self._link_generator = VPNLinkGenerator()
+        self._queues: Dict[str, Deque[OutboxEntry]] = {}  # server id -> pending entries in seq order
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        # Handlers waiting for their key to activate: seq -> future
+        self._waiters: Dict[int, asyncio.Future] = {}
+        # Entries already answered whose batch is not finished yet, so that
+        # a retried completion does not answer them twice
+        self._settled: Set[int] = set()
+        self._notifications: Set[asyncio.Task] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def start(self) -> None:
+        """Starts pushing; entries left pending by the last run go first."""
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.request_timeout))
+        self.outbox.start()
+        for entry in self.outbox.pending.values():
+            self._enqueue(entry)
+
+    def _enqueue(self, entry: OutboxEntry) -> None:
+        server_id = entry.key.server
+        self._queues.setdefault(server_id, deque()).append(entry)
+        self._wakeups.setdefault(server_id, asyncio.Event()).set()
+        if server_id not in self._workers:
+            self._workers[server_id] = asyncio.create_task(self._worker(server_id))
+
+    async def provision(self, user_id: str, key: StoredKey) -> bool:
+        """
+        Registers a new key on its server and adds it to the user's keys.
+
+        Returns True once the key is active, or False if it is still pending
+        after confirm_timeout; the user is then sent the key when it
+        activates.
+
+        Raises:
+            ProvisioningError: If the server refused the key.
+        """
+        server = get_server(key.server)
+        if server is None:
+            raise ProvisioningError(f"Unknown server {key.server!r}")
+        if not server.api_url:
+            await self._store_key(user_id, key)
+            return True
+        entry = await self.outbox.add(ADD, user_id, key)
+        waiter = self._waiters[entry.seq] = asyncio.get_running_loop().create_future()
+        self._enqueue(entry)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), self.confirm_timeout)
+        except asyncio.TimeoutError:
+            # It may have been settled in the same loop iteration as the timeout
+            if waiter.done():
+                return waiter.result()
+            logger.info("Key %s of user %s is still being provisioned on %s.", key.uuid_str, user_id, key.server)
+            return False
+        finally:
+            self._waiters.pop(entry.seq, None)
+
+    async def revoke(self, user_id: str, key: StoredKey) -> bool:
+        """
+        Removes a key from the user's keys and from its server. Returns False
+        if the user has no such key.
+        """
+        if not any(_same_key(stored, key) for stored in self.user_data_manager.get_user_data(user_id).get("keys") or []):
+            return False
+        server = get_server(key.server)
+        if server is not None and server.api_url:
+            # Recorded first: a key that left the user's list must not stay usable
+            self._enqueue(await self.outbox.add(REMOVE, user_id, key))
+        async with self.user_data_manager.transaction(user_id) as user_data:
+            user_data["keys"] = [stored for stored in user_data.get("keys") or [] if not _same_key(stored, key)]
+        logger.info("Revoked key %s of user %s.", key.uuid_str, user_id)
+        return True
+
+    async def _store_key(self, user_id: str, key: StoredKey) -> None:
+        # Replayed entries may find the key already stored
+        async with self.user_data_manager.transaction(user_id) as user_data:
+            keys = list(user_data.get("keys") or [])
+            if not any(_same_key(stored, key) for stored in keys):
+                keys.append(key)
+                user_data["keys"] = keys
+
+    async def _worker(self, server_id: str) -> None:
+        queue = self._queues[server_id]
+        wakeup = self._wakeups[server_id]
+        try:
+            while True:
+                if not queue:
+                    wakeup.clear()
+                    await wakeup.wait()
+                if len(queue) < self.batch_size:
+                    # Let more keys of this server join the batch
+                    await asyncio.sleep(self.batch_interval)
+                batch = list(itertools.islice(queue, self.batch_size))
+                rejected = await self._push_until_answered(server_id, batch)
+                self.counts["batches"] += 1
+                attempt = 0
+                while True:
+                    try:
+                        await self._complete(batch, rejected)
+                        break
+                    except Exception as e:
+                        # The batch stays queued until its outcomes are recorded
+                        attempt += 1
+                        delay = self._backoff(attempt)
+                        logger.error(
+                            "Failed to complete provisioning batch for server %s (%s); retry %s in %.1fs.",
+                            server_id,
+                            e,
+                            attempt,
+                            delay,
+                            exc_info=True,
+                        )
+                        await asyncio.sleep(delay)
+                for _ in batch:
+                    queue.popleft()
+        finally:
+            # A worker replaced meanwhile is not ours to remove
+            if self._workers.get(server_id) is asyncio.current_task():
+                del self._workers[server_id]
+
+    async def _push_until_answered(self, server_id: str, batch: List[OutboxEntry]) -> Dict[str, str]:
+        """Pushes a batch, retrying with backoff until its server answers."""
+        batch_id = uuid.uuid4().hex
+        attempt = 0
+        while True:
+            try:
+                return await self._push(server_id, batch, batch_id)
+            except _RetryablePushError as e:
+                attempt += 1
+                delay = e.retry_after or self._backoff(attempt)
+                logger.warning(
+                    "Provisioning batch of %s for server %s failed (%s); retry %s in %.1fs.",
+                    len(batch),
+                    server_id,
+                    e,
+                    attempt,
+                    delay,
+                )
+            except Exception as e:
+                attempt += 1
+                delay = self._backoff(attempt)
+                logger.error(
+                    "Unexpected error pushing a provisioning batch of %s for server %s; retry %s in %.1fs.",
+                    len(batch),
+                    server_id,
+                    attempt,
+                    delay,
+                    exc_info=True,
+                )
+            self.counts["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.max_backoff, _BASE_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    async def _push(self, server_id: str, batch: List[OutboxEntry], batch_id: str) -> Dict[str, str]:
+        """
+        Sends one batch and returns the refused ids with their reasons.
+
+        Raises:
+            _RetryablePushError: If the batch should be sent again later.
+        """
+        server = get_server(server_id)
+        if server is None or not server.api_url:
+            return {entry.key.uuid_str: "server is no longer provisioned" for entry in batch}
+        payload = {
+            "add": [
+                {"id": entry.key.uuid_str, "email": entry.user_id, "protocol": entry.key.protocol}
+                for entry in batch
+                if entry.op == ADD
+            ],
+            "remove": [entry.key.uuid_str for entry in batch if entry.op == REMOVE],
+        }
+        headers = {"Idempotency-Key": batch_id}
+        if server.api_token:
+            headers["Authorization"] = f"Bearer {server.api_token}"
+        try:
+            async with self._session.post(f"{server.api_url}/users/batch", json=payload, headers=headers) as response:
+                if response.status == 429 or response.status >= 500:
+                    retry_after = response.headers.get("Retry-After", "")
+                    raise _RetryablePushError(
+                        f"HTTP {response.status}", float(retry_after) if retry_after.isdigit() else None
+                    )
+                if response.status >= 300:
+                    reason = f"HTTP {response.status}: {(await response.text())[:200]}"
+                    return {entry.key.uuid_str: reason for entry in batch}
+                try:
+                    body = await response.json(content_type=None)
+                except ValueError:
+                    body = None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise _RetryablePushError(repr(e)) from e
+        rejected = body.get("rejected") if isinstance(body, dict) else None
+        return {str(k): str(v) for k, v in rejected.items()} if isinstance(rejected, dict) else {}
+
+    async def _complete(self, batch: List[OutboxEntry], rejected: Dict[str, str]) -> None:
+        outcomes = []
+        for entry in batch:
+            reason = rejected.get(entry.key.uuid_str)
+            if reason is not None:
+                logger.warning("Server %s refused to %s key %s: %s", entry.key.server, entry.op, entry.key.uuid_str, reason)
+                if entry.op == ADD:
+                    self._settle(entry, ProvisioningError(reason))
+                outcomes.append((entry, REJECTED))
+            elif entry.op == ADD:
+                # Stored before the entry is finished, so a crash in between only re-sends it
+                await self._store_key(entry.user_id, entry.key)
+                self._settle(entry, None)
+                outcomes.append((entry, ACTIVE))
+            else:
+                outcomes.append((entry, REMOVED))
+        self.outbox.finish(outcomes)
+        self._settled.difference_update(entry.seq for entry in batch)
+        for _, outcome in outcomes:
+            self.counts[outcome] += 1
+
+    def _settle(self, entry: OutboxEntry, error: Optional[ProvisioningError]) -> None:
+        """Answers the handler waiting for the key, or messages the user if none is."""
+        if entry.seq in self._settled:
+            return
+        self._settled.add(entry.seq)
+        waiter = self._waiters.get(entry.seq)
+        if waiter is not None and not waiter.done():
+            if error is None:
+                waiter.set_result(True)
+            else:
+                waiter.set_exception(error)
+            return
+        task = asyncio.create_task(self._notify(entry, error))
+        self._notifications.add(task)
+        task.add_done_callback(self._notifications.discard)
+
+    async def _notify(self, entry: OutboxEntry, error: Optional[ProvisioningError]) -> None:
+        lang = self.user_data_manager.get_lang(entry.user_id)
+        if error is None:
+            text = VPN_LINK.render(lang, link=self._link_generator.render_key(entry.key))
+        else:
+            text = KEY_PROVISION_FAILED.render(lang)
+        try:
+            await self.bot.send_message(int(entry.user_id), text, parse_mode="MarkdownV2")
+        except TelegramAPIError as e:
+            logger.warning("Could not tell user %s about key %s: %s", entry.user_id, entry.key.uuid_str, e)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self.outbox.pending), **self.counts}
+
+    async def close(self) -> None:
+        """Stops pushing; unfinished entries are sent again on the next start."""
+        for task in self._workers.values():
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        if self._notifications:
+            await asyncio.wait(self._notifications, timeout=5)
+        if self._session is not None:
+            await self._session.close()
+        await self.outbox.close()
+
+
+def _same_key(stored: Any, key: StoredKey) -> bool:
+    return isinstance(stored, StoredKey) and stored.uuid == key.uuid
@@ -0,0 +1,294 @@
+"""
+VPN server catalog.
+
+Servers are read from SERVERS_FILE_PATH, a JSON object of server id ->
+details in the order their buttons are shown. Each entry is validated once
+per load and becomes a Server that already carries its protocol and
+compiled link template, so creating a key does no per-request work. The file
+is created with the placeholder servers below if it does not exist, and
+watch_servers() reloads it when it changes. Stored keys only reference a
+server by its id, so links are re-rendered from here.
+
+A server with an "api_url" (and usually an "api_token") has its keys
+registered through its management API by app.services.provisioning.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.config import SERVERS_FILE_PATH, SERVERS_RELOAD_INTERVAL
+from app.services.link_templates import LinkTemplate, compile_template
+
+logger = logging.getLogger(__name__)
+
+# Placeholder server details written to a new servers file (replace with actual server info)
+DEFAULT_SERVERS: Dict[str, Dict[str, Any]] = {
+    "russia": {
+        "address": "ru.example.com",
+        "port": 443,
+        "security": "tls",
+        "network": "ws",
+        "path": "/ws",
+    },
+    "america": {
+        "address": "us.example.com",
+        "port": 8443,
+        "security": "tls",
+        "network": "tcp",
+        "flow": "xtls-rprx-vision",
+    },
+    "germany": {
+        "address": "de.example.com",
+        "port": 2053,
+        "security": "tls",
+        "network": "ws",
+        "path": "/v2ray",
+    },
+    "singapore": {
+        "address": "sg.example.com",
+        "port": 443,
+        "security": "tls",
+        "network": "tcp",
+    },
+}
+
+# Inline button callback data is SERVER_CALLBACK_PREFIX + server id
+SERVER_CALLBACK_PREFIX = "select_server_"
+
+# Callback id of the "auto (fastest)" button; no server may use it
+AUTO_SERVER_ID = "auto"
+
+# Ids end up in callback data, which Telegram limits to 64 bytes
+_SERVER_ID = re.compile(r"[a-z0-9_-]{1,40}")
+
+PROTOCOLS = ("vmess", "vless")
+
+# Entries of a server that are not passed on as link parameters
+_RESERVED_FIELDS = ("address", "port", "security", "network", "protocol", "name", "enabled", "api_url", "api_token")
+
+
+class Server(NamedTuple):
+    id: str
+    address: str
+    port: int
+    security: str
+    network: str
+    protocol: str  # "vmess" or "vless"
+    params: Tuple[Tuple[str, Any], ...]  # extra link parameters, e.g. (("path", "/ws"),)
+    name: str  # button text when the locales have no server_button_<id>
+    enabled: bool  # disabled servers keep rendering existing keys but are not offered
+    template: LinkTemplate
+    api_url: str = ""  # management API that keys are provisioned through; empty if none
+    api_token: str = ""
+
+    @property
+    def button_key(self) -> str:
+        return f"server_button_{self.id}"
+
+    @property
+    def callback_data(self) -> str:
+        return f"{SERVER_CALLBACK_PREFIX}{self.id}"
+
+
+def link_type_for(server: Dict[str, Any]) -> str:
+    """vmess for ws transports, vless (tcp, optionally with flow) otherwise."""
+    return "vmess" if server.get("network") == "ws" else "vless"
+
+
+def _text_field(server_id: str, details: Dict[str, Any], field: str, default: Optional[str] = None) -> str:
+    value = details.get(field, default)
+    if not isinstance(value, str) or not value:
+        raise ValueError(f"server '{server_id}': '{field}' must be a non-empty string")
+    return value
+
+
+def build_server(server_id: str, details: Any) -> Server:
+    """
+    Validates one catalog entry and compiles its link template.
+
+    Raises:
+        ValueError: If the entry is not a usable server.
+    """
+    if not isinstance(server_id, str) or not _SERVER_ID.fullmatch(server_id):
+        raise ValueError(f"server id {server_id!r} must be 1-40 characters of a-z, 0-9, '_' or '-'")
+    if server_id == AUTO_SERVER_ID:
+        raise ValueError(f"server id '{AUTO_SERVER_ID}' is reserved for the fastest-server button")
+    if not isinstance(details, dict):
+        raise ValueError(f"server '{server_id}': details must be an object")
+    address = _text_field(server_id, details, "address")
+    port = details.get("port")
+    if isinstance(port, bool) or not isinstance(port, int) or not 0 < port < 65536:
+        raise ValueError(f"server '{server_id}': 'port' must be an integer between 1 and 65535")
+    security = _text_field(server_id, details, "security", "auto")
+    network = _text_field(server_id, details, "network", "tcp")
+    protocol = details.get("protocol", link_type_for(details))
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"server '{server_id}': 'protocol' must be one of {', '.join(PROTOCOLS)}")
+    name = _text_field(server_id, details, "name", server_id.title())
+    enabled = details.get("enabled", True)
+    if not isinstance(enabled, bool):
+        raise ValueError(f"server '{server_id}': 'enabled' must be true or false")
+    api_url = details.get("api_url", "")
+    if not isinstance(api_url, str) or (api_url and not api_url.startswith(("http://", "https://"))):
+        raise ValueError(f"server '{server_id}': 'api_url' must be an http(s) URL")
+    api_token = details.get("api_token", "")
+    if not isinstance(api_token, str):
+        raise ValueError(f"server '{server_id}': 'api_token' must be a string")
+    params = tuple((k, v) for k, v in details.items() if k not in _RESERVED_FIELDS)
+    for key, value in params:
+        if not isinstance(value, (str, int, float)):
+            raise ValueError(f"server '{server_id}': link parameter '{key}' must be a string or number")
+    template = compile_template(protocol, address, port, security=security, network=network, extra=params)
+    return Server(
+        sys.intern(server_id),
+        address,
+        port,
+        security,
+        network,
+        sys.intern(protocol),
+        params,
+        name,
+        enabled,
+        template,
+        api_url.rstrip("/"),
+        api_token,
+    )
+
+
+def _write_defaults(path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(DEFAULT_SERVERS, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logger.info("Wrote placeholder servers to %s; edit it to configure the real ones.", path)
+
+
+def load_servers(path: Path = SERVERS_FILE_PATH) -> Dict[str, Server]:
+    """
+    Reads and validates the servers file. Invalid entries are logged and
+    left out so one typo does not take every server down.
+
+    Raises:
+        ValueError: If the file cannot be read or is not a JSON object.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            catalog = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError(f"Cannot read servers file {path}: {e}") from e
+    if not isinstance(catalog, dict):
+        raise ValueError(f"Servers file {path} must contain a JSON object of server id -> details")
+    servers = {}
+    for server_id, details in catalog.items():
+        try:
+            servers[server_id] = build_server(server_id, details)
+        except ValueError as e:
+            logger.error("Skipping invalid server in %s: %s", path, e)
+    return servers
+
+
+# The current catalog: server id -> Server, in button order
+_servers: Dict[str, Server] = {}
+_available: Tuple[Server, ...] = ()
+
+# Modification time of the servers file seen by the last (attempted) load
+_servers_mtime: Optional[int] = None
+
+# Callbacks run after the catalog is reloaded (e.g. to drop cached keyboards and links)
+_reload_listeners: List[Callable[[], None]] = []
+
+
+def _file_mtime() -> Optional[int]:
+    try:
+        return SERVERS_FILE_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _install(servers: Dict[str, Server], source: Any = SERVERS_FILE_PATH) -> None:
+    global _servers, _available
+    _servers = servers
+    _available = tuple(server for server in servers.values() if server.enabled)
+    logger.info("Loaded %s servers (%s offered) from %s.", len(servers), len(_available), source)
+
+
+def get_server(server_id: str) -> Optional[Server]:
+    """Returns a configured server (enabled or not), or None if it is unknown."""
+    return _servers.get(server_id)
+
+
+def all_servers() -> Tuple[Server, ...]:
+    """Every configured server, in catalog order."""
+    return tuple(_servers.values())
+
+
+def available_servers() -> Tuple[Server, ...]:
+    """The servers offered to users, in button order."""
+    return _available
+
+
+def add_reload_listener(callback: Callable[[], None]) -> None:
+    """Registers a callback to run whenever the server catalog is reloaded."""
+    _reload_listeners.append(callback)
+
+
+def _notify_reload() -> None:
+    for callback in _reload_listeners:
+        callback()
+
+
+def reload_servers() -> bool:
+    """
+    Re-reads the servers file. A file that cannot be read keeps the current
+    catalog. Returns whether the catalog was replaced.
+    """
+    global _servers_mtime
+    _servers_mtime = _file_mtime()
+    try:
+        servers = load_servers()
+    except ValueError as e:
+        logger.error("%s; keeping the %s servers loaded before.", e, len(_servers))
+        return False
+    _install(servers)
+    _notify_reload()
+    return True
+
+
+def set_servers(servers: Iterable[Server]) -> None:
+    """
+    Replaces the catalog with servers made by build_server() instead of the
+    servers file (for benchmarks and stand-in setups); a later change of
+    the file replaces them again.
+    """
+    _install({server.id: server for server in servers}, "set_servers()")
+    _notify_reload()
+
+
+async def watch_servers(interval: float = SERVERS_RELOAD_INTERVAL) -> None:
+    """Reloads the catalog whenever the servers file changes."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if _file_mtime() != _servers_mtime:
+                reload_servers()
+        except Exception as e:
+            logger.error("Failed to reload servers: %s", e, exc_info=True)
+
+
+# The catalog is loaded once at import; a broken servers file stops startup here
+if not SERVERS_FILE_PATH.exists():
+    _write_defaults(SERVERS_FILE_PATH)
+_servers_mtime = _file_mtime()
+_install(load_servers())
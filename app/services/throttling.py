@@ -0,0 +1,42 @@
+"""
+Per-user throttling of incoming updates.
+
+Every user has a token bucket per action (see app.services.token_buckets),
+so only users seen within the last burst / rate seconds take any memory,
+however many there are.
+"""
+
+import time
+from typing import Dict, Optional, Tuple
+
+from app.config import THROTTLE_KEYS_BURST, THROTTLE_KEYS_RATE, THROTTLE_MENU_BURST, THROTTLE_MENU_RATE
+from app.services.token_buckets import TokenBuckets
+
+# Creating or revoking keys: server selections and key deletions
+KEYS = "keys"
+# Everything else
+MENU = "menu"
+
+
+class UserThrottle:
+    """Token buckets per action; take() tells whether a user may go ahead."""
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, int]]] = None):
+        if limits is None:
+            limits = {KEYS: (THROTTLE_KEYS_RATE, THROTTLE_KEYS_BURST), MENU: (THROTTLE_MENU_RATE, THROTTLE_MENU_BURST)}
+        self.buckets = {action: TokenBuckets(rate, burst) for action, (rate, burst) in limits.items()}
+        self.throttled = dict.fromkeys(limits, 0)
+
+    def take(self, action: str, user_id: int, now: Optional[float] = None) -> float:
+        """0.0 if the user may go ahead, else the seconds to wait."""
+        wait = self.buckets[action].take(user_id, time.monotonic() if now is None else now)
+        if wait:
+            self.throttled[action] += 1
+        return wait
+
+    def notify_once(self, action: str, user_id: int, wait: float, now: Optional[float] = None) -> bool:
+        return self.buckets[action].notify_once(user_id, wait, time.monotonic() if now is None else now)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Throttled updates and tracked users, per action."""
+        return {action: {"throttled": self.throttled[action], "tracked_users": len(buckets)} for action, buckets in self.buckets.items()}
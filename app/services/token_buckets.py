@@ -0,0 +1,80 @@
+"""
+Token buckets keyed by user or chat id.
+
+Buckets use GCRA: a bucket is a single float, the time its next token is
+due ("theoretical arrival time"), stored per key. A bucket whose time has
+passed is full again, which is the same as having no entry, so expired
+entries are swept out every _PRUNE_EVERY new keys: only keys seen within
+the last burst / rate seconds take any memory, however many there are.
+
+Used by the per-user throttle of incoming updates and the per-chat limits
+of outgoing messages.
+"""
+
+from typing import Dict, Hashable
+
+# Expired entries are swept every this many new keys
+_PRUNE_EVERY = 10_000
+
+
+class TokenBuckets:
+    """One bucket per key: rate tokens per second, at most burst at once."""
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1.0 / rate
+        self.tolerance = max(burst - 1, 0) * self.interval
+        self._tat: Dict[Hashable, float] = {}
+        # Key -> end of the wait it was last told about
+        self._notified: Dict[Hashable, float] = {}
+        self._new_keys = 0
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+    def take(self, key: Hashable, now: float) -> float:
+        """Takes a token; returns 0.0, or the seconds until one is available (then none is taken)."""
+        tat = self._tat.get(key)
+        if tat is None:
+            self._new_key(now)
+            tat = now
+        elif tat < now:
+            tat = now
+        wait = tat - self.tolerance - now
+        if wait > 0:
+            return wait
+        self._tat[key] = tat + self.interval
+        return 0.0
+
+    def reserve(self, key: Hashable, now: float) -> float:
+        """Takes the next token, even a future one; returns the seconds until it is due."""
+        tat = self._tat.get(key)
+        if tat is None:
+            self._new_key(now)
+            tat = now
+        elif tat < now:
+            tat = now
+        self._tat[key] = tat + self.interval
+        return max(tat - self.tolerance - now, 0.0)
+
+    def block(self, key: Hashable, until: float) -> None:
+        """Empties the bucket until the given time."""
+        self._tat[key] = max(self._tat.get(key, 0.0), until + self.tolerance)
+
+    def notify_once(self, key: Hashable, wait: float, now: float) -> bool:
+        """True the first time a key is refused within one wait."""
+        if self._notified.get(key, 0.0) > now:
+            return False
+        self._notified[key] = now + wait
+        return True
+
+    def _new_key(self, now: float) -> None:
+        self._new_keys += 1
+        if self._new_keys >= _PRUNE_EVERY:
+            self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        self._new_keys = 0
+        for entries in (self._tat, self._notified):
+            expired = [key for key, until in entries.items() if until <= now]
+            for key in expired:
+                del entries[key]
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from app.config import UPDATE_QUEUE_SIZE, UPDATE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: Update) -> int:
+    """
+    Returns the id that orders an update: the chat it belongs to, else the
+    user who sent it. Updates with neither (e.g. polls) get their own key and
+    may run in any order.
+    """
+    try:
+        event = update.event
+    except LookupError:
+        return -update.update_id
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        message = getattr(event, "message", None)
+        chat = getattr(message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    return -update.update_id
+
+
+class UpdatePipeline:
+    """
+    Bounded worker pool that feeds updates to the Dispatcher.
+
+    Updates are grouped per chat: a chat with pending updates is handed to one
+    worker at a time, which runs that chat's updates in arrival order, so
+    different chats are handled concurrently while one chat never sees its
+    updates overtake each other. At most queue_size updates are accepted but
+    not yet finished; submit() waits for room beyond that, which holds the
+    webhook request open and makes Telegram slow down.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        workers: int = UPDATE_WORKERS,
+        queue_size: int = UPDATE_QUEUE_SIZE,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = asyncio.Semaphore(queue_size)
+        self._pending: Dict[int, Deque[Update]] = {}
+        self._ready: "asyncio.Queue[int]" = asyncio.Queue()
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def in_flight(self) -> int:
+        """Updates accepted but not yet handled."""
+        return self._in_flight
+
+    async def start(self) -> None:
+        """Launches the workers."""
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info("Update pipeline started with %s workers, queue size %s.", self.workers, self.queue_size)
+
+    async def submit(self, update: Update) -> None:
+        """Queues an update, waiting while the pipeline is full."""
+        await self._slots.acquire()
+        self._in_flight += 1
+        self._idle.clear()
+        key = chat_key(update)
+        queue = self._pending.get(key)
+        if queue is None:
+            self._pending[key] = deque((update,))
+            self._ready.put_nowait(key)
+        else:
+            # A worker owns this chat already and will pick the update up in order
+            queue.append(update)
+
+    async def _worker(self, number: int) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._pending[key]
+            while queue:
+                update = queue[0]
+                try:
+                    await self.dispatcher.feed_update(self.bot, update)
+                except Exception as e:
+                    logger.error("Worker %s failed to handle update %s: %s", number, update.update_id, e, exc_info=True)
+                finally:
+                    queue.popleft()
+                    self._finish()
+            # No await since the last check, so no update can slip in between
+            del self._pending[key]
+
+    def _finish(self) -> None:
+        self._in_flight -= 1
+        self._slots.release()
+        if not self._in_flight:
+            self._idle.set()
+
+    async def wait_idle(self) -> None:
+        """Returns once every accepted update has been handled."""
+        await self._idle.wait()
+
+    async def close(self, timeout: Optional[float] = 30.0) -> None:
+        """Waits for queued updates to be handled, then stops the workers."""
+        try:
+            await asyncio.wait_for(self.wait_idle(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping update pipeline with %s updates unhandled.", self._in_flight)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Update pipeline stopped.")
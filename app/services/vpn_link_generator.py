@@ -1,14 +1,45 @@
-import json
-import base64
-import uuid
 import logging
-from typing import Any, Dict
+import sys
+import time
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple
+
+from app.data.vpn_keys import StoredKey, format_uuid, uuid_pool
+from app.services.link_templates import LinkTemplate, compile_template
+from app.services.servers import add_reload_listener, get_server
 
 logger = logging.getLogger(__name__)
 
+_compile_cached = lru_cache(maxsize=256)(compile_template)
+
+
+def server_template(server_id: str, protocol: Optional[str] = None) -> LinkTemplate:
+    """
+    The link template of a configured server. Its own protocol's template is
+    precompiled by the server catalog; another protocol is compiled on first
+    use.
+
+    Raises:
+        KeyError: If the server is not configured.
+    """
+    server = get_server(server_id)
+    if server is None:
+        raise KeyError(f"Unknown server {server_id!r}")
+    if protocol is None or protocol == server.protocol:
+        return server.template
+    return _compile_cached(protocol, server.address, server.port, server.security, server.network, server.params)
+
+
 class VPNLinkGenerator:
     def generate_vpn_link(
-        self, link_type: str, server_address: str, port: int, security: str = "auto", network: str = "tcp", **kwargs: Any
+        self,
+        link_type: str,
+        server_address: str,
+        port: int,
+        security: str = "auto",
+        network: str = "tcp",
+        user_uuid: Optional[str] = None,
+        **kwargs: Any,
     ) -> str:
         """
         Generates a fake or real vmess:// or vless:// link.
@@ -19,6 +50,7 @@ class VPNLinkGenerator:
             port (int): The server port.
             security (str): The security protocol (e.g., 'auto', 'none', 'tls'). Defaults to 'auto'.
             network (str): The network type (e.g., 'tcp', 'ws'). Defaults to 'tcp'.
+            user_uuid (str, optional): The client UUID to embed. A random one is used if omitted.
             **kwargs: Additional parameters specific to the link type (e.g., 'path' for ws, 'flow' for vless).
 
         Returns:
@@ -27,53 +59,49 @@ class VPNLinkGenerator:
         Raises:
             ValueError: If the link_type is not 'vmess' or 'vless'.
         """
-        logger.info(
-            f"Generating VPN link of type {link_type} for server {server_address}:{port}"
-        )
-        user_id = str(uuid.uuid4())
-
-        if link_type.lower() == "vmess":
-            vmess_config = {
-                "v": "2",
-                "ps": "Test Bot Generated",  # Placeholder name
-                "add": server_address,
-                "port": str(port),
-                "id": user_id,
-                "aid": "0",  # AlterId, commonly 0 for single-user links
-                "net": network,
-                "type": "none",  # Usually 'none' for tcp, or 'ws'
-                "host": "",
-                "path": "",
-                "tls": "",
-                "sni": "",
-                "alpn": "",
-                "scy": security,  # Use the passed security parameter
-            }
-
-            # Update with specific kwargs if provided
-            vmess_config.update(kwargs)
-            logger.debug(f"VMess config: {vmess_config}")
-
-            json_config = json.dumps(vmess_config)
-            encoded_config = base64.b64encode(json_config.encode("utf-8")).decode("utf-8")
-            link = f"vmess://{encoded_config}"
-            logger.info("VMess link generated successfully.")
-            return link
-
-        elif link_type.lower() == "vless":
-            # Construct VLESS parameters
-            params = f"security={security}&type={network}"
-
-            # Add specific kwargs as parameters
-            for key, value in kwargs.items():
-                params += f"&{key}={value}"
-
-            link = (
-                f"vless://{user_id}@{server_address}:{port}?{params}#Test Bot Generated"
-            )  # Placeholder name
-            logger.info("VLESS link generated successfully.")
-            return link
-
-        else:
-            logger.error(f"Invalid link_type specified: {link_type}")
-            raise ValueError("Invalid link_type. Must be 'vmess' or 'vless'.")
+        extra = tuple(kwargs.items())
+        try:
+            template = _compile_cached(link_type, server_address, port, security, network, extra)
+        except TypeError:
+            # Unhashable parameter values are compiled without the cache
+            template = compile_template(link_type, server_address, port, security, network, extra)
+        return template.render(user_uuid or format_uuid(uuid_pool.take()))
+
+    def render_key(self, key: StoredKey) -> str:
+        """
+        Renders the link of a stored key from its parameters and the current
+        server details. Rendered links are kept in an LRU cache.
+
+        Raises:
+            KeyError: If the key's server is no longer configured.
+        """
+        return _render_key(key.uuid, key.server, key.protocol)
+
+    def generate_many(
+        self, server_id: str, count: int, protocol: Optional[str] = None
+    ) -> List[Tuple[StoredKey, str]]:
+        """
+        Creates count new keys for a server and renders their links in one
+        pass: the server's template is looked up once and the UUIDs are taken
+        from the pool in bulk.
+
+        Raises:
+            KeyError: If the server is not configured.
+        """
+        template = server_template(server_id, protocol)
+        server = sys.intern(server_id)
+        created = int(time.time())
+        render = template.render
+        return [
+            (StoredKey(raw, server, template.protocol, created), render(format_uuid(raw)))
+            for raw in uuid_pool.take_many(count)
+        ]
+
+
+@lru_cache(maxsize=4096)
+def _render_key(uuid_bytes: bytes, server_id: str, protocol: str) -> str:
+    return server_template(server_id, protocol).render(format_uuid(uuid_bytes))
+
+
+# Links of existing keys change with their server's details
+add_reload_listener(_render_key.cache_clear)
@@ -0,0 +1,94 @@
+import asyncio
+import hmac
+import logging
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from pydantic import ValidationError
+
+from app.config import (
+    DROP_PENDING_UPDATES,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+from app.services.update_pipeline import UpdatePipeline
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def create_webhook_app(pipeline: UpdatePipeline, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET) -> web.Application:
+    """
+    Builds the aiohttp app that receives Telegram updates.
+
+    Each request is answered once its update is queued, not handled; handlers
+    reply through the Bot API like in polling mode.
+    """
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            logger.warning("Rejected webhook request from %s: bad secret token.", request.remote)
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": pipeline.bot})
+        except (ValueError, ValidationError) as e:
+            # Telegram would retry a 4xx/5xx forever; a malformed update is dropped
+            logger.error("Ignoring malformed webhook update: %s", e)
+            return web.Response()
+        await pipeline.submit(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+async def run_webhook(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    pipeline: UpdatePipeline,
+    url: str = WEBHOOK_URL,
+    path: str = WEBHOOK_PATH,
+    secret: str = WEBHOOK_SECRET,
+    host: str = WEBAPP_HOST,
+    port: int = WEBAPP_PORT,
+    drop_pending_updates: bool = DROP_PENDING_UPDATES,
+    stop: Optional[asyncio.Event] = None,
+) -> None:
+    """
+    Serves the webhook until stop is set (or the task is cancelled).
+
+    The webhook is left registered on shutdown so that Telegram keeps the
+    updates that arrive while the bot is down and delivers them on restart.
+    """
+    if not url:
+        raise ValueError("WEBHOOK_URL must be set to run in webhook mode.")
+    stop = stop or asyncio.Event()
+    runner = web.AppRunner(create_webhook_app(pipeline, path, secret))
+    await runner.setup()
+    await pipeline.start()
+    await dispatcher.emit_startup(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
+    try:
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        logger.info("Webhook server listening on %s:%s%s.", host, port, path)
+        await bot.set_webhook(
+            url=url + path,
+            secret_token=secret or None,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+            drop_pending_updates=drop_pending_updates,
+            max_connections=min(100, max(1, pipeline.workers)),
+        )
+        logger.info("Webhook set to %s.", url + path)
+        await stop.wait()
+    finally:
+        # Stop accepting requests first, then let queued updates finish
+        await runner.cleanup()
+        await pipeline.close()
+        await dispatcher.emit_shutdown(bot=bot, dispatcher=dispatcher, **dispatcher.workflow_data)
@@ -1,13 +1,51 @@
+import asyncio
 import json
+from collections import Counter
 from pathlib import Path
 import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import I18N_DEFAULT_LANG, I18N_FALLBACKS, I18N_RELOAD_INTERVAL
 
 logger = logging.getLogger(__name__)
 
 # Base directory for locales
 LOCALES_DIR = Path(__file__).parent.parent / "locales"
 
-_translations_cache = {}
+# Raw catalogs as read from disk: lang -> key -> text
+_translations_cache: Dict[str, Dict[str, str]] = {}
+
+# Compiled catalogs: lang -> key -> text with the fallback chain already applied,
+# so a lookup is two dict hits whatever the chain
+_compiled: Dict[str, Dict[str, str]] = {}
+
+# Catalog file modification times seen by the last compile
+_catalog_mtimes: Dict[str, float] = {}
+
+# Lookups of keys missing from every catalog in the chain: (lang, key) -> count
+_missing_keys: Counter = Counter()
+_reported_missing = 0
+
+# Callbacks run after catalogs are reloaded (e.g. to drop cached keyboards)
+_reload_listeners: List[Callable[[], None]] = []
+
+def _parse_fallbacks(spec: str) -> Dict[str, str]:
+    fallbacks = {}
+    for pair in filter(None, (item.strip() for item in spec.split(","))):
+        lang_code, _, fallback = pair.partition(":")
+        fallbacks[lang_code.strip()] = fallback.strip()
+    return fallbacks
+
+FALLBACKS: Dict[str, str] = _parse_fallbacks(I18N_FALLBACKS)
+
+def fallback_chain(lang_code: str) -> List[str]:
+    """Returns lang_code followed by the languages it falls back to."""
+    chain = [lang_code]
+    while chain[-1] in FALLBACKS and FALLBACKS[chain[-1]] not in chain:
+        chain.append(FALLBACKS[chain[-1]])
+    if I18N_DEFAULT_LANG not in chain:
+        chain.append(I18N_DEFAULT_LANG)
+    return chain
 
 def load_translation_file(lang_code: str) -> dict:
     """Loads a translation file into the cache."""
@@ -16,25 +54,131 @@ def load_translation_file(lang_code: str) -> dict:
         try:
             with open(file_path, "r", encoding="utf-8") as f:
                 _translations_cache[lang_code] = json.load(f)
-            logger.info(f"Loaded translation file: {file_path}")
+            logger.info("Loaded translation file: %s", file_path)
         except FileNotFoundError:
-            logger.error(f"Translation file not found: {file_path}")
+            logger.error("Translation file not found: %s", file_path)
             _translations_cache[lang_code] = {} # Store empty dict to avoid repeated errors
         except json.JSONDecodeError:
-            logger.error(f"Error decoding JSON from translation file: {file_path}")
+            logger.error("Error decoding JSON from translation file: %s", file_path)
             _translations_cache[lang_code] = {}
     return _translations_cache[lang_code]
 
+def compile_catalogs(previous: Optional[Dict[str, Dict[str, str]]] = None) -> None:
+    """Reads every catalog and builds the fallback-resolved lookup tables."""
+    global _compiled
+    _catalog_mtimes.clear()
+    for path in LOCALES_DIR.glob("*.json"):
+        _catalog_mtimes[path.stem] = path.stat().st_mtime
+    catalogs = {lang_code: load_translation_file(lang_code) for lang_code in _catalog_mtimes}
+    for lang_code, catalog in (previous or {}).items():
+        if lang_code in catalogs and not catalogs[lang_code] and catalog:
+            # A file caught mid-rewrite may not parse; keep serving the old catalog
+            logger.warning("Keeping previous catalog for '%s'.", lang_code)
+            catalogs[lang_code] = _translations_cache[lang_code] = catalog
+    compiled = {}
+    for lang_code in catalogs:
+        table: Dict[str, str] = {}
+        # Walk the chain from the last fallback to the language itself so closer languages win
+        for source in reversed(fallback_chain(lang_code)):
+            table.update(catalogs.get(source, {}))
+        compiled[lang_code] = table
+    _compiled = compiled
+    logger.info("Compiled translation catalogs: %s", sorted(compiled))
+
 def get_translation(lang_code: str, key: str, default: str = None) -> str:
     """
     Retrieves a translated string for a given key and language code.
     If the key is not found, returns the default or the key itself.
     """
-    translations = load_translation_file(lang_code)
-    if key not in translations and default is None:
-        logger.warning(f"Translation key '{key}' not found for language '{lang_code}'. Returning key itself.")
-        return key
-    return translations.get(key, default if default is not None else key)
+    table = _compiled.get(lang_code)
+    if table is None:
+        table = _compiled.get(I18N_DEFAULT_LANG, {})
+    value = table.get(key)
+    if value is not None:
+        return value
+    # Counted instead of logged: a missing key on a hot path must not flood the logs
+    missed = (lang_code, key)
+    _missing_keys[missed] += 1
+    return default if default is not None else key
+
+def missing_keys_report() -> Dict[Tuple[str, str], int]:
+    """Returns how often each (language, key) pair was looked up without a translation."""
+    return dict(_missing_keys)
+
+def log_missing_keys() -> None:
+    """Logs the missing-key counts if keys went missing since the last report."""
+    global _reported_missing
+    total = sum(_missing_keys.values())
+    if total == _reported_missing:
+        return
+    _reported_missing = total
+    summary = ", ".join(f"{lang}/{key}: {count}" for (lang, key), count in _missing_keys.most_common(20))
+    logger.warning("Missing translation keys (%s distinct, %s lookups): %s", len(_missing_keys), total, summary)
+
+def add_reload_listener(callback: Callable[[], None]) -> None:
+    """Registers a callback to run whenever translation catalogs are reloaded."""
+    _reload_listeners.append(callback)
+
+def reload_translations() -> None:
+    """Re-reads and recompiles catalogs, then drops derived indexes and caches."""
+    global _menu_button_index
+    previous = dict(_translations_cache)
+    _translations_cache.clear()
+    compile_catalogs(previous)
+    _menu_button_index = None
+    logger.info("Translation catalogs reloaded.")
+    for callback in _reload_listeners:
+        callback()
+
+def _catalogs_changed() -> bool:
+    current = {path.stem: path.stat().st_mtime for path in LOCALES_DIR.glob("*.json")}
+    return current != _catalog_mtimes
+
+async def watch_locales(interval: float = I18N_RELOAD_INTERVAL) -> None:
+    """Reloads catalogs whenever a locale file changes; also reports missing keys."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if _catalogs_changed():
+                reload_translations()
+            log_missing_keys()
+        except Exception as e:
+            logger.error("Failed to reload translation catalogs: %s", e, exc_info=True)
+
+def available_languages() -> List[str]:
+    """Returns the language codes that have a catalog in the locales directory."""
+    return sorted(_compiled)
+
+MENU_BUTTON_PREFIX = "main_menu_button_"
+
+_menu_button_index: Optional[Dict[str, Tuple[str, str]]] = None
+
+def get_menu_button_index() -> Dict[str, Tuple[str, str]]:
+    """
+    Returns a reverse index of reply-button texts across all catalogs:
+    button text -> (action, language), where action is the translation key
+    without the "main_menu_button_" prefix (e.g. "tariflar").
+    """
+    global _menu_button_index
+    if _menu_button_index is None:
+        index: Dict[str, Tuple[str, str]] = {}
+        for lang_code in available_languages():
+            for key, text in load_translation_file(lang_code).items():
+                if key.startswith(MENU_BUTTON_PREFIX):
+                    # First catalog wins if two languages share a button text
+                    index.setdefault(text, (key[len(MENU_BUTTON_PREFIX):], lang_code))
+        _menu_button_index = index
+        logger.info("Built menu button index with %s entries.", len(index))
+    return _menu_button_index
+
+def lookup_menu_button(text: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Returns (action, language) for a reply-button text, or None."""
+    if not text:
+        return None
+    return get_menu_button_index().get(text)
 
 # Ensure locales directory exists when i18n module is imported
 LOCALES_DIR.mkdir(parents=True, exist_ok=True)
+
+# Catalogs are compiled once at import; watch_locales() keeps them current
+compile_catalogs()
@@ -0,0 +1,166 @@
+"""
+Log output as text or JSON lines, written off the event loop.
+
+configure_logging() replaces the root handlers. In async mode the loop only
+puts records on a queue, with their %-style arguments already rendered; a
+QueueListener thread formats and writes them. Records emitted while an update
+is handled carry its user_id and handler, set by the log context
+middleware. With a LOG_SAMPLE_RATE below 1 the INFO (and lower) records are
+kept for only that share of the updates, all of an update's records or
+none; warnings and errors are always kept.
+"""
+
+import json
+import logging
+import random
+import sys
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, Optional, TextIO, Tuple
+
+from app.config import LOG_ASYNC, LOG_FORMAT, LOG_LEVEL, LOG_SAMPLE_RATE
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+_user_id: ContextVar[Optional[str]] = ContextVar("log_user_id", default=None)
+_handler: ContextVar[Optional[str]] = ContextVar("log_handler", default=None)
+_sampled: ContextVar[bool] = ContextVar("log_sampled", default=True)
+
+
+def set_log_context(user_id: Optional[str], handler: Optional[str], sampled: bool = True) -> Tuple[Any, ...]:
+    """Tags the records of the current task; pass the result to reset_log_context()."""
+    return _user_id.set(user_id), _handler.set(handler), _sampled.set(sampled)
+
+
+def reset_log_context(tokens: Tuple[Any, ...]) -> None:
+    user_id, handler, sampled = tokens
+    _user_id.reset(user_id)
+    _handler.reset(handler)
+    _sampled.reset(sampled)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds user_id and handler to records and drops the low-level records of
+    unsampled updates. Runs in the emitting task, before the queue.
+    """
+
+    def __init__(self, sample_rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.INFO:
+            if not _sampled.get():
+                return False
+            # aiogram logs every handled update after the handler's context is gone
+            if record.name == "aiogram.event" and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return False
+        if not hasattr(record, "user_id"):
+            record.user_id = _user_id.get()
+        if not hasattr(record, "handler"):
+            record.handler = _handler.get()
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """The classic format, plus the update's user and handler when known."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        user_id = getattr(record, "user_id", None)
+        if user_id is None:
+            return text
+        return f"{text} [user={user_id} handler={getattr(record, 'handler', None)}]"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, user_id, handler, exc."""
+
+    _encode = json.JSONEncoder(ensure_ascii=False, default=str).encode
+
+    def __init__(self):
+        super().__init__()
+        # Records come in bursts: the UTC second is formatted once per second
+        self._second = -1
+        self._second_text = ""
+
+    def format(self, record: logging.LogRecord) -> str:
+        second = int(record.created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        entry = {
+            "ts": "%s.%03dZ" % (self._second_text, record.msecs),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        user_id = getattr(record, "user_id", None)
+        if user_id is not None:
+            entry["user_id"] = user_id
+            entry["handler"] = getattr(record, "handler", None)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return self._encode(entry)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Queues records with only their message rendered. QueueHandler.prepare()
+    would also run the formatter (timestamp, JSON, traceback) in the
+    emitting thread, which is the work this handler exists to move off the
+    loop; records never leave the process, so they need no copy or pickling.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The arguments may be changed by the caller before the listener
+        # writes the record, so they are rendered now
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def configure_logging(
+    level: str = LOG_LEVEL,
+    log_format: str = LOG_FORMAT,
+    use_queue: bool = LOG_ASYNC,
+    sample_rate: float = LOG_SAMPLE_RATE,
+    stream: Optional[TextIO] = None,
+) -> Optional[QueueListener]:
+    """
+    Sends all logging to stream (stderr by default) in log_format ("text" or
+    "json"). With use_queue the records are written by a background thread;
+    the returned listener must be stop()ped on exit to write the rest.
+    """
+    if log_format not in ("text", "json"):
+        raise ValueError(f"Unknown LOG_FORMAT {log_format!r}, expected 'text' or 'json'.")
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    listener = None
+    if use_queue:
+        queue: SimpleQueue = SimpleQueue()
+        handler: logging.Handler = _DeferredQueueHandler(queue)
+        listener = QueueListener(queue, output)
+        listener.start()
+    else:
+        handler = output
+    handler.addFilter(ContextFilter(sample_rate))
+    # Neither format shows the caller, thread or process: skip looking them
+    # up for every record (see "Optimization" in the logging HOWTO)
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(handler)
+    root.setLevel(level)
+    return listener
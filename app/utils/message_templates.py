@@ -0,0 +1,35 @@
+"""
+The bot's MarkdownV2 messages with dynamic content, compiled once per
+language by app.utils.rendering. Translations are referenced as {@key}.
+"""
+
+from app.utils.rendering import MessageTemplate
+
+VPN_LINK = MessageTemplate("{@your_vpn_link}\n`{link:code}`", defaults={"your_vpn_link": "Your VPN link:"})
+
+KEY_PROVISION_FAILED = MessageTemplate(
+    "{@key_provision_failed}",
+    defaults={"key_provision_failed": "Sorry, your key could not be created. Please try again later."},
+)
+
+ACCOUNT_INFO = MessageTemplate(
+    "{@account_info_header}\n\n{@account_info_user_id} `{user_id:code}`",
+    defaults={"account_info_header": "Your Account:", "account_info_user_id": "User ID:"},
+)
+
+REFERRAL = MessageTemplate(
+    "{@referral_link_message}\n`{link:code}`\n\n{@referral_bonus_info}",
+    defaults={
+        "referral_link_message": "Your referral link:",
+        "referral_bonus_info": "Invite your friends and get bonuses! (Referral accounting is basic for now)",
+    },
+)
+
+# A page of "My keys": the header, then the rendered entries (and footer)
+# separated by blank lines
+KEYS_PAGE = MessageTemplate("{@keys_message_header}\n\n{entries:raw}", defaults={"keys_message_header": "Your saved keys:"})
+KEY_ENTRY = MessageTemplate("{number}\\. `{link:code}`")
+KEY_ENTRY_SERVER_REMOVED = MessageTemplate(
+    "{number}\\. {@key_server_removed}", defaults={"key_server_removed": "This key's server is no longer available."}
+)
+KEYS_PAGE_FOOTER = MessageTemplate("{@keys_page_footer}", defaults={"keys_page_footer": "Page {page} of {pages}"})
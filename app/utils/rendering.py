@@ -0,0 +1,167 @@
+"""
+Rendering of message text for Telegram's MarkdownV2 and HTML parse modes.
+
+Escaping goes through precompiled str.translate tables. Message templates
+are compiled once per language: their markup and translations are escaped
+at compile time into a format string, so rendering only escapes the
+dynamic fields. Rendered text is checked against Telegram's length limits.
+See: https://core.telegram.org/bots/api#formatting-options
+"""
+
+import logging
+import weakref
+from string import Formatter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.utils.i18n import add_reload_listener, get_translation as t
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_V2 = "MarkdownV2"
+HTML = "HTML"
+
+# In UTF-16 code units, as Telegram counts them
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+# Every character MarkdownV2 reserves, the backslash included
+_MARKDOWN_V2_TABLE = str.maketrans({char: "\\" + char for char in "\\_*[]()~`>#+-=|{}.!"})
+# Inside `code` and ```pre``` only ` and \ are special
+_MARKDOWN_V2_CODE_TABLE = str.maketrans({"\\": "\\\\", "`": "\\`"})
+_HTML_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"})
+
+
+def escape_markdown_v2(text: str) -> str:
+    """Escapes all special MarkdownV2 characters in text."""
+    return text.translate(_MARKDOWN_V2_TABLE)
+
+
+def escape_markdown_v2_code(text: str) -> str:
+    """Escapes text for use inside a MarkdownV2 code span or pre block."""
+    # Links, the usual content, have neither character: skip the copy
+    if "`" not in text and "\\" not in text:
+        return text
+    return text.translate(_MARKDOWN_V2_CODE_TABLE)
+
+
+def escape_html(text: str) -> str:
+    """Escapes text for Telegram's HTML parse mode."""
+    return text.translate(_HTML_TABLE)
+
+
+# parse mode -> field format spec -> escape function (None: inserted as is)
+_ESCAPES: Dict[str, Dict[str, Optional[Callable[[str], str]]]] = {
+    MARKDOWN_V2: {"": escape_markdown_v2, "code": escape_markdown_v2_code, "raw": None},
+    HTML: {"": escape_html, "code": escape_html, "raw": None},
+}
+
+
+class MessageTooLongError(ValueError):
+    """Raised when rendered text exceeds a Telegram length limit."""
+
+
+def check_length(text: str, limit: int = MESSAGE_LIMIT) -> str:
+    """
+    Returns text, or raises MessageTooLongError if it is longer than limit.
+
+    Telegram applies its limits to the text after parsing the markup; the
+    markup counts here too, which errs on the safe side.
+    """
+    # No character takes more than two UTF-16 code units
+    if len(text) > limit // 2 and len(text.encode("utf-16-le")) // 2 > limit:
+        raise MessageTooLongError(f"Message of {len(text.encode('utf-16-le')) // 2} characters exceeds the limit of {limit}")
+    return text
+
+
+_formatter = Formatter()
+
+# Every template, so that a translation reload can drop their compiled forms
+_templates: "weakref.WeakSet[MessageTemplate]" = weakref.WeakSet()
+
+
+class MessageTemplate:
+    """
+    A message in format string syntax. Literal text is markup of parse_mode
+    and is sent as is. {name} fields are filled in by render() and escaped,
+    {name:code} for use inside a code span and {name:raw} not at all.
+    {@key} inserts the translation of key, escaped ({@key:raw}: as is), and
+    fields in the translation become fields of the message.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        parse_mode: str = MARKDOWN_V2,
+        limit: int = MESSAGE_LIMIT,
+        defaults: Optional[Dict[str, str]] = None,
+    ):
+        self.source = source
+        self.parse_mode = parse_mode
+        self.limit = limit
+        self.defaults = defaults or {}  # translation key -> text used when no catalog has it
+        self._escapes = _ESCAPES[parse_mode]
+        # lang -> (format string with the static parts escaped, (field name, escape) per {})
+        self._compiled: Dict[str, Tuple[str, Tuple[Tuple[str, Optional[Callable[[str], str]]], ...]]] = {}
+        _templates.add(self)
+
+    def render(self, lang: str, **fields: object) -> str:
+        """
+        Renders the message in lang.
+
+        Raises:
+            KeyError: If a field has no value.
+            MessageTooLongError: If the result exceeds the template's limit.
+        """
+        compiled = self._compiled.get(lang)
+        if compiled is None:
+            compiled = self._compiled[lang] = self._compile(lang)
+        pattern, slots = compiled
+        values = []
+        for name, escape in slots:
+            value = str(fields[name])
+            values.append(escape(value) if escape is not None else value)
+        return check_length(pattern.format(*values), self.limit)
+
+    def _compile(self, lang: str):
+        static_escape = self._escapes[""]
+        parts: List[str] = []
+        slots = []
+
+        def add_static(text: str) -> None:
+            parts.append(text.replace("{", "{{").replace("}", "}}"))
+
+        def add_field(name: str, spec: str) -> None:
+            if spec not in self._escapes:
+                raise ValueError(f"Unknown format {spec!r} of field {name!r} in template {self.source!r}")
+            parts.append("{}")
+            slots.append((name, self._escapes[spec]))
+
+        for literal, name, spec, _ in _formatter.parse(self.source):
+            add_static(literal)
+            if name is None:
+                continue
+            if not name.startswith("@"):
+                add_field(name, spec or "")
+                continue
+            key = name[1:]
+            text = t(lang, key, self.defaults.get(key))
+            escape = None if spec == "raw" else static_escape
+            try:
+                pieces = list(_formatter.parse(text))
+            except ValueError:
+                # Stray braces: the translation has no fields then
+                logger.warning("Translation %r (%s) is not a valid template; using it as plain text.", key, lang)
+                pieces = [(text, None, None, None)]
+            for piece, field, field_spec, _ in pieces:
+                add_static(escape(piece) if escape is not None else piece)
+                if field:
+                    add_field(field, field_spec or "")
+        return "".join(parts), tuple(slots)
+
+
+def _clear_compiled() -> None:
+    for template in list(_templates):
+        template._compiled.clear()
+
+
+add_reload_listener(_clear_compiled)
@@ -0,0 +1,7 @@
+"""
+Benchmarks package.
+
+Standalone performance scripts for the bot's hot paths. Run them from the
+project root so that the app package is importable, e.g.:
+  pipenv run python -m benchmarks.bench_cold_start
+"""
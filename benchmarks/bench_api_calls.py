@@ -0,0 +1,108 @@
+"""
+Bot API calls per user action.
+
+Feeds one update per user action through the real handlers with a session
+that records calls instead of sending them, and prints how many calls (and
+of which methods) each action costs. Every call counts against the per-chat
+flood limit, so fewer is better.
+
+Usage:
+  pipenv run python -m benchmarks.bench_api_calls
+"""
+
+import asyncio
+import datetime
+import logging
+import tempfile
+from collections import Counter
+from pathlib import Path
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from app.data.user_data_manager import UserDataManager
+from app.handlers.callback_query_handlers import register_callback_query_handlers
+from app.handlers.message_handlers import register_message_handlers
+from app.services.provisioning import Provisioner, ProvisioningOutbox
+from app.services.vpn_link_generator import VPNLinkGenerator
+from app.utils.i18n import get_translation as t
+
+USER_ID = 42
+
+
+class CountingSession(BaseSession):
+    """Records calls and answers them without any network."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def make_request(self, bot, method: TelegramMethod, timeout=None):
+        self.calls.append(method.__api_method__)
+        if method.__api_method__ in ("sendMessage", "editMessageText"):
+            return Message(
+                message_id=len(self.calls),
+                date=datetime.datetime.now(),
+                chat=Chat(id=USER_ID, type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+
+def message_update(text):
+    user = User(id=USER_ID, is_bot=False, first_name="User")
+    message = Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=USER_ID, type="private"), from_user=user, text=text)
+    return Update(update_id=1, message=message)
+
+
+def callback_update(data):
+    user = User(id=USER_ID, is_bot=False, first_name="User")
+    message = Message(message_id=1, date=datetime.datetime.now(), chat=Chat(id=USER_ID, type="private"), text="...")
+    return Update(update_id=1, callback_query=CallbackQuery(id="1", chat_instance="c", from_user=user, message=message, data=data))
+
+
+ACTIONS = [
+    ("/start (new user)", lambda: message_update("/start")),
+    ("choose language", lambda: callback_update("lang:en")),
+    ("/start (returning user)", lambda: message_update("/start")),
+    ("Tariffs", lambda: message_update(t("en", "main_menu_button_tariflar"))),
+    ("select server", lambda: callback_update("select_server_germany")),
+    ("back to main", lambda: callback_update("back_to_main")),
+    ("My keys", lambda: message_update(t("en", "main_menu_button_kalitlarim"))),
+    ("Account", lambda: message_update(t("en", "main_menu_button_accauntim"))),
+    ("Instructions", lambda: message_update(t("en", "main_menu_button_korsatmalar"))),
+    ("Help", lambda: message_update(t("en", "main_menu_button_yordam"))),
+    ("My friend", lambda: message_update(t("en", "main_menu_button_dustim"))),
+]
+
+
+async def main():
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        user_data_manager = UserDataManager(Path(tmp) / "users.json", write_behind=False)
+        session = CountingSession()
+        bot = Bot("123456:TEST", session=session)
+        provisioner = Provisioner(bot, user_data_manager, ProvisioningOutbox(Path(tmp) / "provisioning.jsonl"))
+        dp = Dispatcher()
+        register_message_handlers(dp, user_data_manager, VPNLinkGenerator())
+        register_callback_query_handlers(dp, user_data_manager, VPNLinkGenerator(), provisioner)
+        total = 0
+        for name, make_update in ACTIONS:
+            session.calls.clear()
+            await dp.feed_update(bot, make_update())
+            total += len(session.calls)
+            methods = ", ".join(f"{method} x{count}" for method, count in Counter(session.calls).items())
+            print(f"{name:<24} {len(session.calls)} calls  {methods}")
+        print(f"{'total':<24} {total} calls")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+Cold-start time and RSS of the user stores.
+
+Generates synthetic users (a language and one VLESS key each), then starts
+each store in a fresh interpreter and reports how long the constructor took
+and how much the peak RSS grew. The lazy store is measured twice: the first
+start builds its offset index by scanning the file, the second loads the
+saved index.
+
+Usage:
+  pipenv run python -m benchmarks.bench_cold_start [--users 100000 1000000]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+
+_CHILD = r"""
+import asyncio, json, resource, sys, time
+sys.path.insert(0, {root!r})
+kind, path = sys.argv[1], sys.argv[2]
+if kind == "json":
+    from app.data.user_data_manager import UserDataManager as M
+    args = dict(file_path=path, write_behind=False)
+else:
+    from app.data.lazy_user_data_manager import LazyUserDataManager as M
+    args = dict(store_path=path, legacy_json_path=None)
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+manager = M(**args)
+elapsed = time.perf_counter() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+lang = manager.get_lang("1000")
+if kind != "json":
+    asyncio.run(manager.close())
+print(json.dumps({{"seconds": elapsed, "rss_mb": (after - before) / 1024}}))
+"""
+
+LANGS = ("en", "ru", "uz")
+
+
+def generate(directory: str, users: int):
+    json_path = os.path.join(directory, "users.json")
+    store_path = os.path.join(directory, "users.jsonl")
+    with open(json_path, "w") as json_file, open(store_path, "w") as store_file:
+        json_file.write("{")
+        for i in range(users):
+            user_id = str(1000 + i)
+            lang = LANGS[i % len(LANGS)]
+            record = {
+                "lang": lang,
+                "keys": [f"vless://{uuid.uuid4()}@us.example.com:8443?security=tls&type=tcp#Test"],
+            }
+            encoded = json.dumps(record, separators=(",", ":"))
+            json_file.write(("," if i else "") + f'"{user_id}":{encoded}')
+            store_file.write(f"{user_id}\t{lang}\t{encoded}\n")
+        json_file.write("}")
+    return json_path, store_path
+
+
+def measure(kind: str, path: str) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = _CHILD.format(root=root)
+    out = subprocess.run(
+        [sys.executable, "-c", script, kind, path], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'users':>10} {'store':<22} {'seconds':>9} {'rss MB':>9}")
+    for users in args.users:
+        with tempfile.TemporaryDirectory() as directory:
+            json_path, store_path = generate(directory, users)
+            rows = [
+                ("json (current)", measure("json", json_path)),
+                ("lazy (build index)", measure("lazy", store_path)),
+                ("lazy (saved index)", measure("lazy", store_path)),
+            ]
+            for name, result in rows:
+                print(f"{users:>10} {name:<22} {result['seconds']:>9.3f} {result['rss_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Size of stored VPN keys: full link strings versus StoredKey parameters.
+
+Generates the same synthetic keys both ways and reports the serialized
+users.json size and the in-memory size (tracemalloc) of the keys lists,
+plus the cost of re-rendering links with and without the LRU cache.
+
+Usage:
+  pipenv run python -m benchmarks.bench_key_storage [--users 10000] [--keys-per-user 3]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from app.data.user_record import user_to_json
+from app.data.vpn_keys import StoredKey
+from app.services import vpn_link_generator as generator_module
+from app.services.servers import all_servers
+
+
+def build(users: int, keys_per_user: int, as_links: bool, generator):
+    servers = all_servers()
+    data = {}
+    for i in range(users):
+        keys = []
+        for k in range(keys_per_user):
+            server = servers[(i + k) % len(servers)]
+            key = StoredKey.new(server.id, server.protocol)
+            keys.append(generator.render_key(key) if as_links else key)
+        data[str(1000 + i)] = {"lang": "en", "keys": keys}
+    return data
+
+
+def measure(users: int, keys_per_user: int, as_links: bool, generator):
+    tracemalloc.start()
+    data = build(users, keys_per_user, as_links, generator)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    disk = len(json.dumps({user_id: user_to_json(user) for user_id, user in data.items()}, separators=(",", ":")))
+    return data, memory, disk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--keys-per-user", type=int, default=3)
+    args = parser.parse_args()
+
+    generator = generator_module.VPNLinkGenerator()
+    _, link_memory, link_disk = measure(args.users, args.keys_per_user, True, generator)
+    data, key_memory, key_disk = measure(args.users, args.keys_per_user, False, generator)
+
+    print(f"{args.users} users x {args.keys_per_user} keys")
+    print(f"{'':<16} {'links':>12} {'parameters':>12}")
+    print(f"{'users.json MB':<16} {link_disk / 2**20:>12.2f} {key_disk / 2**20:>12.2f}")
+    print(f"{'memory MB':<16} {link_memory / 2**20:>12.2f} {key_memory / 2**20:>12.2f}")
+
+    keys = [key for user in data.values() for key in user["keys"]]
+    generator_module._render_key.cache_clear()
+    start = time.perf_counter()
+    for key in keys:
+        generator.render_key(key)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for key in keys[-1000:]:
+        generator.render_key(key)
+    warm = time.perf_counter() - start
+    print(f"render: {cold / len(keys) * 1e6:.1f} us/key uncached, {warm / 1000 * 1e6:.2f} us/key from LRU")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Cost of logging per log call and per handled update.
+
+"before" is the previous setup: f-string messages, formatted even when
+their level is disabled, written by the root StreamHandler in the event
+loop. "after" is configure_logging(): %-style arguments, a queue handler
+whose listener thread formats and writes the records, text or JSON lines,
+and LOG_SAMPLE_RATE. The log calls are timed in isolation first, then the
+user actions of bench_api_calls are fed through the real handlers (with a
+session that answers without any network) under each setup (interleaved,
+best of --repeats). Records go to a file in a temporary directory, and
+then to a slow stream that blocks for --write-delay per write, like a
+stderr pipe whose reader lags behind.
+
+Usage:
+  pipenv run python -m benchmarks.bench_logging [--rounds 100] [--repeats 5] [--write-delay 0.0002]
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import TextIO
+
+from aiogram import Bot, Dispatcher
+
+from app.data.user_data_manager import UserDataManager
+from app.handlers.callback_query_handlers import register_callback_query_handlers
+from app.handlers.message_handlers import register_message_handlers
+from app.handlers.middlewares import register_log_context_middleware
+from app.services.provisioning import Provisioner, ProvisioningOutbox
+from app.services.vpn_link_generator import VPNLinkGenerator
+from app.utils.logging_setup import TEXT_FORMAT, configure_logging
+from benchmarks.bench_api_calls import ACTIONS, CountingSession
+
+# The first two actions make a new user; the rest repeat
+REPEATED = ACTIONS[2:]
+
+# name -> (log_format, use_queue, sample_rate); None: the previous setup
+SETUPS = {
+    "before: sync text": None,
+    "after: queue text": ("text", True, 1.0),
+    "after: queue json": ("json", True, 1.0),
+    "after: queue json, sampled 0.1": ("json", True, 0.1),
+}
+
+# What configure_logging() turns off, for the previous setup
+DEFAULTS = (logging._srcfile, logging.logThreads, logging.logProcesses, logging.logMultiprocessing)
+
+
+class SlowStream:
+    """Blocks for delay seconds per write, releasing the GIL like a full pipe."""
+
+    def __init__(self, stream: TextIO, delay: float):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        if self.delay:
+            time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def configure(setup, stream):
+    """Returns the listener to stop, if any."""
+    if setup is None:
+        logging._srcfile, logging.logThreads, logging.logProcesses, logging.logMultiprocessing = DEFAULTS
+        root = logging.getLogger()
+        for old in root.handlers[:]:
+            root.removeHandler(old)
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        return None
+    log_format, use_queue, sample_rate = setup
+    return configure_logging("INFO", log_format, use_queue, sample_rate, stream)
+
+
+def per_call(name, log, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        log(i)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<44} {elapsed / calls * 1e9:8.0f} ns per call")
+
+
+def calls(tmp: Path, count: int) -> None:
+    """One log call, as the emitting code pays for it."""
+    logger = logging.getLogger("app.bench")
+    user_id, lang = "123456789", "en"
+    with open(tmp / "calls.log", "w") as stream:
+        for name, setup in (("before: sync text", None), ("after: queue text", ("text", True, 1.0))):
+            listener = configure(setup, stream)
+            per_call(f"{name}, f-string", lambda i: logger.info(f"Received /start from {user_id} with lang={lang} ({i})"), count)
+            per_call(f"{name}, %-style", lambda i: logger.info("Received /start from %s with lang=%s (%s)", user_id, lang, i), count)
+            if listener is not None:
+                listener.stop()
+        # A disabled level: the f-string is still built, the %-style call returns at once
+        logging.getLogger().setLevel(logging.WARNING)
+        per_call("INFO disabled, f-string", lambda i: logger.info(f"Received /start from {user_id} with lang={lang} ({i})"), count)
+        per_call("INFO disabled, %-style", lambda i: logger.info("Received /start from %s with lang=%s (%s)", user_id, lang, i), count)
+
+
+async def run(tmp: Path, rounds: int, setup, write_delay: float) -> float:
+    # Every run starts with no users
+    tmp = Path(tempfile.mkdtemp(dir=tmp))
+    user_data_manager = UserDataManager(tmp / "users.json")
+    await user_data_manager.start()
+    session = CountingSession()
+    bot = Bot("123456:TEST", session=session)
+    provisioner = Provisioner(bot, user_data_manager, ProvisioningOutbox(tmp / "provisioning.jsonl"))
+    dp = Dispatcher()
+    register_message_handlers(dp, user_data_manager, VPNLinkGenerator())
+    register_callback_query_handlers(dp, user_data_manager, VPNLinkGenerator(), provisioner)
+    if setup is not None:
+        register_log_context_middleware(dp, setup[2])
+    for _, make_update in ACTIONS[:2]:
+        await dp.feed_update(bot, make_update())
+    updates = [make_update() for _, make_update in REPEATED]
+    with open(tmp / "bot.log", "w") as stream:
+        listener = configure(setup, SlowStream(stream, write_delay))
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for update in updates:
+                await dp.feed_update(bot, update)
+        elapsed = time.perf_counter() - start
+        if listener is not None:
+            listener.stop()
+    logging.getLogger().setLevel(logging.WARNING)
+    await user_data_manager.close()
+    return elapsed / (rounds * len(updates))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--write-delay", type=float, default=0.0002)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        calls(Path(tmp), args.rounds * 200)
+    print()
+
+    names = list(SETUPS)
+    for sink, write_delay in (("file", 0.0), (f"slow stream ({args.write_delay * 1e6:.0f} us per write)", args.write_delay)):
+        best = dict.fromkeys(names, float("inf"))
+        with tempfile.TemporaryDirectory() as tmp:
+            for repeat in range(args.repeats):
+                # Rotated, so that no setup always runs first
+                shift = repeat % len(names)
+                for name in names[shift:] + names[:shift]:
+                    best[name] = min(best[name], await run(Path(tmp), args.rounds, SETUPS[name], write_delay))
+        print(f"to a {sink}:")
+        baseline = best[names[0]]
+        for name in names:
+            print(f"  {name:<32} {best[name] * 1e6:8.1f} us per update ({(best[name] - baseline) / baseline:+.1%})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
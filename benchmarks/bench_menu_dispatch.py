@@ -0,0 +1,60 @@
+"""
+Cost of matching reply-button texts to handlers.
+
+"before" evaluates the six F.text.in_([ru, uz, en]) magic filters in
+registration order until one matches (what aiogram did per text message);
+"after" is the single reverse-index lookup behind MenuButtonFilter. Both are
+measured over a mix of every button in every language plus free text that
+matches nothing (the worst case for the filter chain).
+
+Usage:
+  pipenv run python -m benchmarks.bench_menu_dispatch [--rounds 20000]
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+from aiogram import F
+
+from app.utils.i18n import available_languages, get_translation as t, lookup_menu_button
+
+ACTIONS = ("tariflar", "kalitlarim", "accauntim", "korsatmalar", "yordam", "dustim")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20_000)
+    args = parser.parse_args()
+
+    filters = [
+        F.text.in_([t("ru", f"main_menu_button_{action}"), t("uz", f"main_menu_button_{action}"), t("en", f"main_menu_button_{action}")])
+        for action in ACTIONS
+    ]
+    texts = [t(lang, f"main_menu_button_{action}") for lang in available_languages() for action in ACTIONS]
+    texts += ["hello", "PROMO2024"]
+    messages = [SimpleNamespace(text=text) for text in texts]
+
+    def before(message):
+        for magic in filters:
+            if magic.resolve(message):
+                return True
+        return False
+
+    def after(message):
+        return lookup_menu_button(message.text) is not None
+
+    assert [before(m) for m in messages] == [after(m) for m in messages]
+
+    for name, check in (("before: 6 F.text.in_ filters", before), ("after: reverse index", after)):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for message in messages:
+                check(message)
+        elapsed = time.perf_counter() - start
+        per_update = elapsed / (args.rounds * len(messages)) * 1e6
+        print(f"{name:<32} {per_update:8.3f} us per text update")
+
+
+if __name__ == "__main__":
+    main()
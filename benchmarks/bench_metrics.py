@@ -0,0 +1,145 @@
+"""
+Overhead of the handler metrics and what they report.
+
+Feeds the user actions of bench_api_calls through the real handlers (with a
+session that answers without any network) without metrics, then with the
+metrics middleware, instrumented storage and link generator and the Bot API
+middleware at several sample rates (interleaved, best of --repeats), and
+prints the time per update, which on a busy machine varies by more than
+the metrics cost; so it first measures that cost in isolation. Ends
+with the mean time per part of each handler at sample rate 1.
+
+Usage:
+  pipenv run python -m benchmarks.bench_metrics [--rounds 100] [--repeats 8]
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from aiogram import Bot, Dispatcher
+
+from app.data.user_data_manager import UserDataManager
+from app.handlers.callback_query_handlers import register_callback_query_handlers
+from app.handlers.key_pages import key_pages
+from app.handlers.message_handlers import register_message_handlers
+from app.handlers.middlewares import register_metrics_middleware
+from app.services.metrics import LINK_METHODS, LINKS, PARTS, STORAGE, STORAGE_METHODS, ApiMetrics, Metrics, instrument
+from app.services.provisioning import Provisioner, ProvisioningOutbox
+from app.services.vpn_link_generator import VPNLinkGenerator
+from benchmarks.bench_api_calls import ACTIONS, CountingSession
+
+# The first two actions make a new user; the rest repeat
+REPEATED = ACTIONS[2:]
+
+
+async def run(tmp: Path, rounds: int, sample_rate=None):
+    # Every run starts with no users
+    tmp = Path(tempfile.mkdtemp(dir=tmp))
+    user_data_manager = UserDataManager(tmp / "users.json")
+    await user_data_manager.start()
+    vpn_link_generator = VPNLinkGenerator()
+    session = CountingSession()
+    metrics = None
+    if sample_rate is not None:
+        metrics = Metrics(sample_rate)
+        session.middleware(ApiMetrics(metrics))
+        instrument(user_data_manager, STORAGE, STORAGE_METHODS)
+        instrument(vpn_link_generator, LINKS, LINK_METHODS)
+    bot = Bot("123456:TEST", session=session)
+    provisioner = Provisioner(bot, user_data_manager, ProvisioningOutbox(tmp / "provisioning.jsonl"))
+    dp = Dispatcher()
+    register_message_handlers(dp, user_data_manager, vpn_link_generator)
+    register_callback_query_handlers(dp, user_data_manager, vpn_link_generator, provisioner)
+    if metrics is not None:
+        register_metrics_middleware(dp, metrics)
+    for _, make_update in ACTIONS[:2]:
+        await dp.feed_update(bot, make_update())
+    updates = [make_update() for _, make_update in REPEATED]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for update in updates:
+            await dp.feed_update(bot, update)
+    elapsed = time.perf_counter() - start
+    await user_data_manager.close()
+    return elapsed / (rounds * len(updates)), metrics
+
+
+async def per_call(coroutine_function, calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        await coroutine_function()
+    return (time.perf_counter() - start) / calls
+
+
+async def costs(tmp: Path, calls: int) -> None:
+    """What the metrics add per update and per instrumented call, in isolation."""
+
+    async def handler():
+        pass
+
+    for sample_rate in (0.0, 0.1, 1.0):
+        metrics = Metrics(sample_rate)
+        direct = await per_call(handler, calls)
+        measured = await per_call(lambda: metrics.measure("handler", handler), calls)
+        print(f"middleware, sample rate {sample_rate:<4} {(measured - direct) * 1e9:8.0f} ns per update")
+    user_data_manager = UserDataManager(tmp / "costs.json")
+    plain = user_data_manager.get_lang
+    instrument(user_data_manager, STORAGE, STORAGE_METHODS)
+
+    async def plain_calls():
+        plain("42")
+
+    async def instrumented_calls():
+        user_data_manager.get_lang("42")
+
+    direct = await per_call(plain_calls, calls)
+    unsampled = await per_call(instrumented_calls, calls)
+    # All calls inside one sampled update
+    sampled = await Metrics(1.0).measure("handler", lambda: per_call(instrumented_calls, calls))
+    print(f"instrumented get_lang, not sampled {(unsampled - direct) * 1e9:8.0f} ns per call")
+    print(f"instrumented get_lang, sampled     {(sampled - direct) * 1e9:8.0f} ns per call")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=8)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        await costs(Path(tmp), args.rounds * 1000)
+    print()
+
+    # Interleaved and repeated; the best time of each configuration counts
+    configurations = (None, 0.0, 0.1, 1.0)
+    best = dict.fromkeys(configurations, float("inf"))
+    # The key list renders through the shared key_pages generator
+    instrument(key_pages.vpn_link_generator, LINKS, LINK_METHODS)
+    with tempfile.TemporaryDirectory() as tmp:
+        for repeat in range(args.repeats):
+            # Rotated, so that no configuration always runs first
+            for sample_rate in configurations[repeat % 4:] + configurations[:repeat % 4]:
+                per_update, measured = await run(Path(tmp), args.rounds, sample_rate)
+                best[sample_rate] = min(best[sample_rate], per_update)
+                if sample_rate == 1.0:
+                    metrics = measured
+    baseline = best[None]
+    print(f"{'no metrics':<18} {baseline * 1e6:8.1f} us per update")
+    for sample_rate in configurations[1:]:
+        overhead = (best[sample_rate] - baseline) / baseline
+        print(f"{f'sample rate {sample_rate}':<18} {best[sample_rate] * 1e6:8.1f} us per update ({overhead:+.1%})")
+    print()
+    print(f"{'handler':<36} {'total':>9} " + " ".join(f"{part:>9}" for part in PARTS) + "   (mean us)")
+    for name, stats in sorted(metrics.handlers.items()):
+        count = stats.seconds.count
+        parts = " ".join(f"{stats.parts[part].sum / count * 1e6:9.1f}" for part in PARTS)
+        print(f"{name:<36} {stats.seconds.sum / count * 1e6:9.1f} {parts}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""
+Outbound sends against a fake Bot API that enforces flood limits.
+
+A burst of interactive replies (every chat gets a few messages in a row, like
+a handler sending content and then the main menu) is sent together with a
+bulk broadcast to other chats, once straight through and once through
+OutboundRateLimiter. Reports 429 responses, total time and how long
+interactive and bulk messages waited.
+
+Usage:
+  pipenv run python -m benchmarks.bench_outbound [--chats 40] [--per-chat 3] [--bulk 150]
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.services.bot_session import CachedMarkupSession
+from app.services.outbound import OutboundRateLimiter, bulk_priority
+from benchmarks.fake_telegram import FakeTelegramServer
+
+TOKEN = "123456:TEST"
+
+
+async def run(args, limited):
+    telegram = FakeTelegramServer(latency=(0.0, 0.01), flood_limits=(30, 3))
+    await telegram.start()
+    bot = Bot(token=TOKEN, session=CachedMarkupSession(api=TelegramAPIServer.from_base(telegram.url)))
+    limiter = OutboundRateLimiter() if limited else None
+    if limiter is not None:
+        bot.session.middleware(limiter)
+    latencies = {"interactive": [], "bulk": []}
+    failed = 0
+
+    async def send(chat_id, kind):
+        nonlocal failed
+        start = time.perf_counter()
+        try:
+            await bot.send_message(chat_id, f"{kind} message")
+        except TelegramRetryAfter:
+            failed += 1
+        latencies[kind].append(time.perf_counter() - start)
+
+    async def interactive(chat_id):
+        for _ in range(args.per_chat):
+            await send(chat_id, "interactive")
+
+    async def broadcast():
+        with bulk_priority():
+            await asyncio.gather(*(send(10_000 + n, "bulk") for n in range(args.bulk)))
+
+    start = time.perf_counter()
+    await asyncio.gather(broadcast(), *(interactive(1 + n) for n in range(args.chats)))
+    elapsed = time.perf_counter() - start
+    await bot.session.close()
+    await telegram.close()
+    if limiter is not None:
+        await limiter.close()
+
+    name = "rate limited" if limited else "direct"
+    avg = {kind: sum(values) / len(values) for kind, values in latencies.items()}
+    print(
+        f"{name:<13} {elapsed:6.2f}s total, {telegram.flood_errors:4} 429s, {failed:4} lost, "
+        f"interactive avg {avg['interactive']:6.3f}s, bulk avg {avg['bulk']:6.3f}s"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=40)
+    parser.add_argument("--per-chat", type=int, default=3)
+    parser.add_argument("--bulk", type=int, default=150)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    await run(args, limited=False)
+    await run(args, limited=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
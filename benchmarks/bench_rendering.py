@@ -0,0 +1,76 @@
+"""
+Cost of escaping and of rendering whole MarkdownV2 messages.
+
+"before" is the previous escape_markdown_v2 (a regex built with
+str.format + re.escape on every call) and the previous way of building
+messages: f-strings with a get_translation() and an escape per part.
+"after" is the str.translate escape and the compiled message templates of
+app.utils.message_templates. Also checks that both escapes agree on text
+without backslashes (the old one left those unescaped).
+
+Usage:
+  pipenv run python -m benchmarks.bench_rendering [--rounds 20000]
+"""
+
+import argparse
+import logging
+import re
+import time
+
+from app.data.vpn_keys import StoredKey
+from app.services.vpn_link_generator import VPNLinkGenerator
+from app.utils.i18n import available_languages, get_translation as t
+from app.utils.message_templates import ACCOUNT_INFO, KEY_ENTRY, VPN_LINK
+from app.utils.rendering import escape_markdown_v2
+
+
+def old_escape_markdown_v2(text):
+    escape_chars = r'_*[]()~`>#+-=|{}.!'
+    return re.sub(r"([{}])".format(re.escape(escape_chars)), r"\\\1", text)
+
+
+def old_vpn_link(lang, link):
+    return f"{old_escape_markdown_v2(t(lang, 'your_vpn_link', 'Your VPN link:'))}\n`{old_escape_markdown_v2(link)}`"
+
+
+def old_account_info(lang, user_id):
+    return f"{t(lang, 'account_info_header', 'Your Account:')}\n\n{t(lang, 'account_info_user_id', 'User ID:')} `{old_escape_markdown_v2(user_id)}`"
+
+
+def measure(name, render, cases, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for case in cases:
+            render(*case)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {elapsed / (rounds * len(cases)) * 1e6:8.2f} us per call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20_000)
+    args = parser.parse_args()
+    logging.getLogger("app").setLevel(logging.ERROR)
+
+    generator = VPNLinkGenerator()
+    links = [generator.render_key(StoredKey.new(server, "vmess")) for server in ("russia", "germany")]
+    links.append(generator.generate_vpn_link("vless", "example.com", 443, network="ws", path="/ws", user_uuid="00000000-0000-4000-8000-000000000000"))
+    texts = [(t(lang, "referral_bonus_info"),) for lang in available_languages()] + [(link,) for link in links]
+    for (text,) in texts:
+        assert escape_markdown_v2(text) == old_escape_markdown_v2(text), text
+    langs = available_languages()
+    link_cases = [(lang, link) for lang in langs for link in links]
+    account_cases = [(lang, "123456789") for lang in langs]
+
+    measure("before: escape", old_escape_markdown_v2, texts, args.rounds)
+    measure("after: escape", escape_markdown_v2, texts, args.rounds)
+    measure("before: VPN link message", old_vpn_link, link_cases, args.rounds)
+    measure("after: VPN link message", lambda lang, link: VPN_LINK.render(lang, link=link), link_cases, args.rounds)
+    measure("before: account message", old_account_info, account_cases, args.rounds)
+    measure("after: account message", lambda lang, user_id: ACCOUNT_INFO.render(lang, user_id=user_id), account_cases, args.rounds)
+    measure("after: key list entry", lambda lang, link: KEY_ENTRY.render(lang, number=12, link=link), link_cases, args.rounds)
+    print(f"VPN link message: {len(old_vpn_link('en', links[0]))} characters before, {len(VPN_LINK.render('en', link=links[0]))} after")
+
+
+if __name__ == "__main__":
+    main()
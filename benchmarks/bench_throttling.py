@@ -0,0 +1,66 @@
+"""
+Cost and memory of the per-user throttle.
+
+Times UserThrottle.take() for a known user, a user over the limit and new
+users, then replays --users distinct users arriving at --arrival-rate per
+second (simulated time, one server selection and a few menu updates each)
+and reports the users tracked and the memory (tracemalloc) at the end, next
+to the same buckets never swept.
+
+Usage:
+  pipenv run python -m benchmarks.bench_throttling [--users 1000000] [--arrival-rate 1000]
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from app.services import token_buckets
+from app.services.throttling import KEYS, MENU, UserThrottle
+
+
+def per_call(name, call, count):
+    start = time.perf_counter()
+    for i in range(count):
+        call(i)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<36} {elapsed / count * 1e9:8.0f} ns per call")
+
+
+def replay(users: int, arrival_rate: float):
+    throttle = UserThrottle()
+    tracemalloc.start()
+    for i in range(users):
+        now = i / arrival_rate
+        user_id = 100_000_000 + i
+        throttle.take(KEYS, user_id, now)
+        for step in range(3):
+            throttle.take(MENU, user_id, now + step)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memory, {action: len(buckets) for action, buckets in throttle.buckets.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--arrival-rate", type=float, default=1000.0, help="new users per second")
+    args = parser.parse_args()
+
+    throttle = UserThrottle({MENU: (1e9, 1), KEYS: (1e-9, 1)})
+    per_call("take, allowed", lambda i: throttle.take(MENU, 42), 1_000_000)
+    throttle.take(KEYS, 42)
+    per_call("take, throttled", lambda i: throttle.take(KEYS, 42), 1_000_000)
+    per_call("take, new user", lambda i: throttle.take(MENU, 100_000_000 + i), 1_000_000)
+    print()
+
+    print(f"{args.users} users arriving at {args.arrival_rate:.0f}/s:")
+    memory, tracked = replay(args.users, args.arrival_rate)
+    print(f"  {'swept':<12} tracking {tracked}, {memory / 2**20:.1f} MiB")
+    token_buckets._PRUNE_EVERY = args.users + 1
+    memory, tracked = replay(args.users, args.arrival_rate)
+    print(f"  {'never swept':<12} tracking {tracked}, {memory / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
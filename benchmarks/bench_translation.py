@@ -0,0 +1,60 @@
+"""
+Cost of one get_translation() call.
+
+"before" is the previous lookup: load_translation_file() per call followed
+by a membership test and a .get(), logging a warning on every miss;
+"after" is the compiled lookup. Hits cover every key of every catalog;
+misses use keys no catalog has (the previous code logged each one; those
+records go to a NullHandler so only building them is measured).
+
+Usage:
+  pipenv run python -m benchmarks.bench_translation [--rounds 2000]
+"""
+
+import argparse
+import logging
+import time
+
+from app.utils import i18n
+from app.utils.i18n import available_languages, get_translation, load_translation_file
+
+old_logger = logging.getLogger("bench_translation.old")
+old_logger.addHandler(logging.NullHandler())
+old_logger.propagate = False
+
+
+def old_get_translation(lang_code, key, default=None):
+    translations = load_translation_file(lang_code)
+    if key not in translations and default is None:
+        old_logger.warning(f"Translation key '{key}' not found for language '{lang_code}'. Returning key itself.")
+        return key
+    return translations.get(key, default if default is not None else key)
+
+
+def measure(name, lookup, pairs, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for lang_code, key in pairs:
+            lookup(lang_code, key)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {elapsed / (rounds * len(pairs)) * 1e9:8.1f} ns per call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2_000)
+    args = parser.parse_args()
+
+    logging.getLogger("app").setLevel(logging.ERROR)
+    hits = [(lang, key) for lang in available_languages() for key in load_translation_file(lang)]
+    misses = [(lang, f"no_such_key_{n}") for lang in available_languages() for n in range(10)]
+
+    measure("before: hit", old_get_translation, hits, args.rounds)
+    measure("after: hit", get_translation, hits, args.rounds)
+    measure("before: miss", old_get_translation, misses, args.rounds)
+    measure("after: miss", get_translation, misses, args.rounds)
+    print(f"missing-key counter: {len(i18n.missing_keys_report())} distinct pairs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+End-to-end broadcast against a local fake Telegram server.
+
+Fills a temporary user store, marks some users as having blocked the bot or
+deleted their account, and broadcasts a per-language message. Halfway
+through the broadcaster is stopped as on shutdown and a new one resumes the
+job from its checkpoint. Checks that every user was messaged exactly once,
+in their language, and that blocked/deactivated users were recorded, then
+reports throughput against the configured rate.
+
+Usage:
+  pipenv run python -m benchmarks.broadcast_e2e [--users 3000] [--rate 500]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.data.user_data_manager import UserDataManager
+from app.services.bot_session import CachedMarkupSession
+from app.services.broadcast import Broadcaster, parse_templates
+from app.services.outbound import OutboundRateLimiter
+from benchmarks.fake_telegram import FakeTelegramServer
+
+TEXT = """New servers are available!
+[ru]
+Доступны новые серверы!
+[uz]
+Yangi serverlar mavjud!"""
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--rate", type=float, default=500.0, help="broadcast messages per second")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    templates = parse_templates(TEXT)
+    telegram = FakeTelegramServer()
+    await telegram.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        users = UserDataManager(Path(tmp) / "users.json", write_behind=False)
+        random.seed(1)
+        for n in range(args.users):
+            user_id = str(random.randint(10_000, 10_000_000_000))
+            users.update_user_data(user_id, {"lang": random.choice(["en", "ru", "uz", None])})
+            if n % 20 == 0:
+                telegram.blocked_chats.add(user_id)
+            elif n % 50 == 1:
+                telegram.deactivated_chats.add(user_id)
+
+        bot = Bot(token="123456:TEST", session=CachedMarkupSession(api=TelegramAPIServer.from_base(telegram.url)))
+        limiter = OutboundRateLimiter(global_rate=args.rate * 2, chat_rate=1.0)
+        bot.session.middleware(limiter)
+
+        start = time.perf_counter()
+        first = Broadcaster(bot, users, state_dir=Path(tmp) / "broadcasts", rate=args.rate, batch_size=100)
+        job = first.start(templates)
+        while job.processed < job.total // 2:
+            await asyncio.sleep(0.05)
+        await first.close()
+        stopped_at = job.processed
+
+        second = Broadcaster(bot, users, state_dir=Path(tmp) / "broadcasts", rate=args.rate, batch_size=100)
+        job = second.resume_pending()
+        await second.wait()
+        elapsed = time.perf_counter() - start
+        print(second.format_progress())
+
+        received = Counter(params["chat_id"] for params in telegram.calls_to("sendMessage"))
+        duplicates = sum(1 for count in received.values() if count > 1)
+        expected = {user_id: templates.get(lang or "en") for user_id, lang in users.iter_users()}
+        wrong_text = sum(
+            1 for params in telegram.calls_to("sendMessage") if expected[params["chat_id"]] != params["text"]
+        )
+        outcomes = job.counts
+        print(
+            f"stopped after {stopped_at}, resumed; {len(received)}/{args.users} users reached, "
+            f"{duplicates} messaged twice, {wrong_text} in the wrong language"
+        )
+        print(
+            f"blocked {outcomes.get('blocked', 0)}/{len(telegram.blocked_chats)}, "
+            f"deactivated {outcomes.get('deactivated', 0)}/{len(telegram.deactivated_chats)}"
+        )
+        print(f"{args.users / elapsed:.0f} msg/s overall at a configured rate of {args.rate:.0f} msg/s")
+        await bot.session.close()
+    await telegram.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
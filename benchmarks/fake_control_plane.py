@@ -0,0 +1,100 @@
+"""
+Minimal local stand-in for the servers' management APIs.
+
+Serves POST /nodes/<node>/users/batch as described in
+app.services.provisioning, so a server's api_url is <url>/nodes/<node>.
+Every node keeps the ids registered on it and every batch received. Faults
+can be injected: error_rate answers 503 without applying the batch,
+lost_response_rate applies it and then answers 503 (as if the response
+got lost), nodes listed in outage answer 503, and adds by users in
+rejected_users are refused per id. Batches are remembered by Idempotency-Key
+and a repeated key gets the first answer again without being re-applied.
+"""
+
+import asyncio
+import random
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+
+class FakeControlPlane:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8082,
+        latency: Tuple[float, float] = (0.0, 0.0),
+        error_rate: float = 0.0,
+        lost_response_rate: float = 0.0,
+        token: str = "",
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lost_response_rate = lost_response_rate
+        self.token = token
+        self.outage: Set[str] = set()
+        self.rejected_users: Set[str] = set()
+        # node -> registered id -> email
+        self.users: Dict[str, Dict[str, str]] = defaultdict(dict)
+        # (node, number of adds, number of removes) of every applied batch
+        self.batches: List[Tuple[str, int, int]] = []
+        self.requests = 0
+        self.errors = 0
+        self.replayed = 0  # requests answered from the idempotency cache
+        self._answers: Dict[str, Dict[str, Any]] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def api_url(self, node: str) -> str:
+        return f"{self.url}/nodes/{node}"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/nodes/{node}/users/batch", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        node = request.match_info["node"]
+        if self.token and request.headers.get("Authorization") != f"Bearer {self.token}":
+            return web.json_response({"error": "unauthorized"}, status=401)
+        low, high = self.latency
+        if high:
+            await asyncio.sleep(random.uniform(low, high))
+        if node in self.outage or random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": "unavailable"}, status=503)
+        batch_id = request.headers.get("Idempotency-Key", "")
+        if batch_id in self._answers:
+            self.replayed += 1
+            return web.json_response(self._answers[batch_id])
+        body = await request.json()
+        users = self.users[node]
+        rejected = {}
+        for add in body.get("add", []):
+            if add["email"] in self.rejected_users:
+                rejected[add["id"]] = "user is not allowed on this node"
+            else:
+                users[add["id"]] = add["email"]
+        for user_id in body.get("remove", []):
+            users.pop(user_id, None)
+        self.batches.append((node, len(body.get("add", [])), len(body.get("remove", []))))
+        answer = {"rejected": rejected}
+        if batch_id:
+            self._answers[batch_id] = answer
+        if random.random() < self.lost_response_rate:
+            self.errors += 1
+            return web.json_response({"error": "unavailable"}, status=503)
+        return web.json_response(answer)
@@ -0,0 +1,157 @@
+"""
+Minimal local stand-in for the Telegram Bot API.
+
+Serves /bot<token>/<method> for the methods the bot uses, records every call
+and answers with just enough of a result for aiogram to parse. Point the bot
+at it with TELEGRAM_API_URL=http://127.0.0.1:<port>. Optional per-request
+latency makes concurrency effects visible, optional flood limits answer
+429 with retry_after like Telegram does when a bot sends too fast, and chats
+listed in blocked_chats / deactivated_chats answer 403 like users who
+blocked the bot or deleted their account. error_rate answers that share of
+the replies (send, edit and answerCallbackQuery calls) with a 429 at
+random. Updates queued with push_updates() are served by getUpdates, long
+polling included, for bots running in polling mode.
+"""
+
+import asyncio
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Test", "username": "test_vpn_bot"}
+
+
+class FakeTelegramServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8081,
+        latency: Tuple[float, float] = (0.0, 0.0),
+        flood_limits: Optional[Tuple[int, int]] = None,
+        error_rate: float = 0.0,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # (messages per second overall, messages per second per chat)
+        self.flood_limits = flood_limits
+        self.flood_errors = 0
+        self.error_rate = error_rate
+        self.injected_errors = 0
+        # Updates not yet confirmed by a getUpdates offset
+        self._updates: Deque[Dict[str, Any]] = deque()
+        self._updates_pushed = asyncio.Event()
+        self._sent_global: Deque[float] = deque()
+        self._sent_chat: Dict[str, Deque[float]] = defaultdict(deque)
+        self.blocked_chats: Set[str] = set()
+        self.deactivated_chats: Set[str] = set()
+        # (method, params, monotonic time) for every request received
+        self.calls: List[Tuple[str, Dict[str, Any], float]] = []
+        self.webhook: Optional[Dict[str, Any]] = None
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def calls_to(self, method: str) -> List[Dict[str, Any]]:
+        return [params for name, params, _ in self.calls if name == method]
+
+    def push_updates(self, updates: List[Dict[str, Any]]) -> None:
+        """Queues updates (dicts in Bot API form, with ascending update_id) for getUpdates."""
+        self._updates.extend(updates)
+        self._updates_pushed.set()
+
+    @property
+    def pending_updates(self) -> int:
+        return len(self._updates)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls.append((method, params, time.monotonic()))
+        flooded = self.flood_limits and method.startswith(("send", "edit")) and self._flooded(params.get("chat_id"))
+        low, high = self.latency
+        if high:
+            await asyncio.sleep(random.uniform(low, high))
+        chat_id = params.get("chat_id")
+        if chat_id in self.blocked_chats or chat_id in self.deactivated_chats:
+            reason = "bot was blocked by the user" if chat_id in self.blocked_chats else "user is deactivated"
+            return web.json_response({"ok": False, "error_code": 403, "description": f"Forbidden: {reason}"}, status=403)
+        if method.lower() == "getupdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+        if flooded or (self.error_rate and method.startswith(("send", "edit", "answer")) and random.random() < self.error_rate):
+            if flooded:
+                self.flood_errors += 1
+            else:
+                self.injected_errors += 1
+            return web.json_response(
+                {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1}},
+                status=429,
+            )
+        return web.json_response({"ok": True, "result": self._result(method.lower(), params)})
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Confirms the updates before offset, then returns the next ones, waiting up to timeout for any."""
+        offset = int(params.get("offset", 0))
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._updates_pushed.clear()
+            try:
+                await asyncio.wait_for(self._updates_pushed.wait(), float(params.get("timeout", 0)))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit", 100))
+        return [update for _, update in zip(range(limit), self._updates)]
+
+    def _flooded(self, chat_id: Optional[str]) -> bool:
+        """Counts a message against one-second windows; True if a limit is exceeded."""
+        now = time.monotonic()
+        global_limit, chat_limit = self.flood_limits
+        windows = [(self._sent_global, global_limit)]
+        if chat_id is not None:
+            windows.append((self._sent_chat[chat_id], chat_limit))
+        for window, limit in windows:
+            while window and window[0] <= now - 1.0:
+                window.popleft()
+            if len(window) >= limit:
+                return True
+        for window, _ in windows:
+            window.append(now)
+        return False
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getme":
+            return BOT_USER
+        if method == "setwebhook":
+            self.webhook = params
+            return True
+        if method == "deletewebhook":
+            self.webhook = None
+            return True
+        if method in ("sendmessage", "editmessagetext"):
+            self._message_id += 1
+            return {
+                "message_id": int(params.get("message_id", self._message_id)),
+                "date": int(time.time()),
+                "chat": {"id": int(params["chat_id"]), "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        return True
@@ -0,0 +1,167 @@
+"""
+Server health monitor against local listener stand-ins.
+
+Starts listeners on 127.0.0.1 in front of a local TLS server that behave
+like a healthy server, a slow one (handshake delayed), a hung one (accepts,
+never handshakes), a flaky one (drops every other connection) and a closed
+port. After a few probe rounds it checks the resulting states, the servers
+offered, the "auto (fastest)" pick, that rounds are bounded by the probe
+timeout and that no more than --concurrency probes ran at once. Needs the
+openssl binary for a throwaway self-signed certificate.
+
+Usage:
+  pipenv run python -m benchmarks.health_e2e [--rounds 4] [--timeout 0.5] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import logging
+import ssl
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from app.services.health import DEGRADED, DOWN, UP, HealthMonitor
+from app.services.servers import build_server
+
+
+def make_ssl_context(tmp: Path) -> ssl.SSLContext:
+    cert, key = tmp / "cert.pem", tmp / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+         "-keyout", str(key), "-out", str(cert)],
+        check=True, capture_output=True,
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def pipe(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+class Listener:
+    """
+    A plain TCP front for the TLS backend: relays connections to it after
+    delay seconds, never (delay=None) or drops every drop_every-th one.
+    """
+
+    def __init__(self, backend_port: int, delay=0.0, drop_every=0):
+        self.backend_port = backend_port
+        self.delay = delay
+        self.drop_every = drop_every
+        self.connections = 0
+        self.open = 0
+        self.max_open = 0
+        self.port = None
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self.open += 1
+        self.max_open = max(self.max_open, self.open)
+        try:
+            if self.drop_every and self.connections % self.drop_every == 0:
+                return
+            if self.delay is None:
+                await reader.read()  # until the prober gives up
+                return
+            await asyncio.sleep(self.delay)
+            backend_reader, backend_writer = await asyncio.open_connection("127.0.0.1", self.backend_port)
+            await asyncio.gather(pipe(reader, backend_writer), pipe(backend_reader, writer))
+        except OSError:
+            pass
+        finally:
+            self.open -= 1
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+
+
+async def hold(reader, writer):
+    # The TLS backend: the handshake is all a probe needs
+    await reader.read()
+    writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        context = make_ssl_context(Path(tmp))
+    backend = await asyncio.start_server(hold, "127.0.0.1", 0, ssl=context)
+    backend_port = backend.sockets[0].getsockname()[1]
+    listeners = {
+        "fast": Listener(backend_port),
+        "slow": Listener(backend_port, delay=args.timeout / 3),
+        "hung": Listener(backend_port, delay=None),
+        "flaky": Listener(backend_port, drop_every=2),
+    }
+    for listener in listeners.values():
+        await listener.start()
+    # A port nothing listens on any more
+    closed = Listener(backend_port)
+    await closed.start()
+    await closed.close()
+
+    servers = [build_server(name, {"address": "127.0.0.1", "port": listener.port, "security": "tls"}) for name, listener in listeners.items()]
+    servers.append(build_server("closed", {"address": "127.0.0.1", "port": closed.port, "security": "tls"}))
+    # Extra hung servers so that probes have to queue for the concurrency limit
+    servers += [
+        build_server(f"hung{n}", {"address": "127.0.0.1", "port": listeners["hung"].port, "security": "tls"}) for n in range(8)
+    ]
+    monitor = HealthMonitor(timeout=args.timeout, concurrency=args.concurrency, servers=lambda: servers)
+
+    round_times = []
+    for _ in range(args.rounds):
+        start = time.perf_counter()
+        await monitor.probe_all()
+        round_times.append(time.perf_counter() - start)
+
+    expected = {"fast": UP, "slow": UP, "hung": DOWN, "flaky": DEGRADED, "closed": DOWN}
+    ok = True
+    for server_id, want in expected.items():
+        stats = monitor.health(server_id)
+        latency = f"{stats.latency * 1000:6.1f} ms" if stats.latency is not None else "      -  "
+        state = monitor.state(server_id)
+        ok &= state == want
+        print(f"{server_id:<8} {state:<9} (expected {want:<8}) availability {stats.availability:4.0%}  latency {latency}")
+
+    offered = [server.id for server, _ in monitor.offered(servers)]
+    marked = [server.id for server, unhealthy in monitor.offered(servers) if unhealthy]
+    fastest = monitor.fastest(servers)
+    # Every probe is cut off at the timeout, so a round of n servers takes at most ceil(n / concurrency) timeouts
+    bound = -(-len(servers) // args.concurrency) * args.timeout + 0.5
+    hung_open = listeners["hung"].max_open
+    print(f"offered: {', '.join(offered)}; marked: {', '.join(marked) or '-'}; auto picks: {fastest.id}")
+    print(f"round time max {max(round_times):.2f}s (bound {bound:.2f}s); at most {hung_open} hung probes open at once (limit {args.concurrency})")
+    ok &= offered == ["fast", "slow", "flaky"] and marked == ["flaky"] and fastest.id == "fast"
+    ok &= max(round_times) <= bound and hung_open <= args.concurrency
+    print("OK" if ok else "FAILED")
+
+    for listener in listeners.values():
+        await listener.close()
+    backend.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
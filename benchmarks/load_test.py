@@ -0,0 +1,303 @@
+"""
+Load test of the dispatcher against a local fake Telegram Bot API.
+
+Replays a mix of user traffic (/start, menu buttons, select_server_*
+callbacks, language switches; every user starts with /start) through the
+real handlers, wired as in main.py. In polling mode the updates are queued
+on benchmarks.fake_telegram and fetched with getUpdates; in webhook mode
+they are posted to run_webhook() the way Telegram does, each chat's updates
+in order and many chats at once. The fake API can add latency and answer
+a share of the replies with 429. The per-user throttle is off unless
+--throttle is given: simulated users click far faster than its limits.
+
+For each user count it reports throughput, p50/p99 handler latency (all
+updates and per handler), the bytes the user store wrote (write() calls of
+the process, from /proc/self/io; logging is off while measuring) and the
+Bot API calls and errors. The traffic is the same for the same --seed, so
+runs can be compared across commits: --output saves the results as JSON,
+--compare prints the change against a saved run.
+
+Usage:
+  pipenv run python -m benchmarks.load_test [--users 100,1000] [--updates 3000] [--mode polling]
+      [--storage json] [--latency 0.005] [--error-rate 0] [--rate-limit] [--throttle]
+      [--seed 1] [--output results.json] [--compare previous.json]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.data.journaled_user_data_manager import JournaledUserDataManager
+from app.data.lazy_user_data_manager import LazyUserDataManager
+from app.data.sqlite_user_data_manager import SQLiteUserDataManager
+from app.data.user_data_manager import UserDataManager
+from app.handlers.callback_query_handlers import register_callback_query_handlers
+from app.handlers.error_handlers import register_error_handler
+from app.handlers.message_handlers import register_message_handlers
+from app.handlers.middlewares import handler_name, register_throttling_middleware
+from app.services.bot_session import CachedMarkupSession
+from app.services.outbound import OutboundRateLimiter
+from app.services.provisioning import Provisioner, ProvisioningOutbox
+from app.services.servers import AUTO_SERVER_ID, SERVER_CALLBACK_PREFIX, available_servers
+from app.services.throttling import UserThrottle
+from app.services.update_pipeline import UpdatePipeline
+from app.services.vpn_link_generator import VPNLinkGenerator
+from app.services.webhook import SECRET_HEADER, run_webhook
+from app.utils.i18n import available_languages, get_translation as t
+from benchmarks.fake_telegram import FakeTelegramServer
+from benchmarks.results import compare, load_results, write_results
+
+TOKEN = "123456:TEST"
+SECRET = "load-test-secret"
+WEBHOOK_PORT = 8082
+FIRST_USER_ID = 100_000
+
+# Share of each kind of update, after every user's first /start
+MIX = (("start", 10), ("menu", 45), ("select_server", 30), ("language", 15))
+MENU_BUTTONS = (
+    "main_menu_button_tariflar",
+    "main_menu_button_kalitlarim",
+    "main_menu_button_accauntim",
+    "main_menu_button_korsatmalar",
+    "main_menu_button_yordam",
+    "main_menu_button_dustim",
+)
+
+
+def traffic(users: int, updates: int, seed: int) -> List[Dict[str, Any]]:
+    """updates updates (at least one per user) from users users, in Bot API form."""
+    rng = random.Random(seed)
+    kinds, weights = zip(*MIX)
+    languages = available_languages()
+    server_ids = [server.id for server in available_servers()] + [AUTO_SERVER_ID]
+    langs: Dict[int, str] = {}
+    result = []
+    for update_id in range(1, max(updates, users) + 1):
+        # The first users updates bring every user in once
+        user_id = FIRST_USER_ID + (update_id - 1 if update_id <= users else rng.randrange(users))
+        kind = "start" if user_id not in langs else rng.choices(kinds, weights)[0]
+        user = {"id": user_id, "is_bot": False, "first_name": "User"}
+        chat = {"id": user_id, "type": "private"}
+        if kind in ("start", "menu"):
+            if kind == "start":
+                text = "/start"
+                langs.setdefault(user_id, "en")
+            else:
+                text = t(langs[user_id], rng.choice(MENU_BUTTONS))
+            message = {"message_id": update_id, "date": 0, "chat": chat, "from": user, "text": text}
+            result.append({"update_id": update_id, "message": message})
+            continue
+        if kind == "language":
+            langs[user_id] = rng.choice(languages)
+            data = f"lang:{langs[user_id]}"
+        else:
+            data = SERVER_CALLBACK_PREFIX + rng.choice(server_ids)
+        prompt = {"message_id": update_id, "date": 0, "chat": chat, "text": "..."}
+        callback = {"id": str(update_id), "chat_instance": "load", "from": user, "message": prompt, "data": data}
+        result.append({"update_id": update_id, "callback_query": callback})
+    return result
+
+
+def create_storage(storage: str, tmp: Path):
+    """The user store of create_user_data_manager(), with its files in tmp."""
+    if storage == "json":
+        return UserDataManager(tmp / "users.json")
+    if storage == "journal":
+        return JournaledUserDataManager(tmp / "users.json", tmp / "users.journal")
+    if storage == "lazy":
+        return LazyUserDataManager(tmp / "users.store", legacy_json_path=None)
+    if storage == "sqlite":
+        return SQLiteUserDataManager(tmp / "users.db")
+    raise ValueError(f"Unknown storage {storage!r}")
+
+
+def written_bytes() -> Optional[int]:
+    """Bytes this process has passed to write() so far (socket sends are not counted)."""
+    try:
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values: List[float], share: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+class Recorder(BaseMiddleware):
+    """Times every handler call; count_update() counts the updates that finished."""
+
+    def __init__(self, expected: int):
+        self.seconds: Dict[str, List[float]] = defaultdict(list)
+        self.errors = 0
+        self.expected = expected
+        self.finished = 0
+        self.done = asyncio.Event()
+
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.seconds[handler_name(data)].append(time.perf_counter() - start)
+
+    async def count_update(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            self.finished += 1
+            if self.finished >= self.expected:
+                self.done.set()
+
+
+async def run(args, users: int) -> Dict[str, Any]:
+    updates = traffic(users, args.updates, args.seed)
+    random.seed(args.seed)
+    telegram = FakeTelegramServer(latency=(0.0, args.latency), error_rate=args.error_rate)
+    await telegram.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        user_data_manager = create_storage(args.storage, tmp)
+        bot = Bot(token=TOKEN, session=CachedMarkupSession(api=TelegramAPIServer.from_base(telegram.url)))
+        rate_limiter = OutboundRateLimiter() if args.rate_limit else None
+        if rate_limiter is not None:
+            bot.session.middleware(rate_limiter)
+        dp = Dispatcher()
+        provisioner = Provisioner(bot, user_data_manager, ProvisioningOutbox(tmp / "provisioning.jsonl"))
+        register_message_handlers(dp, user_data_manager, VPNLinkGenerator())
+        register_callback_query_handlers(dp, user_data_manager, VPNLinkGenerator(), provisioner)
+        register_error_handler(dp)
+        if args.throttle:
+            register_throttling_middleware(dp, UserThrottle(), user_data_manager)
+        recorder = Recorder(len(updates))
+        dp.message.middleware(recorder)
+        dp.callback_query.middleware(recorder)
+        dp.update.outer_middleware(recorder.count_update)
+        await user_data_manager.start()
+
+        logging.disable(logging.CRITICAL)
+        written = written_bytes()
+        start = time.perf_counter()
+        if args.mode == "polling":
+            telegram.push_updates(updates)
+            polling = asyncio.create_task(dp.start_polling(bot, polling_timeout=1, handle_signals=False, close_bot_session=False))
+            await recorder.done.wait()
+            elapsed = time.perf_counter() - start
+            await dp.stop_polling()
+            await polling
+        else:
+            stop = asyncio.Event()
+            pipeline = UpdatePipeline(dp, bot)
+            server = asyncio.create_task(
+                run_webhook(dp, bot, pipeline, url="http://127.0.0.1", path="/webhook", secret=SECRET, host="127.0.0.1", port=WEBHOOK_PORT, stop=stop)
+            )
+            while telegram.webhook is None:
+                await asyncio.sleep(0.01)
+            start = time.perf_counter()
+            chats = defaultdict(list)
+            for update in updates:
+                chats[(update.get("message") or update["callback_query"])["from"]["id"]].append(update)
+            async with aiohttp.ClientSession() as http:
+                async def deliver(chat_updates):
+                    for update in chat_updates:
+                        async with http.post(f"http://127.0.0.1:{WEBHOOK_PORT}/webhook", json=update, headers={SECRET_HEADER: SECRET}) as resp:
+                            assert resp.status == 200, resp.status
+
+                await asyncio.gather(*(deliver(chat_updates) for chat_updates in chats.values()))
+                await recorder.done.wait()
+            elapsed = time.perf_counter() - start
+            stop.set()
+            await server
+        await provisioner.close()
+        # Pending changes reach the disk: part of what the run wrote
+        await user_data_manager.close()
+        if written is not None:
+            written = written_bytes() - written
+        logging.disable(logging.NOTSET)
+        if rate_limiter is not None:
+            await rate_limiter.close()
+        await bot.session.close()
+    await telegram.close()
+
+    api_calls = [method for method, _, _ in telegram.calls if method not in ("getUpdates", "getMe", "setWebhook")]
+    everything = sorted(seconds for values in recorder.seconds.values() for seconds in values)
+    handlers = {}
+    for name, values in sorted(recorder.seconds.items()):
+        values.sort()
+        handlers[name] = {"count": len(values), "p50_ms": percentile(values, 0.5) * 1e3, "p99_ms": percentile(values, 0.99) * 1e3}
+    return {
+        "name": f"{args.mode} {args.storage} users={users}",
+        "users": users,
+        "updates": len(updates),
+        "seconds": elapsed,
+        "updates_per_second": len(updates) / elapsed,
+        "p50_ms": percentile(everything, 0.5) * 1e3,
+        "p99_ms": percentile(everything, 0.99) * 1e3,
+        "handlers": handlers,
+        "storage_bytes_written": written,
+        "api_calls": len(api_calls),
+        "api_errors": telegram.flood_errors + telegram.injected_errors,
+        "handler_errors": recorder.errors,
+    }
+
+
+def report(result: Dict[str, Any]) -> None:
+    written = result["storage_bytes_written"]
+    print(
+        f"{result['name']}: {result['updates']} updates in {result['seconds']:.2f}s ({result['updates_per_second']:.0f}/s), "
+        f"handler p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+        f"storage wrote {'n/a' if written is None else f'{written / 1024:.0f} KiB'}, "
+        f"{result['api_calls']} Bot API calls, {result['api_errors']} answered 429, {result['handler_errors']} handler errors"
+    )
+    for name, stats in result["handlers"].items():
+        print(f"  {name:<40} {stats['count']:>6}  p50 {stats['p50_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", default="100,1000", help="comma-separated user counts, one run each")
+    parser.add_argument("--updates", type=int, default=3000, help="updates per run")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--storage", choices=("json", "journal", "lazy", "sqlite"), default="json")
+    parser.add_argument("--latency", type=float, default=0.005, help="max fake Bot API latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of replies answered 429")
+    parser.add_argument(
+        "--rate-limit", action="store_true", help="pace replies like main.py does (then Telegram's limits set the throughput)"
+    )
+    parser.add_argument("--throttle", action="store_true", help="throttle users like main.py does")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="print the change against the results in this JSON file")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for users in (int(n) for n in args.users.split(",")):
+        result = await run(args, users)
+        report(result)
+        results.append(result)
+    if args.output:
+        write_results(args.output, "load_test", vars(args), results)
+    if args.compare:
+        compare(load_results(args.compare), results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,209 @@
+"""
+Micro-benchmarks of the hot paths, with results as JSON.
+
+Covers UserDataManager.update_user_data and save_users_data at several
+user counts, generate_vpn_link for vmess and vless, get_translation hits
+and misses, escape_markdown_v2, every keyboard builder in app/keyboards/
+(cached ones both from the cache and built) and the filter chain of the
+handlers register_message_handlers() adds, for /start, a menu button and
+free text. Each benchmark runs enough calls to take --min-time seconds,
+--repeats times; the fastest run counts (the others were slowed by
+something else). --output saves the results, --compare prints the change
+against a saved run, e.g. of an earlier commit.
+
+Usage:
+  pipenv run python -m benchmarks.micro [--filter storage] [--users 1000,10000,100000]
+      [--repeats 5] [--min-time 0.2] [--output micro.json] [--compare previous.json]
+"""
+
+import argparse
+import asyncio
+import datetime
+import functools
+import itertools
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from aiogram import Bot, Router
+from aiogram.types import Chat, Message, User
+
+from app.data.user_data_manager import UserDataManager
+from app.data.vpn_keys import StoredKey
+from app.handlers.message_handlers import register_message_handlers
+from app.keyboards.language_keyboards import create_language_keyboard
+from app.keyboards.menu_keyboards import (
+    create_accauntim_keyboard,
+    create_key_delete_confirm_keyboard,
+    create_keys_page_keyboard,
+    create_main_menu_keyboard,
+    create_server_location_keyboard,
+)
+from app.services.servers import all_servers
+from app.services.vpn_link_generator import VPNLinkGenerator
+from app.utils.i18n import get_translation as t
+from app.utils.rendering import escape_markdown_v2
+from benchmarks.results import compare, load_results, write_results
+
+USER_UUID = "00000000-0000-4000-8000-000000000000"
+
+# (name, setup); setup() prepares the benchmark and returns the callable to
+# time per call. Async callables are awaited in a loop.
+Benchmark = Tuple[str, Callable[[], Callable[[], Any]]]
+
+
+def storage_benchmarks(tmp: Path, users: int, loop: asyncio.AbstractEventLoop, opened: List[UserDataManager]) -> Iterator[Benchmark]:
+    @functools.lru_cache(maxsize=None)
+    def populated() -> UserDataManager:
+        # Write-behind as configured by default, so that updates only mark
+        # users dirty; the flush task never flushes while measuring
+        user_data_manager = UserDataManager(tmp / f"users-{users}.json", write_behind=True, flush_interval=3600, flush_threshold=10**9)
+        loop.run_until_complete(user_data_manager.start())
+        opened.append(user_data_manager)
+        servers = all_servers()
+        for i in range(users):
+            keys = [StoredKey.new(server.id, server.protocol) for server in (servers[i % len(servers)], servers[(i + 1) % len(servers)])]
+            user_data_manager.update_user_data(str(1000 + i), {"lang": "en", "keys": keys})
+        return user_data_manager
+
+    def update_user_data() -> Callable[[], Any]:
+        user_data_manager = populated()
+        user_ids = itertools.cycle([str(1000 + i) for i in range(users)])
+        langs = itertools.cycle(("ru", "uz", "en"))
+        return lambda: user_data_manager.update_user_data(next(user_ids), {"lang": next(langs)})
+
+    yield f"storage.update_user_data[{users} users]", update_user_data
+    yield f"storage.save_users_data[{users} users]", lambda: populated().save_users_data
+
+
+def link_benchmarks() -> Iterator[Benchmark]:
+    generator = VPNLinkGenerator()
+    for protocol in ("vmess", "vless"):
+        server = next(server for server in all_servers() if server.protocol == protocol)
+        arguments = (server.protocol, server.address, server.port)
+        keywords = dict(security=server.security, network=server.network, user_uuid=USER_UUID, **dict(server.params))
+        yield f"links.generate_vpn_link[{protocol}]", lambda: functools.partial(generator.generate_vpn_link, *arguments, **keywords)
+
+
+def text_benchmarks() -> Iterator[Benchmark]:
+    yield "i18n.get_translation[hit]", lambda: functools.partial(t, "ru", "main_menu_button_tariflar")
+    yield "i18n.get_translation[miss]", lambda: functools.partial(t, "ru", "no_such_key", "default")
+    yield "i18n.get_translation[unknown language]", lambda: functools.partial(t, "xx", "main_menu_button_tariflar")
+    referral = t("en", "referral_bonus_info")
+    yield "rendering.escape_markdown_v2[translation]", lambda: functools.partial(escape_markdown_v2, referral)
+    link = VPNLinkGenerator().generate_vpn_link("vless", "example.com", 443, network="ws", path="/ws", user_uuid=USER_UUID)
+    yield "rendering.escape_markdown_v2[link]", lambda: functools.partial(escape_markdown_v2, link)
+
+
+def keyboard_benchmarks() -> Iterator[Benchmark]:
+    for builder in (create_main_menu_keyboard, create_server_location_keyboard, create_accauntim_keyboard, create_language_keyboard):
+        name = builder.__name__
+        yield f"keyboards.{name}[cached]", lambda builder=builder: functools.partial(builder, "ru")
+        yield f"keyboards.{name}[built]", lambda builder=builder: functools.partial(builder.__wrapped__, "ru")
+    key_ids = [(number, f"{number:032x}") for number in range(1, 6)]
+    yield "keyboards.create_keys_page_keyboard[5 keys]", lambda: functools.partial(create_keys_page_keyboard, "ru", 1, 3, key_ids)
+    yield "keyboards.create_key_delete_confirm_keyboard", lambda: functools.partial(
+        create_key_delete_confirm_keyboard, "ru", 1, 3, key_ids[2][1]
+    )
+
+
+def filter_benchmarks(tmp: Path) -> Iterator[Benchmark]:
+    @functools.lru_cache(maxsize=None)
+    def message_handlers() -> List[Any]:
+        router = Router()
+        register_message_handlers(router, UserDataManager(tmp / "filters.json"), VPNLinkGenerator())
+        return router.message.handlers
+
+    bot = Bot("123456:TEST")
+    user = User(id=42, is_bot=False, first_name="User")
+    chat = Chat(id=42, type="private")
+
+    def first_match(text: str) -> Callable[[], Any]:
+        handlers = message_handlers()
+        event = Message(message_id=1, date=datetime.datetime.now(), chat=chat, from_user=user, text=text)
+
+        async def match() -> Any:
+            # What TelegramEventObserver.trigger() does before calling a handler
+            for handler in handlers:
+                matched, _ = await handler.check(event, bot=bot, handler=handler)
+                if matched:
+                    return handler
+            return None
+
+        return match
+
+    for name, text in (("/start", "/start"), ("menu button", t("uz", "main_menu_button_accauntim")), ("free text", "hello")):
+        yield f"filters.message[{name}]", lambda text=text: first_match(text)
+
+
+def measure(func: Callable[[], Any], repeats: int, min_time: float, loop: asyncio.AbstractEventLoop) -> float:
+    """Seconds per call, from the fastest of repeats runs."""
+    result = func()
+    is_async = asyncio.iscoroutine(result)
+    if is_async:
+        loop.run_until_complete(result)
+
+    async def run_async(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await func()
+        return time.perf_counter() - start
+
+    def run(number: int) -> float:
+        if is_async:
+            return loop.run_until_complete(run_async(number))
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - start
+
+    number = 1
+    elapsed = run(number)
+    while elapsed < min_time:
+        # Straight to about min_time once a run is long enough to extrapolate
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.1)) if elapsed > min_time / 100 else number * 10
+        elapsed = run(number)
+    best = elapsed
+    for _ in range(repeats - 1):
+        best = min(best, run(number))
+    return best / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="run only the benchmarks whose name contains this")
+    parser.add_argument("--users", default="1000,10000,100000", help="user counts of the storage benchmarks")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per run")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="print the change against the results in this JSON file")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    loop = asyncio.new_event_loop()
+    results: List[Dict[str, Any]] = []
+    opened: List[UserDataManager] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        benchmarks = [benchmark for users in args.users.split(",") for benchmark in storage_benchmarks(tmp, int(users), loop, opened)]
+        benchmarks += [*link_benchmarks(), *text_benchmarks(), *keyboard_benchmarks(), *filter_benchmarks(tmp)]
+        for name, setup in benchmarks:
+            # Set up only when selected: --filter skips the costly setups of the others
+            if args.filter not in name:
+                continue
+            seconds = measure(setup(), args.repeats, args.min_time, loop)
+            print(f"{name:<56} {seconds * 1e6:12.3f} us per call")
+            results.append({"name": name, "us_per_call": seconds * 1e6})
+        for user_data_manager in opened:
+            loop.run_until_complete(user_data_manager.close())
+    loop.close()
+    if args.output:
+        write_results(args.output, "micro", vars(args), results)
+    if args.compare:
+        compare(load_results(args.compare), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+End-to-end key provisioning against a local fake control plane.
+
+Every user gets a new key on one of three servers with a management API
+(plus one server without, whose keys are active at once). The control plane
+fails some requests before and some after applying them, and refuses the
+keys of a few users. Halfway through, the provisioner is stopped as on
+shutdown and a new one continues from the outbox; afterwards some keys are
+revoked. Checks that exactly the accepted, unrevoked keys are registered
+and stored, that users whose key outlasted the confirmation wait got one
+message about it, and reports throughput and batching.
+
+Usage:
+  pipenv run python -m benchmarks.provisioning_e2e [--users 2000] [--error-rate 0.2]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.data.user_data_manager import UserDataManager
+from app.data.vpn_keys import StoredKey
+from app.services.bot_session import CachedMarkupSession
+from app.services.provisioning import Provisioner, ProvisioningError, ProvisioningOutbox
+from app.services.servers import build_server, set_servers
+from benchmarks.fake_control_plane import FakeControlPlane
+from benchmarks.fake_telegram import FakeTelegramServer
+
+NODES = ["alpha", "beta", "gamma"]
+
+
+async def wait_for(condition, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("condition not reached")
+        await asyncio.sleep(0.02)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--error-rate", type=float, default=0.2, help="share of requests failed before applying")
+    parser.add_argument("--lost-rate", type=float, default=0.1, help="share of requests failed after applying")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+    # Requests cut off by the first provisioner's shutdown
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+    random.seed(1)
+
+    control = FakeControlPlane(latency=(0.005, 0.02), error_rate=args.error_rate, lost_response_rate=args.lost_rate, token="secret")
+    telegram = FakeTelegramServer()
+    await control.start()
+    await telegram.start()
+    servers = [
+        build_server(node, {"address": f"{node}.example.com", "port": 443, "api_url": control.api_url(node), "api_token": "secret"})
+        for node in NODES
+    ]
+    servers.append(build_server("direct", {"address": "direct.example.com", "port": 443}))
+    set_servers(servers)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        users = UserDataManager(Path(tmp) / "users.json")
+        await users.start()
+        outbox_path = Path(tmp) / "provisioning.jsonl"
+        bot = Bot(token="123456:TEST", session=CachedMarkupSession(api=TelegramAPIServer.from_base(telegram.url)))
+        settings = dict(batch_size=25, batch_interval=0.05, max_backoff=0.5, confirm_timeout=2.0)
+
+        user_ids = [str(100_000 + n) for n in range(args.users)]
+        control.rejected_users = set(user_ids[::97])
+        keys = {user_id: StoredKey.new(random.choice(servers).id, "vless") for user_id in user_ids}
+        results = {}
+
+        async def create(provisioner, user_id):
+            try:
+                results[user_id] = await provisioner.provision(user_id, keys[user_id])
+            except ProvisioningError:
+                results[user_id] = "refused"
+
+        start = time.perf_counter()
+        first = Provisioner(bot, users, ProvisioningOutbox(outbox_path), **settings)
+        first.start()
+        tasks = [asyncio.create_task(create(first, user_id)) for user_id in user_ids]
+        await wait_for(lambda: first.counts["active"] + first.counts["rejected"] >= args.users // 2)
+        await first.close()
+        stopped_at = first.counts["active"]
+        await asyncio.gather(*tasks)
+        left_pending = len(ProvisioningOutbox(outbox_path).pending)
+
+        second = Provisioner(bot, users, ProvisioningOutbox(outbox_path), **settings)
+        second.start()
+        await wait_for(lambda: not second.outbox.pending)
+        elapsed = time.perf_counter() - start
+
+        # Servers without a management API refuse nothing
+        refused_users = {user_id for user_id in control.rejected_users if keys[user_id].server != "direct"}
+        revoked = [user_id for user_id in user_ids[::10] if user_id not in refused_users]
+        for user_id in revoked:
+            assert await second.revoke(user_id, keys[user_id])
+        await wait_for(lambda: not second.outbox.pending)
+        await second.close()
+
+        registered = {key_id: email for node in NODES for key_id, email in control.users[node].items()}
+        wrong = 0
+        for user_id in user_ids:
+            key = keys[user_id]
+            expected = user_id not in refused_users and user_id not in revoked
+            stored = [k for k in users.get_user_data(user_id).get("keys") or [] if k.uuid == key.uuid]
+            on_server = key.uuid_str in registered if key.server != "direct" else expected
+            wrong += len(stored) != expected or on_server != expected
+        messaged = Counter(params["chat_id"] for params in telegram.calls_to("sendMessage"))
+        late = [user_id for user_id, result in results.items() if result is False]
+        bad_notifications = sum(messaged[user_id] != 1 for user_id in late) + sum(
+            messaged[user_id] for user_id, result in results.items() if result is not False
+        )
+        batches = [adds + removes for _, adds, removes in control.batches]
+
+        print(f"stopped after {stopped_at} activations with {left_pending} entries pending, resumed")
+        print(
+            f"{args.users} keys: {sum(r is True for r in results.values())} confirmed in time, {len(late)} later, "
+            f"{sum(r == 'refused' for r in results.values())} refused; {len(revoked)} revoked"
+        )
+        print(f"{wrong} keys in the wrong state, {bad_notifications} missing or extra notifications")
+        print(
+            f"{control.requests} requests ({control.errors} failed, {control.replayed} answered from the idempotency cache), "
+            f"{len(batches)} batches applied, {sum(batches) / len(batches):.1f} changes per batch"
+        )
+        print(f"{args.users / elapsed:.0f} keys/s provisioned; retries {first.counts['retries'] + second.counts['retries']}")
+        print("OK" if wrong == 0 and bad_notifications == 0 else "FAILED")
+        await users.close()
+        await bot.session.close()
+    await telegram.close()
+    await control.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
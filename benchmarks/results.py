@@ -0,0 +1,75 @@
+"""
+Benchmark results as JSON files, comparable across commits.
+
+A results file records the benchmark, its arguments, the commit and
+machine it ran on, and a list of result entries, each a dict with a
+unique "name" and numeric metrics (nested dicts allowed). compare() lines
+up the entries of two runs by name and prints the change of every metric
+both have.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    """Where the results come from; a commit with uncommitted changes ends in "+dirty"."""
+    commit = _git("rev-parse", "--short", "HEAD")
+    if commit and _git("status", "--porcelain", "--untracked-files=no"):
+        commit += "+dirty"
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(path: str, benchmark: str, args: Dict[str, Any], results: List[Dict[str, Any]]) -> None:
+    document = {"benchmark": benchmark, "environment": environment(), "args": args, "results": results}
+    Path(path).write_text(json.dumps(document, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def _metrics(entry: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in entry.items():
+        if isinstance(value, dict):
+            yield from _metrics(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(previous: Dict[str, Any], results: List[Dict[str, Any]], file=sys.stdout) -> None:
+    """Prints every metric of results next to the same one in a previous results document."""
+    before = {entry["name"]: dict(_metrics(entry)) for entry in previous["results"]}
+    print(f"compared with {previous['environment'].get('commit')} ({previous['environment'].get('time')}):", file=file)
+    for entry in results:
+        old = before.get(entry["name"])
+        if old is None:
+            print(f"  {entry['name']}: not in the previous run", file=file)
+            continue
+        print(f"  {entry['name']}:", file=file)
+        for metric, value in _metrics(entry):
+            if metric not in old:
+                continue
+            change = f"{(value - old[metric]) / old[metric]:+.1%}" if old[metric] else "n/a"
+            print(f"    {metric:<56} {old[metric]:>12.4g} -> {value:<12.4g} {change}", file=file)
@@ -0,0 +1,78 @@
+"""
+Stress check for per-user transactions.
+
+Fires thousands of concurrent simulated server-selection callbacks, each
+appending a key inside user_data_manager.transaction() with awaits in the
+middle to force interleaving, then verifies that no update was lost. The
+same load is timed behind a single global lock for comparison.
+
+Usage:
+  pipenv run python -m benchmarks.stress_transactions [--callbacks 20000] [--users 500]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from app.data.user_data_manager import UserDataManager
+from app.data.vpn_keys import StoredKey
+
+# Simulated I/O inside the critical section (e.g. a storage round trip).
+IO_DELAY = 0.001
+
+
+async def callback(manager: UserDataManager, user_id: str) -> None:
+    async with manager.transaction(user_id) as user_data:
+        await asyncio.sleep(0)
+        keys = user_data.get("keys") or []
+        await asyncio.sleep(IO_DELAY)
+        user_data["keys"] = keys + [StoredKey.new("russia", "vmess")]
+
+
+async def callback_global_lock(manager: UserDataManager, lock: asyncio.Lock, user_id: str) -> None:
+    async with lock:
+        user_data = manager.get_user_data(user_id)
+        await asyncio.sleep(0)
+        keys = user_data.get("keys") or []
+        await asyncio.sleep(IO_DELAY)
+        manager.update_user_data(user_id, {"keys": keys + [StoredKey.new("russia", "vmess")]})
+
+
+async def run(callbacks: int, users: int, global_lock: bool) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        manager = UserDataManager(os.path.join(directory, "users.json"), flush_interval=0.5)
+        await manager.start()
+        user_ids = [str(1000 + random.randrange(users)) for _ in range(callbacks)]
+        lock = asyncio.Lock()
+        start = time.perf_counter()
+        if global_lock:
+            await asyncio.gather(*(callback_global_lock(manager, lock, user_id) for user_id in user_ids))
+        else:
+            await asyncio.gather(*(callback(manager, user_id) for user_id in user_ids))
+        elapsed = time.perf_counter() - start
+        await manager.close()
+
+        expected = {user_id: user_ids.count(user_id) for user_id in set(user_ids)}
+        reloaded = UserDataManager(os.path.join(directory, "users.json"))
+        lost = sum(expected[u] - len(reloaded.get_user_data(u).get("keys", [])) for u in expected)
+        assert lost == 0, f"{lost} updates lost"
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--callbacks", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=500)
+    args = parser.parse_args()
+
+    striped = asyncio.run(run(args.callbacks, args.users, global_lock=False))
+    print(f"per-user transactions: {args.callbacks} callbacks in {striped:.2f}s, no lost updates")
+    serialized = asyncio.run(run(args.callbacks // 10, args.users, global_lock=True))
+    print(f"global lock:           {args.callbacks // 10} callbacks in {serialized:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
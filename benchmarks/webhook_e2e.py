@@ -0,0 +1,146 @@
+"""
+End-to-end check of webhook mode against a local fake Telegram server.
+
+Starts benchmarks.fake_telegram, runs the real handlers behind run_webhook()
+and posts updates the way Telegram does: many chats at once, each chat's
+updates one after another. Every chat sends the same script, which switches
+language between button presses, so any reordering inside a chat changes the
+replies. The replies of every chat are compared with a single-chat run, and
+throughput is reported for each worker count.
+
+Usage:
+  pipenv run python -m benchmarks.webhook_e2e [--chats 200] [--workers 1,16] [--latency 0.005]
+"""
+
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.data.user_data_manager import UserDataManager
+from app.handlers.callback_query_handlers import register_callback_query_handlers
+from app.handlers.error_handlers import register_error_handler
+from app.handlers.message_handlers import register_message_handlers
+from app.services.bot_session import CachedMarkupSession
+from app.services.provisioning import Provisioner, ProvisioningOutbox
+from app.services.update_pipeline import UpdatePipeline
+from app.services.vpn_link_generator import VPNLinkGenerator
+from app.services.webhook import SECRET_HEADER, run_webhook
+from app.utils.i18n import get_translation as t
+from benchmarks.fake_telegram import FakeTelegramServer
+
+TOKEN = "123456:TEST"
+SECRET = "e2e-secret"
+WEBHOOK_PORT = 8082
+
+
+def chat_script(chat_id, first_update_id):
+    """The updates one chat sends, in order."""
+    user = {"id": chat_id, "is_bot": False, "first_name": "User"}
+    chat = {"id": chat_id, "type": "private"}
+    update_id = first_update_id
+
+    def message(text):
+        nonlocal update_id
+        update_id += 1
+        return {"update_id": update_id, "message": {"message_id": update_id, "date": 0, "chat": chat, "from": user, "text": text}}
+
+    def callback(data):
+        nonlocal update_id
+        update_id += 1
+        prompt = {"message_id": update_id, "date": 0, "chat": chat, "text": "..."}
+        return {"update_id": update_id, "callback_query": {"id": str(update_id), "chat_instance": "e2e", "from": user, "message": prompt, "data": data}}
+
+    return [
+        message("/start"),
+        callback("lang:ru"),
+        message(t("en", "main_menu_button_tariflar")),
+        message(t("en", "main_menu_button_yordam")),
+        callback("lang:uz"),
+        message(t("en", "main_menu_button_accauntim")),
+        callback("lang:en"),
+        message(t("uz", "main_menu_button_korsatmalar")),
+    ]
+
+
+async def run(chats, workers, latency, queue_size):
+    telegram = FakeTelegramServer(latency=(0.0, latency))
+    await telegram.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        user_data_manager = UserDataManager(Path(tmp) / "users.json")
+        bot = Bot(token=TOKEN, session=CachedMarkupSession(api=TelegramAPIServer.from_base(telegram.url)))
+        dp = Dispatcher()
+        register_message_handlers(dp, user_data_manager, VPNLinkGenerator())
+        provisioner = Provisioner(bot, user_data_manager, ProvisioningOutbox(Path(tmp) / "provisioning.jsonl"))
+        register_callback_query_handlers(dp, user_data_manager, VPNLinkGenerator(), provisioner)
+        register_error_handler(dp)
+        pipeline = UpdatePipeline(dp, bot, workers=workers, queue_size=queue_size)
+        stop = asyncio.Event()
+        await user_data_manager.start()
+        server = asyncio.create_task(
+            run_webhook(dp, bot, pipeline, url="http://127.0.0.1", path="/webhook", secret=SECRET, host="127.0.0.1", port=WEBHOOK_PORT, stop=stop)
+        )
+        while telegram.webhook is None:
+            await asyncio.sleep(0.01)
+
+        scripts = [chat_script(1000 + n, n * 100) for n in range(chats)]
+        headers = {SECRET_HEADER: SECRET}
+        max_in_flight = 0
+        async with aiohttp.ClientSession() as http:
+            async def deliver(script):
+                nonlocal max_in_flight
+                for update in script:
+                    async with http.post(f"http://127.0.0.1:{WEBHOOK_PORT}/webhook", json=update, headers=headers) as resp:
+                        assert resp.status == 200, resp.status
+                    max_in_flight = max(max_in_flight, pipeline.in_flight)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(deliver(script) for script in scripts))
+            await pipeline.wait_idle()
+            elapsed = time.perf_counter() - start
+
+        stop.set()
+        await server
+        await user_data_manager.close()
+        await bot.session.close()
+    await telegram.close()
+
+    replies = defaultdict(list)
+    for method, params, _ in telegram.calls:
+        if "chat_id" in params:
+            chat_id = params["chat_id"]
+            # Account info quotes the user id; mask it so chats can be compared
+            replies[int(chat_id)].append((method, params.get("text", "").replace(chat_id, "<id>")))
+    return replies, elapsed, max_in_flight
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--workers", default="1,16")
+    parser.add_argument("--latency", type=float, default=0.005, help="max fake Bot API latency, seconds")
+    parser.add_argument("--queue-size", type=int, default=1000)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    reference, _, _ = await run(1, 1, args.latency, args.queue_size)
+    expected = reference[1000]
+    updates = args.chats * len(chat_script(0, 0))
+    for workers in (int(n) for n in args.workers.split(",")):
+        replies, elapsed, max_in_flight = await run(args.chats, workers, args.latency, args.queue_size)
+        in_order = all(replies[1000 + n] == expected for n in range(args.chats))
+        print(
+            f"workers={workers:<3} {updates} updates in {elapsed:6.2f}s ({updates / elapsed:7.0f}/s), "
+            f"max queued {max_in_flight}, per-chat order {'OK' if in_order else 'BROKEN'}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
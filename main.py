@@ -3,46 +3,134 @@ import logging
 from aiogram import Bot, Dispatcher
 
 # Import configurations
-from app.config import BOT_TOKEN, logger
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+from app.config import (
+    BOT_MODE,
+    BOT_TOKEN,
+    DROP_PENDING_UPDATES,
+    HEALTH_CHECK_INTERVAL,
+    I18N_RELOAD_INTERVAL,
+    METRICS_PORT,
+    SERVERS_RELOAD_INTERVAL,
+    OUTBOUND_RATE_LIMIT,
+    TELEGRAM_API_URL,
+    THROTTLE_ENABLED,
+    logger,
+)
 
 # Import managers and services
-from app.data.user_data_manager import UserDataManager
+from app.services.bot_session import CachedMarkupSession
+from app.services.broadcast import Broadcaster
+from app.services.health import health_monitor
+from app.services.metrics import LINK_METHODS, LINKS, STORAGE, STORAGE_METHODS, ApiMetrics, instrument, metrics, serve_metrics
+from app.services.outbound import OutboundRateLimiter
+from app.services.provisioning import Provisioner
+from app.services.servers import watch_servers
+from app.services.throttling import UserThrottle
+from app.data.storage import create_user_data_manager
+from app.services.update_pipeline import UpdatePipeline
 from app.services.vpn_link_generator import VPNLinkGenerator
+from app.services.webhook import run_webhook
+from app.utils.i18n import log_missing_keys, watch_locales
+from app.utils.logging_setup import configure_logging
 
 # Import handler registration functions
+from app.handlers.admin_handlers import register_admin_handlers
 from app.handlers.message_handlers import register_message_handlers
 from app.handlers.callback_query_handlers import register_callback_query_handlers
 from app.handlers.error_handlers import register_error_handler
+from app.handlers.key_pages import key_pages
+from app.handlers.middlewares import (
+    register_log_context_middleware,
+    register_metrics_middleware,
+    register_throttling_middleware,
+)
 
+# Text or JSON lines, written by a background thread (see LOG_FORMAT, LOG_ASYNC)
+log_listener = configure_logging()
 logger.info("Starting bot initialization...")
 
 # Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN)
+api = TelegramAPIServer.from_base(TELEGRAM_API_URL) if TELEGRAM_API_URL else PRODUCTION
+bot = Bot(token=BOT_TOKEN, session=CachedMarkupSession(api=api))
+# Times every Bot API call; registered first so that rate limiter waits count
+bot.session.middleware(ApiMetrics(metrics))
+# Every message the handlers send is paced to Telegram's flood limits
+rate_limiter = OutboundRateLimiter() if OUTBOUND_RATE_LIMIT else None
+if rate_limiter is not None:
+    bot.session.middleware(rate_limiter)
 dp = Dispatcher()
 
 # Initialize managers and services
-user_data_manager = UserDataManager()
-vpn_link_generator = VPNLinkGenerator()
+# Their calls count as storage and link generation time of the update being handled
+user_data_manager = instrument(create_user_data_manager(), STORAGE, STORAGE_METHODS)
+vpn_link_generator = instrument(VPNLinkGenerator(), LINKS, LINK_METHODS)
+instrument(key_pages.vpn_link_generator, LINKS, LINK_METHODS)
+broadcaster = Broadcaster(bot, user_data_manager)
+provisioner = Provisioner(bot, user_data_manager)
 
 # Register handlers
-register_message_handlers(dp, user_data_manager)
-register_callback_query_handlers(dp, user_data_manager, vpn_link_generator)
+register_admin_handlers(dp, broadcaster)
+register_message_handlers(dp, user_data_manager, vpn_link_generator)
+register_callback_query_handlers(dp, user_data_manager, vpn_link_generator, provisioner)
 register_error_handler(dp)
+# Per-user limits; first, so that throttled updates skip the other middlewares
+user_throttle = UserThrottle() if THROTTLE_ENABLED else None
+if user_throttle is not None:
+    register_throttling_middleware(dp, user_throttle, user_data_manager)
+register_metrics_middleware(dp, metrics)
+register_log_context_middleware(dp)
 
 logger.info("Bot and Dispatcher initialized, handlers registered.")
 
 async def main():
     logger.info("Bot is starting...")
-    # No need to explicitly load users_data here, UserDataManager does it on instantiation
-    # Ensure bot is ready and polling for updates
-    await dp.start_polling(bot, skip_updates=True)
-    logger.info("Bot is ready and polling for updates.")
-
-    # Keep the bot running until interrupted
+    # The user store loads on instantiation; start() only launches background
+    # work such as the write-behind flusher.
+    await user_data_manager.start()
+    # A broadcast interrupted by the last shutdown continues where it stopped
+    broadcaster.resume_pending()
+    # Keys left in the provisioning outbox by the last run are pushed again
+    provisioner.start()
+    # Picks up edited locale files without a restart
+    locale_watcher = asyncio.create_task(watch_locales()) if I18N_RELOAD_INTERVAL > 0 else None
+    # ... and an edited servers file
+    servers_watcher = asyncio.create_task(watch_servers()) if SERVERS_RELOAD_INTERVAL > 0 else None
+    # Dead servers drop out of the server keyboard
+    if HEALTH_CHECK_INTERVAL > 0:
+        health_monitor.start()
+    metrics_runner = await serve_metrics(metrics) if METRICS_PORT > 0 else None
     try:
-        await asyncio.Event().wait()
+        # Blocks until the bot is stopped
+        if BOT_MODE == "webhook":
+            logger.info("Bot is ready and receiving updates via webhook.")
+            await run_webhook(dp, bot, UpdatePipeline(dp, bot))
+        elif BOT_MODE == "polling":
+            logger.info("Bot is ready and polling for updates.")
+            # getUpdates is refused while a webhook is set (e.g. after running in webhook mode)
+            await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+            await dp.start_polling(bot)
+        else:
+            raise ValueError(f"Unknown BOT_MODE '{BOT_MODE}', expected 'polling' or 'webhook'.")
     finally:
         logger.info("Bot is shutting down.")
+        for watcher in (locale_watcher, servers_watcher):
+            if watcher is not None:
+                watcher.cancel()
+        log_missing_keys()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await health_monitor.close()
+        # Stops sending; an unfinished broadcast resumes on the next start
+        await broadcaster.close()
+        await provisioner.close()
+        # Guarantee that pending user changes reach the disk
+        await user_data_manager.close()
+        if rate_limiter is not None:
+            await rate_limiter.close()
+        if user_throttle is not None:
+            logger.info("User throttle stats: %s", user_throttle.stats())
         await bot.session.close()
 
 
@@ -52,4 +140,8 @@ if __name__ == "__main__":
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped manually.")
     except Exception as e:
-        logger.error(f"Unexpected error occurred: {e}", exc_info=True)
\ No newline at end of file
+        logger.error("Unexpected error occurred: %s", e, exc_info=True)
+    finally:
+        # Writes the records still queued
+        if log_listener is not None:
+            log_listener.stop()
\ No newline at end of file